@@ -0,0 +1,358 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Asynchronous load generator measuring the sustainable tile rate of an inline algorithm.
+
+It drives start/image-tile/end sequences for one or more simulated scanners against the
+algorithm, and runs a local stand-in for the scanner's result endpoints on port 8001 to
+match every result with the tile it belongs to.
+'''
+import os
+import math
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+import numpy as np
+from PIL import Image
+import aiohttp
+from aiohttp import web
+
+TILE_WIDTH = 1912
+TILE_HEIGHT = 1192
+
+
+class ResultSink:
+    '''
+    A local stand-in for the scanner's /v1/tile-results, /v1/tile-results/batch and
+    /v1/algorithm-completed endpoints, recording when every result arrives.
+
+    :param str host: The host to bind to.
+    :param int port: The port the algorithm posts its results to.
+    '''
+
+    def __init__(self, host="0.0.0.0", port=8001):
+        self.host = host
+        self.port = port
+        self.result_times = {} # Arrival time of the results, by (slide_name, tile_name).
+        self.completed_times = {} # Arrival time of algorithm-completed, by slide_name.
+        self.__completed_events = {}
+        self.__runner = None
+
+    async def start(self):
+        '''
+        Starts serving the result endpoints.
+        '''
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/v1/tile-results", self.tile_results)
+        app.router.add_post("/v1/tile-results/batch", self.tile_results_batch)
+        app.router.add_post("/v1/algorithm-completed", self.algorithm_completed)
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        await web.TCPSite(self.__runner, self.host, self.port).start()
+
+    async def stop(self):
+        '''
+        Stops serving the result endpoints.
+        '''
+        await self.__runner.cleanup()
+
+    async def tile_results(self, request):
+        '''
+        Records the arrival of the results of a tile.
+        '''
+        received_time = time.perf_counter()
+        message = await request.json()
+        self.result_times[(message["slide_name"], message["tile_name"])] = received_time
+        return web.Response(status=204)
+
+    async def tile_results_batch(self, request):
+        '''
+        Records the arrival of a batch of tile results.
+        '''
+        received_time = time.perf_counter()
+        for message in await request.json():
+            self.result_times[(message["slide_name"], message["tile_name"])] = received_time
+        return web.Response(status=204)
+
+    async def algorithm_completed(self, request):
+        '''
+        Records the arrival of the algorithm-completed message of a slide.
+        '''
+        received_time = time.perf_counter()
+        message = await request.json()
+        self.completed_times[message["slide_name"]] = received_time
+        self.completed_event(message["slide_name"]).set()
+        return web.Response(status=204)
+
+    def completed_event(self, slide_name):
+        '''
+        :param str slide_name: The name of the slide.
+
+        :return: The event set when the algorithm-completed message of the slide arrives.
+        :rtype: asyncio.Event
+        '''
+        if slide_name not in self.__completed_events:
+            self.__completed_events[slide_name] = asyncio.Event()
+        return self.__completed_events[slide_name]
+
+
+class SimulatedScanner:
+    '''
+    Sends the start/image-tile/end sequence of one slide to the algorithm.
+
+    :param aiohttp.ClientSession session: The pooled HTTP session.
+    :param str api_url: The base URL of the algorithm.
+    :param str slide_name: The name of the simulated slide.
+    :param str tile_image_path: The tile image every tile message points to.
+    :param int num_tiles: The number of tiles of the slide.
+    :param float rate: The mean tile arrival rate in tiles per second, or 0 for as fast as
+        the concurrency allows.
+    :param bool poisson: Whether tile arrivals are Poisson distributed instead of evenly
+        spaced.
+    :param asyncio.Semaphore semaphore: Limits the number of requests in flight.
+    '''
+
+    def __init__(
+        self,
+        session,
+        api_url,
+        slide_name,
+        tile_image_path,
+        num_tiles,
+        rate,
+        poisson,
+        semaphore,
+    ):
+        self.session = session
+        self.api_url = api_url
+        self.slide_name = slide_name
+        self.tile_image_path = tile_image_path
+        self.num_tiles = num_tiles
+        self.rate = rate
+        self.poisson = poisson
+        self.semaphore = semaphore
+        self.send_times = {} # Time every tile was sent, by tile_name.
+        self.status_codes = Counter()
+        self.tiles_started = None
+        self.tiles_finished = None
+        self.end_time = None
+
+    async def run(self, algorithm_id):
+        '''
+        Runs the scan: start, every tile at the configured rate, then end.
+
+        :param str algorithm_id: The algorithm_id sent in /v1/scan/start.
+        '''
+        start_payload = {
+            "algorithm_id": algorithm_id,
+            "slide_name": self.slide_name,
+            "stain_name": "benchmark",
+            "organ_name": "benchmark",
+            "tile_width": TILE_WIDTH,
+            "tile_height": TILE_HEIGHT,
+            "path_to_output": "benchmark",
+        }
+        async with self.session.put(self.api_url + "/v1/scan/start", json=start_payload) as res:
+            self.status_codes[f"start {res.status}"] += 1
+
+        columns = max(1, int(math.sqrt(self.num_tiles)))
+        tasks = []
+        self.tiles_started = time.perf_counter()
+        next_time = self.tiles_started
+        for index in range(self.num_tiles):
+            if self.rate > 0:
+                interval = 1 / self.rate
+                next_time += random.expovariate(self.rate) if self.poisson else interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            row_idx, col_idx = divmod(index, columns)
+            await self.semaphore.acquire()
+            tasks.append(asyncio.create_task(self.send_tile(row_idx, col_idx)))
+        await asyncio.gather(*tasks)
+        self.tiles_finished = time.perf_counter()
+
+        async with self.session.put(
+            self.api_url + "/v1/scan/end", json={"slide_name": self.slide_name}
+        ) as res:
+            self.status_codes[f"end {res.status}"] += 1
+        self.end_time = time.perf_counter()
+
+    async def send_tile(self, row_idx, col_idx):
+        '''
+        Posts one tile message, releasing the concurrency semaphore when done.
+
+        :param int row_idx: The row index of the tile.
+        :param int col_idx: The column index of the tile.
+        '''
+        tile_name = f"tile_{row_idx}_{col_idx}.bmp"
+        payload = {
+            "slide_name": self.slide_name,
+            "tile_name": tile_name,
+            "tile_image_path": self.tile_image_path,
+            "row_idx": row_idx,
+            "col_idx": col_idx,
+        }
+        try:
+            self.send_times[tile_name] = time.perf_counter()
+            async with self.session.post(
+                self.api_url + "/v1/scan/image-tile", json=payload
+            ) as res:
+                self.status_codes[f"image-tile {res.status}"] += 1
+        except aiohttp.ClientError as e:
+            self.status_codes[f"image-tile {type(e).__name__}"] += 1
+        finally:
+            self.semaphore.release()
+
+
+def percentiles(values, quantiles=(50, 90, 99)):
+    '''
+    :param list values: The samples.
+    :param tuple quantiles: The percentiles to compute.
+
+    :return: The requested percentiles and the maximum, by name.
+    :rtype: dict
+    '''
+    if not values:
+        return {}
+    array = np.asarray(values)
+    report = {f"p{quantile}": float(np.percentile(array, quantile)) for quantile in quantiles}
+    report["max"] = float(array.max())
+    return report
+
+
+def report(scanners, sink):
+    '''
+    Prints the ingest rate, the end-to-end tile latency percentiles and the time from
+    scan end to algorithm-completed.
+
+    :param list scanners: The SimulatedScanner of every slide.
+    :param ResultSink sink: The result sink.
+    '''
+    status_codes = Counter()
+    latencies = []
+    tiles = 0
+    for scanner in scanners:
+        status_codes.update(scanner.status_codes)
+        tiles += len(scanner.send_times)
+        for tile_name, send_time in scanner.send_times.items():
+            received_time = sink.result_times.get((scanner.slide_name, tile_name))
+            if received_time is not None:
+                latencies.append(received_time - send_time)
+    ingest_start = min(scanner.tiles_started for scanner in scanners)
+    ingest_end = max(scanner.tiles_finished for scanner in scanners)
+
+    print(f"Tiles sent                : {tiles}")
+    print(f"Responses                 : {dict(sorted(status_codes.items()))}")
+    print(f"Ingest rate               : {tiles / (ingest_end - ingest_start):.1f} tiles/s")
+    print(f"Tiles with results        : {len(latencies)}")
+    for name, value in percentiles(latencies).items():
+        print(f"Tile latency {name:<13}: {value * 1000:.1f} ms")
+    for scanner in scanners:
+        completed_time = sink.completed_times.get(scanner.slide_name)
+        if completed_time is None:
+            print(f"{scanner.slide_name}: algorithm-completed not received")
+        else:
+            print(
+                f"{scanner.slide_name}: scan end to algorithm-completed "
+                f"{(completed_time - scanner.end_time) * 1000:.1f} ms"
+            )
+
+
+async def run_benchmark(args, tile_image_path):
+    '''
+    Runs every simulated scanner concurrently and prints the report.
+
+    :param argparse.Namespace args: The command line arguments.
+    :param str tile_image_path: The tile image the tile messages point to.
+    '''
+    sink = ResultSink(port=args.sink_port)
+    await sink.start()
+    connector = aiohttp.TCPConnector(limit=args.concurrency, keepalive_timeout=60)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            semaphore = asyncio.Semaphore(args.concurrency)
+            scanners = [
+                SimulatedScanner(
+                    session,
+                    args.api_url,
+                    f"{args.slide_prefix}_{index}",
+                    tile_image_path,
+                    args.tiles,
+                    args.rate,
+                    args.poisson,
+                    semaphore,
+                )
+                for index in range(args.scanners)
+            ]
+            await asyncio.gather(*(scanner.run(args.algorithm_id) for scanner in scanners))
+            waits = [
+                asyncio.wait_for(sink.completed_event(scanner.slide_name).wait(), args.timeout)
+                for scanner in scanners
+            ]
+            results = await asyncio.gather(*waits, return_exceptions=True)
+            if any(isinstance(result, asyncio.TimeoutError) for result in results):
+                print(f"Timed out after {args.timeout}s waiting for algorithm-completed")
+            # Leave a moment for results still in flight to the sink.
+            await asyncio.sleep(0.1)
+        report(scanners, sink)
+    finally:
+        await sink.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api-url", default="http://localhost:8000",
+                        help="Base URL of the algorithm")
+    parser.add_argument("--sink-port", type=int, default=8001,
+                        help="Port of the local stand-in for the scanner's result endpoints")
+    parser.add_argument("--scanners", type=int, default=1,
+                        help="Number of simulated scanners, each scanning its own slide")
+    parser.add_argument("--tiles", type=int, default=1000, help="Tiles per slide")
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="Maximum number of requests in flight over every scanner")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="Tile arrival rate per scanner in tiles/s, 0 for as fast as possible")
+    parser.add_argument("--poisson", action="store_true",
+                        help="Use Poisson distributed arrivals instead of evenly spaced ones")
+    parser.add_argument("--tile-image-path",
+                        help="Tile image sent in every message, a random BMP is generated if omitted")
+    parser.add_argument("--algorithm-id", default="benchmark")
+    parser.add_argument("--slide-prefix", default="benchmark_slide")
+    parser.add_argument("--timeout", type=float, default=300,
+                        help="Seconds to wait for algorithm-completed after the scan end")
+    args = parser.parse_args()
+
+    if args.tile_image_path:
+        asyncio.run(run_benchmark(args, args.tile_image_path))
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tile_image_path = os.path.join(tmp_dir, "tile_0_0.bmp")
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 256, size=(TILE_HEIGHT, TILE_WIDTH, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(tile_image_path)
+        asyncio.run(run_benchmark(args, tile_image_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Measures whether the prefetch stage hides the disk reads of memory-mapped BMP tiles behind
+the inference of the tiles in front of them. The tiles are evicted from the page cache
+before every run, so that their pixels have to come from the disk.
+'''
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image
+
+from inline_algorithm.models import ScanOngoing
+from inline_algorithm.tile_prefetcher import TilePrefetcher
+from inline_algorithm.tile_reader import read_tile
+
+
+def make_tiles(tiles_dir, count, width=1912, height=1192):
+    '''
+    Writes random 24 bit BMP tiles of the scanner's tile size.
+
+    :return: The paths of the tiles.
+    :rtype: list
+    '''
+    rng = np.random.default_rng(0)
+    paths = []
+    for index in range(count):
+        path = os.path.join(tiles_dir, f"tile_0_{index}.bmp")
+        pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(path)
+        paths.append(path)
+    return paths
+
+
+def evict(paths):
+    '''
+    Drops the tiles from the page cache.
+    '''
+    for path in paths:
+        with open(path, "rb") as tile_file:
+            os.fsync(tile_file.fileno())
+            os.posix_fadvise(tile_file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def run(paths, infer_ms, prefetch_workers):
+    '''
+    Processes the tiles one after the other like the handler thread: every tile is
+    loaded, its pixels are read and the inference is simulated by a sleep.
+
+    :return: The total time and the time spent waiting for the pixels, in seconds.
+    :rtype: tuple
+    '''
+    messages = [
+        ScanOngoing(slide_name="s", tile_name=os.path.basename(path),
+                    tile_image_path=path, row_idx=0, col_idx=index)
+        for index, path in enumerate(paths)
+    ]
+    prefetcher = None
+    if prefetch_workers > 0:
+        prefetcher = TilePrefetcher(read_tile, num_readers=prefetch_workers, max_tiles=8)
+        for message in messages:
+            prefetcher.submit(message)
+    start_time = time.perf_counter()
+    waited = 0.0
+    for message in messages:
+        load_start = time.perf_counter()
+        if prefetcher is not None:
+            prefetcher.dequeued(message)
+        tile_image = message.tile_image
+        if tile_image is None:
+            tile_image = read_tile(message.tile_image_path)
+        tile_image.sum(dtype=np.uint64)
+        waited += time.perf_counter() - load_start
+        time.sleep(infer_ms / 1000)
+        if prefetcher is not None:
+            prefetcher.release(message)
+    total = time.perf_counter() - start_time
+    if prefetcher is not None:
+        prefetcher.shutdown()
+    return total, waited
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tiles", type=int, default=32, help="Number of tiles")
+    parser.add_argument("--infer-ms", type=float, default=30, help="Simulated inference time")
+    parser.add_argument("--prefetch-workers", type=int, default=2, help="Reader threads")
+    parser.add_argument("--dir", help="Directory of the generated tiles, on the disk to test")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tiles_dir:
+        paths = make_tiles(tiles_dir, args.tiles)
+        print(f"{'mode':<24}{'total (ms)':>12}{'waiting for pixels (ms)':>26}")
+        for name, workers in (("read on demand", 0), ("prefetch", args.prefetch_workers)):
+            evict(paths)
+            total, waited = run(paths, args.infer_ms, workers)
+            print(f"{name:<24}{total * 1000:>12.0f}{waited * 1000:>26.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Recording and time-accurate replay of the scanner messages of a scan.
+
+A trace is a JSON Lines file: a header line, then one line per start, tile, abort or end
+message, in the order they were sent, with the time they were sent at in seconds from the
+first message, e.g.
+
+    {"format": "pramana-scan-trace", "version": 1}
+    {"time": 0.0, "event": "start", "payload": {"algorithm_id": "...", ...}}
+    {"time": 0.05, "event": "tile", "payload": {"slide_name": "...", "tile_name": "...", ...}}
+    {"time": 12.3, "event": "end", "payload": {"slide_name": "..."}}
+
+Traces are generated from a directory of tiles, in the serpentine order and at the fixed
+acquisition rate of a scanner, or recorded from a live scan by a proxy in front of the
+algorithm. The replayer plays a trace back at 1x, Nx or maximum speed, and reports how far
+behind the acquisition of the tiles their results are delivered, over the course of the
+scan.
+'''
+import os
+import re
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+import numpy as np
+import aiohttp
+from aiohttp import web
+
+from load_generator import ResultSink, percentiles, TILE_WIDTH, TILE_HEIGHT
+
+TRACE_FORMAT = "pramana-scan-trace"
+TRACE_VERSION = 1
+
+# The method and path of the scanner message of every event.
+EVENT_REQUESTS = {
+    "start": ("PUT", "/v1/scan/start"),
+    "tile": ("POST", "/v1/scan/image-tile"),
+    "abort": ("PUT", "/v1/scan/abort"),
+    "end": ("PUT", "/v1/scan/end"),
+}
+
+TILE_NAME_PATTERN = re.compile(r"tile_(\d+)_(\d+)\.bmp$")
+
+
+class TraceWriter:
+    '''
+    Writes the events of a trace to a JSON Lines file, as they happen.
+
+    :param str path: The path of the trace file.
+    '''
+
+    def __init__(self, path):
+        self.__file = open(path, "w", encoding="utf-8") # pylint: disable=consider-using-with
+        self.__first_time = None # The time of the first event, the origin of the trace.
+        self.__file.write(json.dumps({"format": TRACE_FORMAT, "version": TRACE_VERSION}) + "\n")
+
+    def write(self, event, payload, event_time):
+        '''
+        :param str event: The event, one of start, tile, abort or end.
+        :param dict payload: The JSON body of the scanner message.
+        :param float event_time: The time the message was sent at, in seconds, on any clock.
+        '''
+        if self.__first_time is None:
+            self.__first_time = event_time
+        line = {"time": round(event_time - self.__first_time, 6), "event": event}
+        self.__file.write(json.dumps({**line, "payload": payload}) + "\n")
+        self.__file.flush()
+
+    def close(self):
+        '''
+        Closes the trace file.
+        '''
+        self.__file.close()
+
+
+def load_trace(path):
+    '''
+    :param str path: The path of the trace file.
+
+    :return: The events of the trace, in order.
+    :rtype: list
+    :raises ValueError: If the file is not a trace of a supported version.
+    '''
+    with open(path, encoding="utf-8") as trace_file:
+        header = json.loads(trace_file.readline() or "{}")
+        if header.get("format") != TRACE_FORMAT or header.get("version") != TRACE_VERSION:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} scan trace")
+        events = [json.loads(line) for line in trace_file if line.strip()]
+    for event in events:
+        if event["event"] not in EVENT_REQUESTS:
+            raise ValueError(f"Unknown event {event['event']} in {path}")
+    return events
+
+
+def serpentine_order(tile_names):
+    '''
+    Orders tiles the way a scanner acquires them: row by row, from left to right on even
+    rows and from right to left on odd rows.
+
+    :param list tile_names: The names of the tiles, tile_<row>_<column>.bmp.
+
+    :return: The (tile_name, row_idx, col_idx) of every tile, in acquisition order.
+    :rtype: list
+    '''
+    tiles = {}
+    for tile_name in tile_names:
+        match = TILE_NAME_PATTERN.search(tile_name)
+        if match:
+            row_idx, col_idx = int(match.group(1)), int(match.group(2))
+            tiles.setdefault(row_idx, []).append((col_idx, tile_name))
+    ordered = []
+    for index, row_idx in enumerate(sorted(tiles)):
+        columns = sorted(tiles[row_idx], reverse=index % 2 == 1)
+        ordered.extend((tile_name, row_idx, col_idx) for col_idx, tile_name in columns)
+    return ordered
+
+
+def generate_trace(args):
+    '''
+    Generates the trace of a scan of the tiles extracted by the simulator, acquired in
+    serpentine order at a fixed rate.
+
+    :param argparse.Namespace args: The command line arguments.
+    '''
+    tiles = serpentine_order(os.listdir(args.tiles_dir))
+    if not tiles:
+        raise ValueError(f"No tile_<row>_<column>.bmp tiles in {args.tiles_dir}")
+    tile_image_dir = args.tile_image_dir or os.path.abspath(args.tiles_dir)
+    interval = 1 / args.rate
+    writer = TraceWriter(args.trace)
+    try:
+        writer.write("start", {
+            "algorithm_id": args.algorithm_id,
+            "slide_name": args.slide_name,
+            "stain_name": args.stain_name,
+            "organ_name": args.organ_name,
+            "tile_width": TILE_WIDTH,
+            "tile_height": TILE_HEIGHT,
+            "path_to_output": args.path_to_output,
+        }, 0)
+        for index, (tile_name, row_idx, col_idx) in enumerate(tiles):
+            if index == args.abort_after:
+                writer.write("abort", {"slide_name": args.slide_name}, index * interval)
+                break
+            writer.write("tile", {
+                "slide_name": args.slide_name,
+                "tile_name": tile_name,
+                "tile_image_path": os.path.join(tile_image_dir, tile_name),
+                "row_idx": row_idx,
+                "col_idx": col_idx,
+            }, index * interval)
+        else:
+            writer.write("end", {"slide_name": args.slide_name}, len(tiles) * interval)
+    finally:
+        writer.close()
+    print(f"Wrote a trace of {len(tiles)} tiles at {args.rate} tiles/s to {args.trace}")
+
+
+async def record_trace(args):
+    '''
+    Records a trace of a live scan: listens for the scanner messages in front of the
+    algorithm, forwards them to the algorithm and records when they arrive, until the
+    given number of scans ended or were aborted.
+
+    :param argparse.Namespace args: The command line arguments.
+    '''
+    writer = TraceWriter(args.trace)
+    scans_done = asyncio.Event()
+    counts = Counter()
+
+    async with aiohttp.ClientSession() as session:
+        def forward(event):
+            method, path = EVENT_REQUESTS[event]
+
+            async def handler(request):
+                received_time = time.perf_counter()
+                payload = await request.json()
+                writer.write(event, payload, received_time)
+                counts[event] += 1
+                async with session.request(method, args.api_url + path, json=payload) as res:
+                    body = await res.read()
+                    response = web.Response(
+                        status=res.status, body=body, content_type=res.content_type
+                    )
+                if event in ("end", "abort") and counts["end"] + counts["abort"] >= args.scans:
+                    scans_done.set()
+                return response
+            return handler
+
+        app = web.Application(client_max_size=1024 ** 3)
+        for event, (method, path) in EVENT_REQUESTS.items():
+            app.router.add_route(method, path, forward(event))
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, args.host, args.port).start()
+        print(f"Recording the scanner messages sent to port {args.port} into {args.trace}, "
+              f"forwarding them to {args.api_url}")
+        try:
+            await scans_done.wait()
+        finally:
+            await runner.cleanup()
+            writer.close()
+    print(f"Recorded {dict(counts)}")
+
+
+class TraceReplayer:
+    '''
+    Sends the events of a trace to the algorithm, at the times they were recorded at,
+    divided by `speed`.
+
+    :param aiohttp.ClientSession session: The pooled HTTP session.
+    :param str api_url: The base URL of the algorithm.
+    :param float speed: The replay speed, 1 for the recorded timing, or 0 for as fast as
+        the concurrency allows.
+    :param int concurrency: The maximum number of tile messages in flight.
+    '''
+
+    def __init__(self, session, api_url, speed, concurrency):
+        self.session = session
+        self.api_url = api_url
+        self.speed = speed
+        self.__semaphore = asyncio.Semaphore(concurrency)
+        self.acquisition_times = {} # Time every tile was acquired, by (slide_name, tile_name).
+        self.send_delays = [] # How late every tile was sent, compared to its acquisition.
+        self.end_times = {} # Time the end or abort message was sent, by slide_name.
+        self.aborted = set() # The slides whose scan was aborted.
+        self.status_codes = Counter()
+        self.start_time = None
+        self.acquisition_rate = None # The tile rate of the trace, at 1x, in tiles per second.
+
+    async def run(self, events):
+        '''
+        Replays the events. Tile messages are sent concurrently, so that a slow response
+        does not delay the next acquisitions, and start, abort and end messages are only
+        sent once the previous tile messages are answered.
+
+        :param list events: The events of the trace.
+        '''
+        tile_times = [event["time"] for event in events if event["event"] == "tile"]
+        if len(tile_times) > 1 and tile_times[-1] > tile_times[0]:
+            self.acquisition_rate = (len(tile_times) - 1) / (tile_times[-1] - tile_times[0])
+        tasks = []
+        self.start_time = time.perf_counter()
+        for event in events:
+            due_time = time.perf_counter()
+            if self.speed > 0:
+                due_time = self.start_time + event["time"] / self.speed
+                delay = due_time - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if event["event"] == "tile":
+                await self.__semaphore.acquire()
+                tasks.append(asyncio.create_task(self.send_tile(event["payload"], due_time)))
+                continue
+            await asyncio.gather(*tasks)
+            tasks = []
+            if event["event"] in ("end", "abort"):
+                self.end_times[event["payload"]["slide_name"]] = time.perf_counter()
+            await self.send(event["event"], event["payload"])
+            if event["event"] == "abort":
+                self.aborted.add(event["payload"]["slide_name"])
+        await asyncio.gather(*tasks)
+
+    async def send(self, event, payload):
+        '''
+        :param str event: The event, one of start, tile, abort or end.
+        :param dict payload: The JSON body of the scanner message.
+        '''
+        method, path = EVENT_REQUESTS[event]
+        try:
+            async with self.session.request(method, self.api_url + path, json=payload) as res:
+                self.status_codes[f"{event} {res.status}"] += 1
+        except aiohttp.ClientError as e:
+            self.status_codes[f"{event} {type(e).__name__}"] += 1
+
+    async def send_tile(self, payload, acquisition_time):
+        '''
+        Sends one tile message, releasing the concurrency semaphore when done.
+
+        :param dict payload: The JSON body of the tile message.
+        :param float acquisition_time: The time the tile is acquired at in the replay.
+        '''
+        try:
+            self.acquisition_times[(payload["slide_name"], payload["tile_name"])] = (
+                acquisition_time
+            )
+            self.send_delays.append(time.perf_counter() - acquisition_time)
+            await self.send("tile", payload)
+        finally:
+            self.__semaphore.release()
+
+
+def report_lag_course(lag_times, lags, windows, speed):
+    '''
+    Prints the delivery lag over the course of the scan, and whether it grows.
+
+    :param list lag_times: The acquisition time of the tiles with results, in seconds
+        from the start of the replay, in acquisition order.
+    :param list lags: The delivery lag of these tiles, in seconds.
+    :param int windows: The number of parts of the scan the lag is reported for.
+    :param float speed: The replay speed, 0 for max.
+    '''
+    if not lags:
+        return
+    print()
+    print(f"{'scan time (s)':>20}{'tiles':>8}{'lag p50 (ms)':>15}{'lag max (ms)':>15}")
+    for part in np.array_split(np.arange(len(lags)), min(windows, len(lags))):
+        part_lags = [lags[index] for index in part]
+        print(
+            f"{lag_times[part[0]]:>9.1f} - {lag_times[part[-1]]:>7.1f}{len(part):>8}"
+            f"{np.percentile(part_lags, 50) * 1000:>15.1f}{max(part_lags) * 1000:>15.1f}"
+        )
+    print()
+    if len(lags) < 2:
+        return
+    if speed == 0:
+        # Every tile is acquired at once, only the rate the results come back at matters.
+        received_times = sorted(np.add(lag_times, lags))
+        if received_times[-1] > received_times[0]:
+            rate = (len(lags) - 1) / (received_times[-1] - received_times[0])
+            print(f"Results delivered at {rate:.1f} tiles/s")
+    elif lag_times[-1] > lag_times[0]:
+        # The lag grows by 1 - processing rate / acquisition rate per second of scan once
+        # the algorithm falls behind, and stays flat while it keeps up.
+        slope = float(np.polyfit(lag_times, lags, 1)[0])
+        if slope > 0.02:
+            print(f"The delivery lag grows by {slope * 1000:.1f} ms per second of scan: the "
+                  f"algorithm processes tiles at about {max(0.0, 1 - slope) * 100:.0f}% of "
+                  "the acquisition rate")
+        else:
+            print("The delivery lag does not grow over the scan: the algorithm keeps up with "
+                  "the acquisition rate")
+
+
+def report(replayer, sink, windows):
+    '''
+    Prints how far behind the acquisition of the tiles their results are delivered, over
+    the course of the scan, and the time from the scan end to algorithm-completed.
+
+    :param TraceReplayer replayer: The replayer of the trace.
+    :param ResultSink sink: The result sink.
+    :param int windows: The number of parts of the scan the lag is reported for.
+    '''
+    acquired = sorted(replayer.acquisition_times.items(), key=lambda item: item[1])
+    lags = []
+    lag_times = []
+    for key, acquisition_time in acquired:
+        received_time = sink.result_times.get(key)
+        if received_time is not None:
+            lags.append(received_time - acquisition_time)
+            lag_times.append(acquisition_time - replayer.start_time)
+
+    print(f"Tiles acquired            : {len(acquired)}")
+    if replayer.acquisition_rate is not None:
+        print(f"Acquisition rate at 1x    : {replayer.acquisition_rate:.1f} tiles/s")
+    print(f"Responses                 : {dict(sorted(replayer.status_codes.items()))}")
+    print(f"Tiles with results        : {len(lags)}")
+    late = percentiles(replayer.send_delays).get("max", 0)
+    if replayer.speed > 0 and late > 0.1:
+        print(f"Tiles were sent up to {late * 1000:.1f} ms after their acquisition, the "
+              "replay did not keep the trace timing, reduce the speed or raise the concurrency")
+    for name, value in percentiles(lags).items():
+        print(f"Delivery lag {name:<13}: {value * 1000:.1f} ms")
+
+    report_lag_course(lag_times, lags, windows, replayer.speed)
+
+    for slide_name, end_time in replayer.end_times.items():
+        completed_time = sink.completed_times.get(slide_name)
+        message = "scan abort" if slide_name in replayer.aborted else "scan end"
+        if completed_time is None:
+            print(f"{slide_name}: algorithm-completed not received")
+        else:
+            print(f"{slide_name}: {message} to algorithm-completed "
+                  f"{(completed_time - end_time) * 1000:.1f} ms")
+
+
+async def replay_trace(args):
+    '''
+    Replays a trace against the algorithm and prints the report.
+
+    :param argparse.Namespace args: The command line arguments.
+    '''
+    events = load_trace(args.trace)
+    sink = ResultSink(port=args.sink_port)
+    await sink.start()
+    connector = aiohttp.TCPConnector(limit=args.concurrency, keepalive_timeout=60)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            replayer = TraceReplayer(session, args.api_url, args.speed, args.concurrency)
+            await replayer.run(events)
+            waits = [
+                asyncio.wait_for(sink.completed_event(slide_name).wait(), args.timeout)
+                for slide_name in replayer.end_times
+                if slide_name not in replayer.aborted
+            ]
+            results = await asyncio.gather(*waits, return_exceptions=True)
+            if any(isinstance(result, asyncio.TimeoutError) for result in results):
+                print(f"Timed out after {args.timeout}s waiting for algorithm-completed")
+            # Leave a moment for results still in flight to the sink.
+            await asyncio.sleep(0.1)
+        report(replayer, sink, args.windows)
+    finally:
+        await sink.stop()
+
+
+def speed_type(value):
+    '''
+    :param str value: A replay speed: 1x, 4x, max, or a number.
+
+    :return: The replay speed, 0 for max.
+    :rtype: float
+    '''
+    if value == "max":
+        return 0
+    speed = float(value.rstrip("x"))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("the speed must be positive, or max")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser(
+        "generate", help="Generate the trace of a scan of the tiles extracted by the simulator"
+    )
+    generate.add_argument("trace", help="Path of the trace file to write")
+    generate.add_argument("--tiles-dir", required=True,
+                          help="Directory of tile_<row>_<column>.bmp tiles")
+    generate.add_argument("--tile-image-dir",
+                          help="Directory of the tiles as seen by the algorithm, e.g. "
+                               "/data/acquired_data/<slide>_tiles_input in docker, defaults "
+                               "to --tiles-dir")
+    generate.add_argument("--rate", type=float, default=10,
+                          help="Acquisition rate of the scanner in tiles/s")
+    generate.add_argument("--abort-after", type=int,
+                          help="Abort the scan after this number of tiles instead of ending it")
+    generate.add_argument("--algorithm-id", default="trace")
+    generate.add_argument("--slide-name", default="trace_slide")
+    generate.add_argument("--stain-name", default="trace")
+    generate.add_argument("--organ-name", default="trace")
+    generate.add_argument("--path-to-output", default="trace")
+
+    record = subparsers.add_parser(
+        "record", help="Record the trace of a live scan, forwarding the messages to the algorithm"
+    )
+    record.add_argument("trace", help="Path of the trace file to write")
+    record.add_argument("--api-url", default="http://localhost:8000",
+                        help="Base URL of the algorithm the messages are forwarded to")
+    record.add_argument("--host", default="0.0.0.0")
+    record.add_argument("--port", type=int, default=8080,
+                        help="Port the scanner or the simulator sends its messages to")
+    record.add_argument("--scans", type=int, default=1,
+                        help="Number of scans to record, ended or aborted")
+
+    replay = subparsers.add_parser("replay", help="Replay a trace against the algorithm")
+    replay.add_argument("trace", help="Path of the trace file to replay")
+    replay.add_argument("--api-url", default="http://localhost:8000",
+                        help="Base URL of the algorithm")
+    replay.add_argument("--sink-port", type=int, default=8001,
+                        help="Port of the local stand-in for the scanner's result endpoints")
+    replay.add_argument("--speed", type=speed_type, default=1,
+                        help="Replay speed: 1x for the recorded timing, Nx, or max")
+    replay.add_argument("--concurrency", type=int, default=32,
+                        help="Maximum number of tile messages in flight")
+    replay.add_argument("--windows", type=int, default=10,
+                        help="Number of parts of the scan the delivery lag is reported for")
+    replay.add_argument("--timeout", type=float, default=300,
+                        help="Seconds to wait for algorithm-completed after the scan end")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_trace(args)
+    elif args.command == "record":
+        asyncio.run(record_trace(args))
+    else:
+        asyncio.run(replay_trace(args))
+
+
+if __name__ == "__main__":
+    main()
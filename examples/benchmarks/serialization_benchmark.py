@@ -0,0 +1,161 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Micro-benchmark of the serialization of tile results into the body of /v1/tile-results.
+'''
+import json
+import random
+import argparse
+import timeit
+from unittest import mock
+import numpy as np
+
+from inline_algorithm import serialization
+from inline_algorithm.serialization import serialize_tile_results
+from inline_algorithm.detections import ColumnarDetections
+from inline_algorithm.models import ScanOngoing, AoiResults, TileResults
+
+_COLUMNAR_CACHE = {}
+
+
+def double_round_trip(algorithm_id, message, model_results):
+    '''
+    The serialization used before the fast path: the detections are validated twice,
+    through AoiResults and then TileResults, and encoded with the json module.
+    '''
+    results = AoiResults(
+        row_idx=message.row_idx,
+        col_idx=message.col_idx,
+        detection_array=model_results,
+    )
+    data_json = {
+        "algorithm_id": algorithm_id,
+        "slide_name": message.slide_name,
+        "tile_name": message.tile_name,
+        "results": results.dict(by_alias=True),
+    }
+    return json.dumps(TileResults(**data_json).dict(by_alias=True))
+
+
+def make_detections(count, seed=0):
+    '''
+    :param int count: The number of detections.
+    :param int seed: The seed of the random generator.
+
+    :return: Random detections in the DetectionArray format.
+    :rtype: list
+    '''
+    rng = random.Random(seed)
+    detections = []
+    for _ in range(count):
+        x, y = rng.uniform(0, 1800), rng.uniform(0, 1100)
+        detections.append({
+            "bbox": [x, y, x + rng.uniform(5, 50), y + rng.uniform(5, 50)],
+            "confidence": rng.random(),
+            "class": rng.choice(("tumor", "stroma", "lymphocyte")),
+        })
+    return detections
+
+
+def to_columnar(detections):
+    '''
+    :param list detections: Detections in the DetectionArray format.
+
+    :return: The same detections as NumPy arrays, as a detection model would output them.
+        The conversion is cached, so only the serialization is timed.
+    :rtype: ColumnarDetections
+    '''
+    key = id(detections)
+    if key not in _COLUMNAR_CACHE:
+        class_names = sorted({detection["class"] for detection in detections})
+        _COLUMNAR_CACHE[key] = ColumnarDetections(
+            np.array([detection["bbox"] for detection in detections]).reshape(-1, 4),
+            np.array([detection["confidence"] for detection in detections]),
+            np.array([class_names.index(detection["class"]) for detection in detections],
+                     dtype=np.intp),
+            class_names,
+        )
+    return _COLUMNAR_CACHE[key]
+
+
+def benchmark(sizes, repeat):
+    '''
+    Times every serializer on every number of detections.
+
+    :param list sizes: The numbers of detections per tile.
+    :param int repeat: The number of timing runs, the best one is reported.
+    '''
+    message = ScanOngoing(
+        slide_name="slide", tile_name="tile_0_0.bmp", tile_image_path="tile_0_0.bmp",
+        row_idx=0, col_idx=0,
+    )
+    encoders = ["json"] + (["orjson"] if serialization.orjson is not None else [])
+    if serialization.orjson is None:
+        print("orjson is not installed, only the json module is benchmarked")
+    serializers = {
+        "double round trip + json": lambda results: double_round_trip(
+            "algorithm", message, results
+        ),
+    }
+    for encoder in encoders:
+        serializers[f"validated once + {encoder}"] = lambda results: serialize_tile_results(
+            "algorithm", message, results
+        )
+        serializers[f"trusted + {encoder}"] = lambda results: serialize_tile_results(
+            "algorithm", message, results, trusted=True
+        )
+        serializers[f"columnar + {encoder}"] = lambda results: serialize_tile_results(
+            "algorithm", message, to_columnar(results)
+        )
+
+    print(f"{'serializer':<28}" + "".join(f"{f'{size} dets (ms)':>18}" for size in sizes))
+    detections = {size: make_detections(size) for size in sizes}
+    for name, serializer in serializers.items():
+        # Without orjson, serialize_tile_results falls back to the json module.
+        with mock.patch.object(
+            serialization, "orjson", None if name.endswith(" json") else serialization.orjson
+        ):
+            row = f"{name:<28}"
+            for size in sizes:
+                number = max(1, 20000 // size)
+                best = min(
+                    timeit.repeat(
+                        lambda: serializer(detections[size]), # pylint: disable=cell-var-from-loop
+                        repeat=repeat,
+                        number=number,
+                    )
+                )
+                row += f"{best / number * 1000:>18.3f}"
+        print(row)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 1000, 50000],
+        help="Numbers of detections per tile",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timing runs")
+    args = parser.parse_args()
+    benchmark(args.sizes, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Micro-benchmark of the memory-mapped BMP reader against Pillow and OpenCV decoding.
+'''
+import os
+import argparse
+import tempfile
+import timeit
+import numpy as np
+from PIL import Image
+import cv2
+
+from inline_algorithm.tile_reader import read_bmp
+
+
+def make_tile(path, width=1912, height=1192):
+    '''
+    Writes a random 24 bit BMP tile of the scanner's tile size.
+
+    :param str path: The path of the BMP file to write.
+    :param int width: The width of the tile.
+    :param int height: The height of the tile.
+    '''
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+def benchmark(path, repeat, number):
+    '''
+    Times every loader twice: opening the tile only, and opening it then reading every
+    pixel, which is where the memory-mapped reader pays for its page faults.
+
+    :param str path: The path of the BMP tile.
+    :param int repeat: The number of timing runs, the best one is reported.
+    :param int number: The number of loads per timing run.
+    '''
+    loaders = {
+        "read_bmp (mmap view)": read_bmp,
+        "read_bmp, BGR (mmap view)": lambda path: read_bmp(path, rgb=False),
+        "PIL Image.open + np.asarray": lambda path: np.asarray(Image.open(path)),
+        "cv2.imread (BGR)": cv2.imread,
+        "cv2.imread + BGR to RGB": lambda path: cv2.cvtColor(
+            cv2.imread(path), cv2.COLOR_BGR2RGB
+        ),
+    }
+    print(f"{'loader':<32}{'open (ms)':>12}{'open + sum (ms)':>18}")
+    for name, loader in loaders.items():
+        open_time = min(timeit.repeat(lambda: loader(path), repeat=repeat, number=number))
+        sum_time = min(
+            timeit.repeat(
+                lambda: loader(path).sum(dtype=np.uint64), repeat=repeat, number=number
+            )
+        )
+        print(
+            f"{name:<32}{open_time / number * 1000:>12.3f}"
+            f"{sum_time / number * 1000:>18.3f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--path",
+        help="BMP tile to load, a random 1912x1192 tile is generated if omitted",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timing runs")
+    parser.add_argument("--number", type=int, default=20, help="Loads per timing run")
+    args = parser.parse_args()
+
+    if args.path:
+        benchmark(args.path, args.repeat, args.number)
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "tile_0_0.bmp")
+        make_tile(path)
+        benchmark(path, args.repeat, args.number)
+
+
+if __name__ == "__main__":
+    main()
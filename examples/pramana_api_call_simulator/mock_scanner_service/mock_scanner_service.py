@@ -22,7 +22,10 @@ FastAPI server
 '''
 
 import os
+import time
+import atexit
 import configparser
+from typing import List
 from threading import  Thread, Event
 from queue import Queue
 
@@ -31,6 +34,7 @@ from fastapi import FastAPI, Request
 
 from models_scanner import TileResults, AlgorithmCompleted
 from scanner_service_helpers import api_call_handler_scanner
+from result_log import ResultLogWriter, TILE_RESULTS, TILE_RESULTS_BATCH, ALGORITHM_COMPLETED
 
 my_path = os.path.abspath(os.path.dirname(__file__))
 config_path = os.path.join(my_path, "../config.ini")
@@ -38,6 +42,11 @@ config = configparser.ConfigParser()
 config.read(config_path)
 base_path=config.get('DEFAULT', 'BASE_PATH')
 input_file_name=config.get('DEFAULT', 'INPUT_FILE_NAME')
+tile_store_dir=config.get('DEFAULT', 'TILE_STORE_DIR', fallback=None)
+
+result_sink=config.get('DEFAULT', 'RESULT_SINK', fallback='overlay').strip()
+overlay_workers=config.getint('DEFAULT', 'OVERLAY_WORKERS', fallback=1)
+mosaic_downsample=config.getint('DEFAULT', 'MOSAIC_DOWNSAMPLE', fallback=16)
 
 app = FastAPI()
 app.state.api_call_queue = Queue()
@@ -45,26 +54,75 @@ app.state.api_call_queue = Queue()
 error_event = Event()
 thread_handle = Thread(
        target=api_call_handler_scanner,
-       args=(app.state.api_call_queue, base_path, input_file_name, error_event),
+       args=(
+           app.state.api_call_queue,
+           base_path,
+           input_file_name,
+           error_event,
+           tile_store_dir,
+           overlay_workers,
+           mosaic_downsample,
+       ),
        daemon=True,
    )
 thread_handle.start()
 
-@app.post('/v1/tile-results', status_code=204)
-async def tile_results(
-        params: TileResults,
-        request: Request
-    ):
-    app.state.api_call_queue.put(params)
-    return "v1/tile-results received"
-
-@app.post('/v1/algorithm-completed', status_code=204)
-async def algorithm_completed(
-        params: AlgorithmCompleted,
-        request: Request
-    ):
-    app.state.api_call_queue.put(params)
-    return "v1/algorithm-completed received"
+if result_sink == 'log':
+    # Benchmark mode: the results are acknowledged as soon as they are received, and
+    # appended to the log without being validated. Overlays are only drawn if
+    # OVERLAY_WORKERS is not 0.
+    result_log = ResultLogWriter(os.path.join(base_path, 'output', 'tile_results.log'))
+
+    async def log_message(request, kind):
+        """
+        Appends the body of a result message to the log, and passes it on to the handler
+        thread if it draws overlays. Algorithm-completed messages are always passed on.
+        """
+        body = await request.body()
+        result_log.append(kind, time.time(), body)
+        if kind == ALGORITHM_COMPLETED:
+            result_log.flush()
+        if overlay_workers > 0 or kind == ALGORITHM_COMPLETED:
+            app.state.api_call_queue.put((kind, body))
+
+    @app.post('/v1/tile-results', status_code=204)
+    async def log_tile_results(request: Request):
+        await log_message(request, TILE_RESULTS)
+
+    @app.post('/v1/tile-results/batch', status_code=204)
+    async def log_tile_results_batch(request: Request):
+        await log_message(request, TILE_RESULTS_BATCH)
+
+    @app.post('/v1/algorithm-completed', status_code=204)
+    async def log_algorithm_completed(request: Request):
+        await log_message(request, ALGORITHM_COMPLETED)
+    atexit.register(result_log.close)
+
+else:
+    @app.post('/v1/tile-results', status_code=204)
+    async def tile_results(
+            params: TileResults,
+            request: Request
+        ):
+        app.state.api_call_queue.put(params)
+        return "v1/tile-results received"
+
+    @app.post('/v1/tile-results/batch', status_code=204)
+    async def tile_results_batch(
+            params: List[TileResults],
+            request: Request
+        ):
+        for tile_results_params in params:
+            app.state.api_call_queue.put(tile_results_params)
+        return "v1/tile-results/batch received"
+
+    @app.post('/v1/algorithm-completed', status_code=204)
+    async def algorithm_completed(
+            params: AlgorithmCompleted,
+            request: Request
+        ):
+        app.state.api_call_queue.put(params)
+        return "v1/algorithm-completed received"
 
 if __name__ == '__main__':
     uvicorn.run(
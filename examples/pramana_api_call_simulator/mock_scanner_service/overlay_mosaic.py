@@ -0,0 +1,141 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Slide-level overlay mosaic: a downsampled image of the whole slide with the detections of
+the algorithm drawn on it, built tile by tile as the results arrive.
+'''
+import os
+import re
+import json
+import threading
+import cv2
+import numpy as np
+import tifffile
+
+TILE_WIDTH = 1912
+TILE_HEIGHT = 1192
+
+TILE_NAME_PATTERN = re.compile(r"tile_(\d+)_(\d+)\.bmp$")
+
+
+def slide_extent(tiles_path):
+    '''
+    :param str tiles_path: The directory of the tiles extracted by the simulator, named
+                           tile_<row>_<column>.bmp after the pixel offsets of the tiles.
+                           The in-memory tile store of the simulator only holds a few
+                           tiles at a time, the size of the slide is read from its
+                           slide.json instead.
+
+    :return: The height and width of the slide in pixels, or None if there are no tiles.
+    '''
+    slide_json_path = os.path.join(tiles_path, "slide.json")
+    if os.path.isfile(slide_json_path):
+        with open(slide_json_path, encoding="utf-8") as slide_file:
+            slide = json.load(slide_file)
+        return slide["height"], slide["width"]
+    height = width = 0
+    for file_name in os.listdir(tiles_path):
+        match = TILE_NAME_PATTERN.search(file_name)
+        if match:
+            height = max(height, int(match.group(1)) + TILE_HEIGHT)
+            width = max(width, int(match.group(2)) + TILE_WIDTH)
+    return (height, width) if height and width else None
+
+
+class SlideMosaic:
+    '''
+    A downsampled canvas of a whole slide, allocated once. Every tile is downsampled and
+    pasted at its position, with its detections, so the memory used does not depend on the
+    number of tiles. Tiles can be added from several threads at once: they are read and
+    downsampled in parallel, and pasted under a lock.
+
+    :param int height: The height of the slide in pixels.
+    :param int width: The width of the slide in pixels.
+    :param int downsample: The downsampling factor of the canvas.
+    '''
+
+    def __init__(self, height, width, downsample):
+        self.downsample = downsample
+        self.canvas = np.zeros(
+            (-(-height // downsample), -(-width // downsample), 3), dtype=np.uint8
+        ) # BGR, like OpenCV.
+        self.tiles = 0 # The number of tiles pasted on the canvas.
+        self.lock = threading.Lock() # Guards the pastes and the tile count.
+
+    def add_tile(self, row_idx, col_idx, detection_array, source_img_path):
+        '''
+        Pastes a tile and draws its detections on the canvas.
+
+        :param int row_idx: The row of the top left pixel of the tile in the slide.
+        :param int col_idx: The column of the top left pixel of the tile in the slide.
+        :param list detection_array: The detections of the tile, in the DetectionArray or
+                                     List[List] format.
+        :param str source_img_path: The path of the tile image.
+        '''
+        top, left = row_idx // self.downsample, col_idx // self.downsample
+        region = self.canvas[
+            top:(row_idx + TILE_HEIGHT) // self.downsample,
+            left:(col_idx + TILE_WIDTH) // self.downsample,
+        ]
+        if region.size == 0:
+            return
+        image = cv2.imread(source_img_path)
+        thumbnail = None
+        if image is not None:
+            thumbnail = cv2.resize(
+                image,
+                (image.shape[1] // self.downsample, image.shape[0] // self.downsample),
+                interpolation=cv2.INTER_AREA,
+            )[:region.shape[0], :region.shape[1]]
+        with self.lock:
+            if thumbnail is not None:
+                region[:thumbnail.shape[0], :thumbnail.shape[1]] = thumbnail
+            self.tiles += 1
+        if len(detection_array) == 0:
+            return
+        boxes = np.array([
+            detection.get('bbox') if isinstance(detection, dict) else detection[:4]
+            for detection in detection_array
+        ], dtype=np.float64).reshape(-1, 4)
+        # Rasterize every box at once, as a closed polygon in canvas pixels:
+        # (x1, y1) (x2, y1) (x2, y2) (x1, y2).
+        corners = (boxes[:, [0, 1, 2, 1, 2, 3, 0, 3]] / self.downsample).astype(np.int32)
+        cv2.polylines(region, corners.reshape(-1, 4, 2), True, (255, 0, 0), 1)
+
+    def save(self, path, min_size=512):
+        '''
+        Writes the canvas as a pyramidal TIFF: the canvas, then levels halving its size
+        until they fit in `min_size` pixels.
+
+        :param str path: The path of the TIFF file.
+        :param int min_size: The largest side of the smallest level.
+        '''
+        levels = [self.canvas[..., ::-1]] # RGB
+        while max(levels[-1].shape[:2]) > min_size:
+            level = levels[-1]
+            levels.append(cv2.resize(
+                level, (max(1, level.shape[1] // 2), max(1, level.shape[0] // 2)),
+                interpolation=cv2.INTER_AREA,
+            ))
+        options = {"photometric": "rgb", "tile": (256, 256), "compression": "zlib"}
+        with tifffile.TiffWriter(path, bigtiff=self.canvas.nbytes > 2 ** 31) as tiff:
+            tiff.write(levels[0], subifds=len(levels) - 1, **options)
+            for level in levels[1:]:
+                tiff.write(level, subfiletype=1, **options)
@@ -0,0 +1,160 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Append-only binary log of the messages received by the mock scanner in RESULT_SINK = log
+mode, and reader converting it to columns.
+
+Every record is a fixed header, the arrival time as a float64 UNIX timestamp, the kind of
+the message as a uint8 and the length of the body as a uint32, followed by the body of the
+request as received. Bodies are neither parsed nor validated when they are written.
+'''
+import json
+import struct
+import argparse
+import numpy as np
+
+TILE_RESULTS = 0
+TILE_RESULTS_BATCH = 1
+ALGORITHM_COMPLETED = 2
+
+RECORD_HEADER = struct.Struct("<dBI")
+
+
+class ResultLogWriter:
+    '''
+    Appends the bodies of the result messages to a binary log.
+
+    :param str path: The path of the log, appended to if it exists.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.__file = open(path, "ab", buffering=1024 * 1024) # pylint: disable=consider-using-with
+
+    def append(self, kind, received_time, body):
+        '''
+        :param int kind: TILE_RESULTS, TILE_RESULTS_BATCH or ALGORITHM_COMPLETED.
+        :param float received_time: The arrival time of the message, as a UNIX timestamp.
+        :param bytes body: The body of the request.
+        '''
+        self.__file.write(RECORD_HEADER.pack(received_time, kind, len(body)))
+        self.__file.write(body)
+
+    def flush(self):
+        '''
+        Writes the buffered records to the file.
+        '''
+        self.__file.flush()
+
+    def close(self):
+        '''
+        Closes the log.
+        '''
+        self.__file.close()
+
+
+def read_result_log(path):
+    '''
+    Reads the messages of a log. Batches are split into their tile results.
+
+    :param str path: The path of the log.
+
+    :return: An iterator of the arrival time, the kind, TILE_RESULTS or
+             ALGORITHM_COMPLETED, and the decoded message.
+    '''
+    with open(path, "rb") as log_file:
+        while True:
+            header = log_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            received_time, kind, length = RECORD_HEADER.unpack(header)
+            message = json.loads(log_file.read(length))
+            if kind == TILE_RESULTS_BATCH:
+                for tile_results in message:
+                    yield received_time, TILE_RESULTS, tile_results
+            else:
+                yield received_time, kind, message
+
+
+def to_columns(path):
+    '''
+    Converts the detections of a log to columns, one row per detection. Detections in the
+    DetectionArray and in the compact List[List] formats are both supported.
+
+    :param str path: The path of the log.
+
+    :return: The arrays of the columns, by name: received_time, slide_name, tile_name,
+             row_idx, col_idx, bbox (N, 4), confidence and class.
+    :rtype: dict
+    '''
+    columns = {
+        name: [] for name in (
+            "received_time", "slide_name", "tile_name", "row_idx", "col_idx", "bbox",
+            "confidence", "class",
+        )
+    }
+    for received_time, kind, message in read_result_log(path):
+        if kind != TILE_RESULTS:
+            continue
+        results = message["results"]
+        for detection in results["detection_array"]:
+            if isinstance(detection, dict):
+                bbox, confidence, class_name = (
+                    detection["bbox"], detection["confidence"], detection["class"]
+                )
+            else:
+                bbox, confidence, class_name = detection[:4], detection[4], detection[5]
+            columns["received_time"].append(received_time)
+            columns["slide_name"].append(message["slide_name"])
+            columns["tile_name"].append(message["tile_name"])
+            columns["row_idx"].append(results["row_idx"])
+            columns["col_idx"].append(results["col_idx"])
+            columns["bbox"].append(bbox)
+            columns["confidence"].append(confidence)
+            columns["class"].append(class_name)
+    arrays = {name: np.asarray(values) for name, values in columns.items()}
+    arrays["bbox"] = arrays["bbox"].reshape(-1, 4).astype(np.float64)
+    return arrays
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a result log of the mock scanner")
+    parser.add_argument("path", help="Path of the result log")
+    parser.add_argument("--npz", help="Save the detections as columns to this .npz file")
+    args = parser.parse_args()
+
+    tiles = 0
+    completed = []
+    for _, kind, message in read_result_log(args.path):
+        if kind == TILE_RESULTS:
+            tiles += 1
+        else:
+            completed.append(message["slide_name"])
+    columns = to_columns(args.path)
+    print(f"Tile results        : {tiles}")
+    print(f"Detections          : {len(columns['confidence'])}")
+    print(f"Algorithm completed : {completed}")
+    if args.npz:
+        np.savez(args.npz, **columns)
+        print(f"Saved the detections to {args.npz}")
+
+
+if __name__ == "__main__":
+    main()
@@ -21,34 +21,98 @@ under the License.
 Handler for acquisition messages
 '''
 import os
-import cv2
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from models_scanner import TileResults, AlgorithmCompleted
+from result_log import TILE_RESULTS, TILE_RESULTS_BATCH
+from overlay_mosaic import SlideMosaic, slide_extent
 
-def api_call_handler_scanner(api_call_queue, base_path, input_file_name, error_event):
+def decode_messages(message):
+    """
+    :param message: A validated message, or the kind and body of a logged request.
+
+    :return: The tile results and algorithm-completed messages, as dicts.
+    """
+    if isinstance(message, TileResults):
+        return [("tile-results", message.dict(by_alias=True))]
+    if isinstance(message, AlgorithmCompleted):
+        return [("algorithm-completed", message.dict(by_alias=True))]
+    kind, body = message
+    if kind == TILE_RESULTS_BATCH:
+        return [("tile-results", tile_results) for tile_results in json.loads(body)]
+    if kind == TILE_RESULTS:
+        return [("tile-results", json.loads(body))]
+    return [("algorithm-completed", json.loads(body))]
+
+def api_call_handler_scanner(
+        api_call_queue,
+        base_path,
+        input_file_name,
+        error_event,
+        tile_store_dir=None,
+        overlay_workers=1,
+        mosaic_downsample=16
+    ):
+    """
+    Handles the result messages received by the mock scanner. The detections of every slide
+    are drawn on a slide-level mosaic, downsampled `mosaic_downsample` times, which is
+    written to output/<slide_name>_overlay.tif when the algorithm completes. The tiles are
+    read and drawn on the mosaic by a pool of `overlay_workers` threads, so that a slow disk
+    does not hold back the next messages. No mosaic is built with 0 workers.
+    """
+    input_file_path = os.path.join(base_path, 'data', input_file_name)
+    tiles_path = os.path.splitext(input_file_path)[0] + "_tiles_input"
+    executor = ThreadPoolExecutor(max_workers=overlay_workers) if overlay_workers > 0 else None
+    pending = deque() # Bounds the tiles waiting for a worker.
+    mosaics = {} # The mosaic of every slide being scanned, None if its tiles are not found.
     try:
         while True:
-            message = api_call_queue.get()
-            if isinstance(message, TileResults):
-                algorithm_id = message.algorithm_id
-                results = message.results
-                tile_name = message.tile_name
-                slide_name = message.slide_name
-                detection_array = results.dict(by_alias=True).get('detection_array')
-                print(detection_array)
-                if len(detection_array) > 0:
-                    input_file_path = os.path.join(base_path, 'data', input_file_name)
-                    tiles_path = os.path.splitext(input_file_path)[0] + "_tiles_input"
-                    source_img_path = os.path.join(tiles_path, tile_name)
-                    image = cv2.imread(source_img_path)
-                    for detection in detection_array:
-                        x1, y1, x2, y2 = detection.get('bbox')
-                        # Draw a rectangle on the image
-                        image = cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), (255, 0, 0) , 2)
-                    output_path = os.path.join(base_path,'output', tile_name)
-                    cv2.imwrite(output_path, image)
-            elif isinstance(message, AlgorithmCompleted):
-                print('algorithm completed hit')
+            for message_type, message in decode_messages(api_call_queue.get()):
+                slide_name = message['slide_name']
+                if message_type == "algorithm-completed":
+                    while pending:
+                        pending.popleft().result()
+                    mosaic = mosaics.pop(slide_name, None)
+                    if mosaic is not None:
+                        output_path = os.path.join(base_path, 'output', f"{slide_name}_overlay.tif")
+                        mosaic.save(output_path)
+                        print(f"Saved the overlay of {mosaic.tiles} tiles to {output_path}")
+                    print('algorithm completed hit')
+                    continue
+                tile_name = message['tile_name']
+                results = message['results']
+                detection_array = results['detection_array']
+                print(f"{tile_name} : {len(detection_array)} detections")
+                if executor is None:
+                    continue
+                slide_tiles_path = tiles_path
+                if tile_store_dir is not None and not os.path.isdir(tiles_path):
+                    # The simulator served the tiles from memory.
+                    slide_tiles_path = os.path.join(tile_store_dir, os.path.basename(tiles_path))
+                if slide_name not in mosaics:
+                    extent = None
+                    if os.path.isdir(slide_tiles_path):
+                        extent = slide_extent(slide_tiles_path)
+                    if extent is None:
+                        print(f"No tiles found in {slide_tiles_path}, no overlay is drawn")
+                    mosaics[slide_name] = (
+                        SlideMosaic(*extent, mosaic_downsample) if extent is not None else None
+                    )
+                if mosaics[slide_name] is None:
+                    continue
+                if len(pending) >= 4 * overlay_workers:
+                    pending.popleft().result()
+                pending.append(executor.submit(
+                    mosaics[slide_name].add_tile,
+                    int(results['row_idx']),
+                    int(results['col_idx']),
+                    detection_array,
+                    os.path.join(slide_tiles_path, tile_name),
+                ))
+                while pending and pending[0].done():
+                    pending.popleft().result()
 
     except BaseException as e:
         error_event.set()
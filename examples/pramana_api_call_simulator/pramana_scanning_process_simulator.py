@@ -22,14 +22,35 @@ import math
 import random
 import configparser
 import argparse
+import json
+import time
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import requests
 import tifffile
 import pydicom
 import numpy as np
 from PIL import Image
-from pydicom.pixel_data_handlers import convert_color_space
 from tqdm import tqdm
 
+try:
+    from pydicom.pixels import convert_color_space, iter_pixels
+except ImportError: # pydicom < 3
+    from pydicom.pixel_data_handlers import convert_color_space
+    iter_pixels = None
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+TILE_WIDTH = 1912
+TILE_HEIGHT = 1192
+
+# The base image of the slide, opened once in every tile extraction worker process.
+_BASE_IMAGE = None
+
 ####### Helper function to patch images from dicom pixel data #######
 def get_patched_image(data, total_pixel_matrix_rows, total_pixel_matrix_cols):
     '''
@@ -48,28 +69,66 @@ def get_patched_image(data, total_pixel_matrix_rows, total_pixel_matrix_cols):
 
         row_ceil = math.ceil(total_pixel_matrix_rows / base_tile_rows)
         col_ceil = math.ceil(total_pixel_matrix_cols / base_tile_cols)
-        data = convert_color_space(data, "YBR_FULL", "RGB")
-        patched_image = None
-        for row in range(0,row_ceil):
-            horz_array = None
-            for col in range(0,col_ceil):
-                index = row*(col_ceil) + col
-                if horz_array is None:
-                    horz_array = data[index]
-                else:
-                    horz_array = np.hstack((horz_array,data[index]))
-            if patched_image is None:
-                patched_image = horz_array
-            else:
-                patched_image = np.vstack((patched_image, horz_array))
+        # Place every frame at once: (row, col, y, x, channel) -> (row, y, col, x, channel).
+        frames = data[:row_ceil * col_ceil].reshape(
+            row_ceil, col_ceil, base_tile_rows, base_tile_cols, -1
+        )
+        patched_image = frames.transpose(0, 2, 1, 3, 4).reshape(
+            row_ceil * base_tile_rows, col_ceil * base_tile_cols, -1
+        )
 
-        # Chop off the excess unnecessary parts of the image.
+        # Chop off the excess unnecessary parts of the image, before the color conversion.
         patched_image = patched_image[:total_pixel_matrix_rows, :total_pixel_matrix_cols]
+        patched_image = convert_color_space(patched_image, "YBR_FULL", "RGB")
 
         return patched_image
     except Exception as e:
         print("Caught an error in get_patched_image function : ", e)
 
+####### Helper function to stream tile rows from a tiled dcm file #######
+def iter_dicom_tile_rows(file_name, tile_height=1192):
+    '''
+    Decodes the frames of a tiled DICOM file one at a time, and yields the image in bands
+    of `tile_height` rows. Only the frames of the current band are held in memory, never
+    every frame or the whole image. Frames are expected in row-major order (TILED_FULL).
+
+    :param file_name: path of the dicom file saved.
+    :param tile_height: The number of rows of the yielded bands.
+
+    :return: An iterator of the row index of the band and the band, of shape
+             (tile_height, total columns, channels), shorter for the last one.
+    '''
+    dicom = pydicom.dcmread(file_name, stop_before_pixels=True)
+    total_rows = dicom.TotalPixelMatrixRows
+    total_cols = dicom.TotalPixelMatrixColumns
+    frame_rows = dicom.Rows
+    frame_cols = dicom.Columns
+    col_ceil = math.ceil(total_cols / frame_cols)
+
+    band = None # The decoded rows not yielded yet, the height of a tile plus a frame.
+    band_rows = 0 # The number of rows of the band filled with decoded frames.
+    band_start = 0 # The row index of the first row of the band in the image.
+    for index, frame in enumerate(iter_pixels(file_name)): # Converted to RGB if needed.
+        if frame.ndim == 2:
+            frame = frame[..., np.newaxis]
+        if band is None:
+            band = np.empty(
+                (tile_height + frame_rows, col_ceil * frame_cols, frame.shape[2]),
+                dtype=frame.dtype,
+            )
+        col = index % col_ceil
+        band[band_rows:band_rows + frame_rows, col * frame_cols:(col + 1) * frame_cols] = frame
+        if col < col_ceil - 1:
+            continue
+        band_rows = min(band_rows + frame_rows, total_rows - band_start)
+        while band_rows >= tile_height or (band_rows > 0 and band_start + band_rows >= total_rows):
+            rows = min(tile_height, band_rows)
+            strip = band[:rows, :total_cols].copy()
+            yield band_start, strip[..., 0] if strip.shape[2] == 1 else strip
+            band[:band_rows - rows] = band[rows:band_rows]
+            band_rows -= rows
+            band_start += rows
+
 ####### Helper function to extract patched data from dcm file #######
 def extract_pixel_data(file_name):
     '''
@@ -134,7 +193,11 @@ def process_tiles(
     input_file_path,
     file_path_to_docker,
     abort_scan=False,
-    is_docker_running=False
+    is_docker_running=False,
+    tiles_dir_path=None,
+    docker_tiles_dir_path=None,
+    tile_names=None,
+    num_tiles=None
 ):
     """
     Access the tiles in the specified directory and submit them to the API as
@@ -144,23 +207,33 @@ def process_tiles(
 
     :param api_url: The URL of the API.
     :param slide_name: The name of the slide.
-    :param TILES_DIR_PATH: The path to the directory containing the tiles.
+    :param tiles_dir_path: The path to the directory containing the tiles.
                            Defaults to './data/DEID-ID-2_H01EBB55P-86.ome_tiles_input/'.
+    :param docker_tiles_dir_path: The path of that directory inside the algorithm's container.
+                                  Defaults to the tiles directory next to file_path_to_docker.
+    :param tile_names: The file names of the tiles to send, e.g. as they are generated by
+                       iter_memory_tiles. Defaults to the files of tiles_dir_path.
+    :param num_tiles: The number of tile_names, when they are generated.
     """
     try:
         print("Testing the POST /v1/scan/image-tile API")
-        tiles_dir_path = os.path.splitext(input_file_path)[0] + "_tiles_input"
-        docker_base_dir = os.path.splitext(file_path_to_docker)[0] + "_tiles_input"
+        if tiles_dir_path is None:
+            tiles_dir_path = os.path.splitext(input_file_path)[0] + "_tiles_input"
+        if docker_tiles_dir_path is None:
+            docker_tiles_dir_path = os.path.splitext(file_path_to_docker)[0] + "_tiles_input"
         counter = 0
         print("Logging the next print statements for every 200th POST request.")
-        abort_index = random.randint(0, len(os.listdir(tiles_dir_path)))
-        for file_name in os.listdir(tiles_dir_path):
+        if tile_names is None:
+            tile_names = os.listdir(tiles_dir_path)
+            num_tiles = len(tile_names)
+        abort_index = random.randint(0, num_tiles)
+        for file_name in tile_names:
             if file_name.endswith('.bmp'):
                 tile_name, _ = os.path.splitext(file_name)
                 _, row_idx, column_idx = tile_name.split('_')
                 tile_image_path = os.path.join(tiles_dir_path  , file_name)
                 if is_docker_running:
-                    tile_image_path = os.path.join(docker_base_dir  , file_name)
+                    tile_image_path = os.path.join(docker_tiles_dir_path, file_name)
                 image_tile_payload = {
                     "slide_name": slide_name,
                     "tile_name": file_name,
@@ -219,37 +292,302 @@ def end_scan( api_port, slide_name):
     except Exception as e:
         print("Caught an error in end_scan function : ", e)
 
-####### Helper function to crop images to bmp files in 2048x2048 size #######
-def extract_tiles(input_file_path):
+####### Helpers to read tile-sized regions of an OME-TIFF without loading it #######
+def open_tiff_base_image(input_file_path):
+    """
+    Opens the base image of an OME-TIFF file as an array whose regions are only read and
+    decoded when they are sliced: as a memory map for uncompressed contiguous files, or
+    through zarr, chunk by chunk of the native tiles or strips of the file. Without zarr,
+    other files are read whole, as a last resort.
+
+    :param input_file_path: The path to the OME-TIFF file.
+    """
+    with tifffile.TiffFile(input_file_path) as tiff:
+        is_memmappable = tiff.pages[0].is_memmappable
+    if is_memmappable:
+        return tifffile.memmap(input_file_path, page=0, mode="r")
+    tiff = tifffile.TiffFile(input_file_path) # Kept open as long as the zarr store.
+    page = tiff.pages[0] ## The base image of the ome.tif file
+    if zarr is not None:
+        return zarr.open(page.aszarr(), mode="r")
+    print("Install zarr to extract the tiles without loading the whole image in memory")
+    return page.asarray()
+
+def init_tile_worker(input_file_path):
     """
-    Extract tiles from the specified OME-TIFF file and save them as BMP files.
+    Initializer of the tile extraction worker processes: opens the base image once per
+    worker.
 
-    :param ome_tif_file_path: The path to the OME-TIFF file.
+    :param input_file_path: The path to the OME-TIFF file.
+    """
+    global _BASE_IMAGE # pylint: disable=global-statement
+    _BASE_IMAGE = open_tiff_base_image(input_file_path)
+
+def is_tiled_dicom(file_name):
+    """
+    :param file_name: path of the dicom file saved.
+
+    :return: Whether the file holds a whole slide image split in several frames, that
+             can be decoded frame by frame.
+    """
+    dicom = pydicom.dcmread(file_name, stop_before_pixels=True)
+    return (
+        iter_pixels is not None
+        and int(dicom.get("NumberOfFrames", 1)) > 1
+        and "TotalPixelMatrixRows" in dicom
+    )
+
+def save_tile_image(task):
+    """
+    Saves the pixels of one tile as a BMP file.
+
+    :param task: The path of the BMP file and the pixels of the tile.
+    """
+    path, extracted_image = task
+    Image.fromarray(extracted_image).save(path)
+
+def save_tile(task):
+    """
+    Reads one tile-sized region of the base image and saves it as a BMP file.
+
+    :param task: The row and column of the top left pixel of the tile, and the path of
+                 the tiles directory.
+    """
+    i, j, tiles_path = task
+    extracted_image = np.asarray(_BASE_IMAGE[i:i + TILE_HEIGHT, j:j + TILE_WIDTH])
+    image = Image.fromarray(extracted_image)
+    image.save(tiles_path + f"/tile_{i}_{j}.bmp")
+
+def slide_size(input_file_path):
+    """
+    :param input_file_path: The path to the OME-TIFF or DICOM file.
+
+    :return: The height and width of the base image in pixels, read from the header.
+    """
+    if 'tif' in input_file_path:
+        with tifffile.TiffFile(input_file_path) as tiff:
+            return tiff.pages[0].shape[:2]
+    dicom = pydicom.dcmread(input_file_path, stop_before_pixels=True)
+    if "TotalPixelMatrixRows" in dicom:
+        return dicom.TotalPixelMatrixRows, dicom.TotalPixelMatrixColumns
+    return dicom.Rows, dicom.Columns
+
+def count_tiles(input_file_path):
+    """
+    :param input_file_path: The path to the OME-TIFF or DICOM file.
+
+    :return: The number of tiles of the slide.
+    """
+    height, width = slide_size(input_file_path)
+    return math.ceil(height / TILE_HEIGHT) * math.ceil(width / TILE_WIDTH)
+
+def iter_tile_tasks(input_file_path, tiles_path):
+    """
+    Lists the work of saving every tile of the slide, in row-major order, without reading
+    the pixels of the tiles not reached yet.
+
+    :param input_file_path: The path to the OME-TIFF or DICOM file.
+    :param tiles_path: The directory to save the tiles to.
+
+    :return: An iterator of the function saving a tile, its task and the file name of the
+             tile.
+    """
+    if 'tif' in input_file_path:
+        height, width = slide_size(input_file_path)
+        for i in range(0, height, TILE_HEIGHT):
+            for j in range(0, width, TILE_WIDTH):
+                yield save_tile, (i, j, tiles_path), f"tile_{i}_{j}.bmp"
+    elif is_tiled_dicom(input_file_path):
+        for i, strip in iter_dicom_tile_rows(input_file_path, TILE_HEIGHT):
+            for j in range(0, strip.shape[1], TILE_WIDTH):
+                file_name = f"tile_{i}_{j}.bmp"
+                task = (os.path.join(tiles_path, file_name), strip[:, j:j + TILE_WIDTH])
+                yield save_tile_image, task, file_name
+    else:
+        base_image = extract_pixel_data(input_file_path)
+        for i in range(0, base_image.shape[0], TILE_HEIGHT):
+            for j in range(0, base_image.shape[1], TILE_WIDTH):
+                file_name = f"tile_{i}_{j}.bmp"
+                task = (
+                    os.path.join(tiles_path, file_name),
+                    base_image[i:i + TILE_HEIGHT, j:j + TILE_WIDTH],
+                )
+                yield save_tile_image, task, file_name
+
+def iter_saved_tiles(input_file_path, tiles_path, num_workers=None):
+    """
+    Saves the tiles of the slide as BMP files with a pool of worker processes, and yields
+    their file names in row-major order as they are saved. At most two tiles per worker
+    are saved ahead of the consumer of the iterator, so the memory used is bounded by the
+    number of workers rather than by the size of the slide, and tiles are only generated
+    as fast as they are consumed.
+
+    :param input_file_path: The path to the OME-TIFF or DICOM file.
+    :param tiles_path: The directory to save the tiles to, which must exist.
+    :param num_workers: The number of worker processes, defaults to the number of CPUs.
+    """
+    num_workers = num_workers or os.cpu_count()
+    initializer, initargs = None, ()
+    if 'tif' in input_file_path:
+        # Every worker opens the base image once, and reads its tiles from the file.
+        initializer, initargs = init_tile_worker, (input_file_path,)
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        initializer=initializer,
+        initargs=initargs,
+    ) as executor:
+        pending = deque() # Bounds the tiles held in memory while they are saved.
+        for function, task, file_name in iter_tile_tasks(input_file_path, tiles_path):
+            if len(pending) >= 2 * num_workers:
+                future, saved_file_name = pending.popleft()
+                future.result()
+                yield saved_file_name
+            pending.append((executor.submit(function, task), file_name))
+        for future, saved_file_name in pending:
+            future.result()
+            yield saved_file_name
+
+####### Helper functions of the in-memory tile store #######
+def prepare_memory_tile_store(input_file_path, tiles_path):
+    """
+    Prepares a directory for the tiles on a tmpfs file system, such as /dev/shm, so that
+    the tiles are served from memory: neither the simulator nor the algorithm touches the
+    persistent disk during the scan. Tiles of a previous run are removed. The tiles are
+    generated during the scan by iter_memory_tiles, and the size of the slide is saved in
+    slide.json for the overlay of the mock scanner service.
+
+    :param input_file_path: The path to the OME-TIFF or DICOM file.
+    :param tiles_path: The directory to save the tiles to, inside TILE_STORE_DIR.
+    """
+    tile_store_dir = os.path.dirname(tiles_path)
+    if not os.path.isdir(os.path.dirname(tile_store_dir)):
+        print(f"The parent of TILE_STORE_DIR {tile_store_dir} does not exist, "
+              "set TILE_STORE_DIR in config.ini to a tmpfs directory")
+    shutil.rmtree(tiles_path, ignore_errors=True)
+    os.makedirs(tiles_path)
+    height, width = slide_size(input_file_path)
+    with open(os.path.join(tiles_path, "slide.json"), "w", encoding="utf-8") as slide_file:
+        json.dump({"height": int(height), "width": int(width)}, slide_file)
+    print(f"Serving the tiles from memory, in {tiles_path}")
+
+def get_tiles_processed(api_port, slide_name):
+    """
+    Reads the number of tiles of the slide processed by the algorithm from its
+    GET /v1/queue API.
+
+    :param api_port: The port of the algorithm API.
+    :param slide_name: The name of the slide.
+
+    :return: The number of tiles processed, or None if the algorithm does not report it.
     """
     try:
-        file_size = os.path.getsize(input_file_path)
-        time = int(file_size * 3.5 // 543367358)
-        print(f"Estimated time to extract .bmp files : {time + 1} - {time + 2} minutes")
-        tiles_path = os.path.splitext(input_file_path)[0] + "_tiles_input"
-        extension = input_file_path # Checking extension whether it is a dcm file or a ome.tif file
-        os.makedirs(tiles_path) ## Make a directory for the bmp files
-        if 'tif' in extension:
-            with tifffile.TiffFile(input_file_path) as tiff:
-                base_image = tiff.pages[0] ## Extract the base image from the ome.tif file
-            base_image = base_image.asarray()
+        res = requests.get(f"http://localhost:{api_port}/v1/queue", timeout=5)
+        if res.status_code != 200:
+            return None
+        for session in res.json().get("sessions", []):
+            if session["slide_name"] == slide_name:
+                return session["tiles_processed"]
+    except (requests.RequestException, ValueError, KeyError):
+        pass
+    return None
+
+def iter_memory_tiles(
+    input_file_path,
+    tiles_path,
+    api_port,
+    slide_name,
+    num_workers=None,
+    window=64
+):
+    """
+    Generates the tiles of the slide in the tile store on demand, like the acquisition
+    buffer of the scanner: at most `window` tiles are in the store at once, the ones sent
+    and not processed yet and the ones being saved. Once the window is full, it waits for
+    the algorithm to process the tiles sent, as reported by its GET /v1/queue API, and
+    deletes their files before saving more. The tiles are expected to be processed in the
+    order they are sent. The last tiles of the window are left in the store, they are
+    removed by the next run.
+
+    If the algorithm does not report the tiles it processed, no tile is deleted and the
+    memory used is no longer bounded.
+
+    :param input_file_path: The path to the OME-TIFF or DICOM file.
+    :param tiles_path: The directory of the tile store prepared by prepare_memory_tile_store.
+    :param api_port: The port of the algorithm API.
+    :param slide_name: The name of the slide.
+    :param num_workers: The number of worker processes saving the tiles.
+    :param window: The maximum number of tiles in the store.
+
+    :return: An iterator of the file names of the tiles, once they are saved.
+    """
+    num_workers = num_workers or os.cpu_count()
+    # Saved ahead of the consumer of iter_saved_tiles, hence part of the window.
+    saving = 2 * num_workers
+    sent = deque() # The paths of the tiles sent and not deleted yet, in order.
+    deleted = 0 # The number of tiles deleted, all processed.
+    for file_name in iter_saved_tiles(input_file_path, tiles_path, num_workers):
+        while sent and len(sent) + saving >= window:
+            processed = get_tiles_processed(api_port, slide_name)
+            if processed is None:
+                print("The algorithm does not report the tiles it processed on "
+                      "GET /v1/queue, the tiles are kept in the store")
+                sent.clear()
+                window = math.inf
+                break
+            if processed <= deleted:
+                time.sleep(0.01)
+            while sent and deleted < processed:
+                os.remove(sent.popleft())
+                deleted += 1
+        sent.append(os.path.join(tiles_path, file_name))
+        yield file_name
+
+def prepare_tiles(input_file_path, tiles_path, api_port, slide_name, num_workers, window):
+    """
+    Prepares the in-memory tile store, if the tiles are served from memory.
 
+    :param input_file_path: The path to the OME-TIFF or DICOM file.
+    :param tiles_path: The directory of the tile store, or None to send the tiles
+                       extracted next to the input file.
+    :param api_port: The port of the algorithm API.
+    :param slide_name: The name of the slide.
+    :param num_workers: The number of worker processes saving the tiles.
+    :param window: The maximum number of tiles in the store.
 
-        elif 'dcm' in extension:
-            base_image = extract_pixel_data(input_file_path)
+    :return: The iterator of the file names of the tiles generated during the scan and
+             their number, or None and None to send the extracted tiles.
+    """
+    if tiles_path is None:
+        return None, None
+    prepare_memory_tile_store(input_file_path, tiles_path)
+    tile_names = iter_memory_tiles(
+        input_file_path, tiles_path, api_port, slide_name, num_workers, window
+    )
+    return tile_names, count_tiles(input_file_path)
 
+####### Helper function to crop images to bmp files in 1912x1192 size #######
+def extract_tiles(input_file_path, num_workers=None):
+    """
+    Extract tiles from the specified OME-TIFF or DICOM file and save them as BMP files.
 
-        counter = 0
-        for i in tqdm(range(0, base_image.shape[0], 1192)):
-            for j in range(0, base_image.shape[1], 1912):
-                extracted_image = base_image[i:i+1192, j:j+1912]
-                image = Image.fromarray(extracted_image)
-                image.save(tiles_path + f"/tile_{i}_{j}.bmp")
-                counter +=1
+    OME-TIFF tiles are streamed: a pool of worker processes reads tile-sized regions of
+    the base image straight from the file and encodes them, so the memory used is bounded
+    by the number of workers rather than by the size of the slide. Tiled DICOM files are
+    decoded frame by frame, one band of tiles at a time, and the tiles are encoded by the
+    pool.
+
+    :param input_file_path: The path to the OME-TIFF or DICOM file.
+    :param num_workers: The number of worker processes, defaults to the number of CPUs.
+    """
+    try:
+        tiles_path = os.path.splitext(input_file_path)[0] + "_tiles_input"
+        os.makedirs(tiles_path) ## Make a directory for the bmp files
+        num_tiles = count_tiles(input_file_path)
+        print(f"Extracting {num_tiles} tiles with {num_workers or os.cpu_count()} "
+              "worker processes")
+        for _ in tqdm(iter_saved_tiles(input_file_path, tiles_path, num_workers),
+                      total=num_tiles):
+            pass
         print("All tiles extracted successfully!!")
 
     except Exception as e:
@@ -267,6 +605,11 @@ def main():
     organ_name =config.get('DEFAULT', 'ORGAN_NAME')
     api_port = config.get('DEFAULT', "API_PORT")
     path_to_output = config.get('DEFAULT', "PATH_TO_OUTPUT")
+    tile_store_dir = config.get('DEFAULT', "TILE_STORE_DIR", fallback="/dev/shm/pramana_simulator")
+    docker_tile_store_dir = config.get(
+        'DEFAULT', "DOCKER_TILE_STORE_DIR", fallback="/data/tile_store"
+    )
+    tile_store_window = config.getint('DEFAULT', "TILE_STORE_WINDOW", fallback=64)
 
     file_path = os.path.join(base_path, 'data', input_file_name)
 
@@ -290,19 +633,42 @@ def main():
         action="store_true",
         help="Run with -d if the algorithm api service is running as a docker container"
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes extracting the tiles, defaults to the number of CPUs"
+    )
+    parser.add_argument(
+        "-t",
+        "--tile-store",
+        choices=["disk", "memory"],
+        default="disk",
+        help="Save the tiles next to the input file before the scan (disk), or generate "
+             "them during the scan in TILE_STORE_DIR, a tmpfs directory, to measure the "
+             "algorithm without the simulator's disk I/O (memory)"
+    )
 
     # Parse the command-line arguments
     args = parser.parse_args()
+    tiles_dir_path = None
+    docker_tiles_dir_path = None
+    if args.tile_store == "memory":
+        tiles_dir_name = os.path.splitext(input_file_name)[0] + "_tiles_input"
+        tiles_dir_path = os.path.join(tile_store_dir, tiles_dir_name)
+        # TILE_STORE_DIR is mounted at DOCKER_TILE_STORE_DIR in the algorithm's container.
+        docker_tiles_dir_path = os.path.join(docker_tile_store_dir, tiles_dir_name)
 
     # Check if the -i flag is present
     if args.interactive:
         ####### Helper function to crop images to bmp files in 1936x1216 size #######
-        while True:
+        while tiles_dir_path is None:
             response = input("""Do you wish to start extracting tiles from the input file ?
                              Note: If you have already saved the .bmp files you can skip
                              to the API part by pressing No [Y/N] : """)
             if response.upper() == "Y" or response.upper() == "YES":
-                extract_tiles(file_path)
+                extract_tiles(file_path, args.workers)
                 break
 
             if response.upper() == "N" or response.upper() == "NO":
@@ -343,13 +709,21 @@ def main():
                 )
                 ####### Helper function to test the POST /v1/scan/image-tile API #######
                 file_path_to_docker = os.path.join('/data/acquired_data',  input_file_name)
+                tile_names, num_tiles = prepare_tiles(
+                    file_path, tiles_dir_path, api_port, slide_name, args.workers,
+                    tile_store_window
+                )
                 process_tiles(
                     api_port,
                     slide_name,
                     file_path,
                     file_path_to_docker,
                     abort_bool,
-                    args.docker
+                    args.docker,
+                    tiles_dir_path,
+                    docker_tiles_dir_path,
+                    tile_names,
+                    num_tiles
                 )
                 ####### Helper function to test the PUT /v1/scan/end API #######
                 end_scan(api_port, slide_name)
@@ -359,7 +733,8 @@ def main():
             print("Invalid Response. Please try again...")
     else:
         ####### Helper function to crop images to bmp files in 1936x1216 size #######
-        extract_tiles(file_path)
+        if tiles_dir_path is None:
+            extract_tiles(file_path, args.workers)
         ####### Helper function to test the PUT /v1/scan/start API #######
         start_scan(
             algorithm_id,
@@ -371,12 +746,19 @@ def main():
         )
         ####### Helper function to test the POST /v1/scan/image-tile API #######
         file_path_to_docker = os.path.join('/data/acquired_data',  input_file_name)
+        tile_names, num_tiles = prepare_tiles(
+            file_path, tiles_dir_path, api_port, slide_name, args.workers, tile_store_window
+        )
         process_tiles(
             api_port,
             slide_name,
             file_path,
             file_path_to_docker,
-            is_docker_running=args.docker
+            is_docker_running=args.docker,
+            tiles_dir_path=tiles_dir_path,
+            docker_tiles_dir_path=docker_tiles_dir_path,
+            tile_names=tile_names,
+            num_tiles=num_tiles
         )
         ####### Helper function to test the PUT /v1/scan/end API #######
         end_scan(api_port, slide_name)
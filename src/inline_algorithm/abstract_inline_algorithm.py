@@ -49,6 +49,13 @@ class AbstractInlineAlgorithm(ABC):
         '''
         pass
 
+    def get_warm_up_tiles(self):
+        '''
+        Returns the synthetic tiles run through process before the server reports ready,
+        as NumPy arrays or ScanOngoing messages. Optional, no tile is run by default.
+        '''
+        return []
+
     @abstractmethod
     def on_scan_start(self, message):
         '''
@@ -63,6 +70,14 @@ class AbstractInlineAlgorithm(ABC):
         '''
         pass
 
+    def process_batch(self, messages):
+        '''
+        Method to run when several AOIs or tiles of the same slide are presented
+        together. Returns one result per message, in the same order. Optional, it calls
+        process on every message by default.
+        '''
+        return [self.process(message) for message in messages]
+
     @abstractmethod
     def on_scan_end(self, message):
         '''
@@ -0,0 +1,656 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+An asyncio-native implementation of the AbstractInlineAlgorithm, for I/O-bound
+algorithms such as remote inference, where many tiles are in flight at once.
+'''
+import json
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import replace
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, APIRouter, Response
+from .abstract_inline_algorithm import AbstractInlineAlgorithm
+from .processor_config import ProcessorConfig
+from .result_sender import RETRY_STATUS_CODES
+from .scan_sessions import ScanSession
+from .tile_reader import read_tile
+from .serialization import serialize_tile_results, dumps
+from .readiness import Readiness, warm_up_messages
+from .models import ScanStart, ScanOngoing, ScanEnd, ScanAbort
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# The hooks of AbstractInlineAlgorithm are declared as regular methods, this class
+# implements them as coroutines.
+# pylint: disable=invalid-overridden-method
+
+
+async def _call_hook(hook, *args):
+    '''
+    Awaits a coroutine hook, or runs a regular one in a worker thread so that it does not
+    block the event loop.
+
+    :param callable hook: The hook to call.
+
+    :return: The return value of the hook.
+    '''
+    if inspect.iscoroutinefunction(hook):
+        return await hook(*args)
+    return await asyncio.to_thread(hook, *args)
+
+
+class AsyncInlineAlgoQueueProcessor(AbstractInlineAlgorithm):
+    '''
+    A sibling of InlineAlgoQueueProcessor running the whole pipeline on the event loop of
+    the FastAPI server: messages go through an `asyncio.Queue`, up to `max_concurrency`
+    tiles are processed at the same time by `async def process()` hooks, and results are
+    posted with an async HTTP client over keep-alive connections.
+
+    The scan semantics are those of InlineAlgoQueueProcessor. Hooks run in the order the
+    messages are received, every tile is posted with the `algorithm_id` of its own slide's
+    ScanStart, and /v1/algorithm-completed is only sent once every tile of the slide has
+    been processed and its results posted. Hooks may also be regular functions, they are
+    then run in a worker thread, so existing subclasses can migrate by changing their base
+    class. The synthetic tiles of `get_warm_up_tiles` are processed before the first
+    message, as with InlineAlgoQueueProcessor, and /ready reports when they are done.
+    An exception raised by `process` also stops the handling of messages, the tiles in
+    flight are still posted and /ready then reports the server failed.
+
+    Requires httpx (`pip install "inline_algorithm[async]"`).
+
+    :param int port: The port number the FastAPI app will run on.
+    :param str host: The host address the FastAPI app will bind to
+    :param bool docker_mode: A flag indicating if the application is running in Docker mode.
+    :param ProcessorConfig config: The options of the pipeline, the defaults of
+        ProcessorConfig with 8 `sender_connections` if not given. Only `max_concurrency`,
+        `batch_size`, `max_queue_size`, `queue_full_policy`, `queue_block_timeout`,
+        `retry_after`, `sender_connections`, `post_retries`, `post_timeout`,
+        `retry_backoff` and `trusted_results` apply, the other options are ignored.
+    :param options: Options overriding the ones of `config`, as keyword arguments named
+        after the fields of ProcessorConfig, e.g. `max_concurrency=64`.
+    :raises TypeError: If an option is not a field of ProcessorConfig.
+    :raises ValueError: If an option has an invalid value, see ProcessorConfig.
+    :raises ImportError: If httpx is not installed.
+    '''
+
+    def __init__(self, port, host, docker_mode=True, config=None, **options):
+        if httpx is None:
+            raise ImportError(
+                "AsyncInlineAlgoQueueProcessor requires httpx, "
+                "install it with: pip install \"inline_algorithm[async]\""
+            )
+        config = replace(config or ProcessorConfig(sender_connections=8), **options)
+        self.port = port
+        self.host = host
+        self.docker_mode = docker_mode
+        self.config = config # The options of the pipeline.
+
+        hostname = "host.docker.internal" if docker_mode else "localhost"
+        self.__scanner_url = f"http://{hostname}:8001" # The scanner the results are posted to.
+        # A queue of API messages. Only tiles are bounded by max_queue_size, see scan_ongoing.
+        self.__queue = asyncio.Queue()
+        self.__dropped_tiles = 0 # Tiles accepted but dropped because the queue was full.
+        self.__rejected_tiles = 0 # Tiles rejected because the queue was full.
+        self.__held_message = None # The message dequeued after a batch, handled next.
+        self.__sessions = {} # The active scan sessions, by slide name.
+        self.__ending = {} # The sessions waiting for their tiles after a ScanEnd.
+        # The number of ScanAbort queued by slide, the queued tiles of these slides are skipped.
+        self.__aborting = {}
+        self.__tile_tasks = {} # The tasks of the tiles in flight, by session.
+        # Bounds the tiles in flight.
+        self.__concurrency = asyncio.Semaphore(config.max_concurrency)
+        self.__background_tasks = set() # Keeps the tile and scan end tasks referenced.
+        self.__dispatcher_task = None # The task handing out the queued messages.
+        self.__client = None # The async HTTP client, opened for the server's lifetime.
+        self.__stats = {"sent": 0, "failed": 0, "retried": 0}
+        self.__error_event = asyncio.Event() # An event to handle error states.
+        self.__readiness = Readiness() # Whether the model is warmed up, served on /ready.
+        self.app = FastAPI(lifespan=self.lifespan) # The FastAPI application instance.
+        self.__router = APIRouter() # The FastAPI router for handling routes.
+
+        self.__init_routes()
+
+    def __init_routes(self):
+        self.__router.add_api_route("/v1/scan/start", self.scan_start, methods=["PUT"])
+        self.__router.add_api_route("/v1/scan/end", self.scan_end, methods=["PUT"])
+        self.__router.add_api_route(
+            "/v1/scan/image-tile", self.scan_ongoing, methods=["POST"]
+        )
+        self.__router.add_api_route("/v1/scan/abort", self.scan_abort, methods=["PUT"])
+        self.__router.add_api_route("/v1/queue", self.queue_status, methods=["GET"])
+        self.__router.add_api_route("/ready", self.ready, methods=["GET"])
+        self.app.include_router(self.__router)
+
+    @asynccontextmanager
+    async def lifespan(self, app: FastAPI):
+        '''
+        Manages the lifespan of the FastAPI application: opens the HTTP client posting to
+        the scanner, calls the server start hook and starts the task dispatching the queued
+        messages, which first warms the model up. On shutdown the dispatcher and the tiles
+        in flight are cancelled, the client is closed and the server end hook is called.
+
+        :param obj app: The FastAPI application instance.
+        '''
+        self.__client = httpx.AsyncClient(
+            base_url=self.__scanner_url,
+            timeout=self.config.post_timeout,
+            limits=httpx.Limits(
+                max_connections=self.config.sender_connections,
+                max_keepalive_connections=self.config.sender_connections,
+            ),
+            headers={"Content-Type": "application/json"},
+        )
+        await _call_hook(self.on_server_start)
+        self.__dispatcher_task = asyncio.create_task(self.api_call_handler_loop())
+        yield
+        self.__dispatcher_task.cancel()
+        for task in list(self.__background_tasks):
+            task.cancel()
+        await asyncio.gather(
+            self.__dispatcher_task, *self.__background_tasks, return_exceptions=True
+        )
+        await self.__client.aclose()
+        await _call_hook(self.on_server_end)
+
+    def stats(self):
+        '''
+        :return: The counts of sent, failed and retried posts to the scanner.
+        :rtype: dict
+        '''
+        return dict(self.__stats)
+
+    async def scan_start(self, params: ScanStart, request: Request):
+        '''
+        Handles the /v1/scan/start API endpoint. This method enqueues the provided
+        scan parameters for processing and returns a response indicating the
+        request was successfully received.
+
+        :param ScanStart params: The request body for /v1/scan/start.
+        :param Request request: The incoming HTTP request.
+
+        :return: A response object with status code 200.
+        :rtype: Response
+        '''
+        self.__queue.put_nowait(params)
+        return Response(status_code=200)
+
+    async def scan_ongoing(self, params: ScanOngoing, request: Request):
+        '''
+        Handles the /v1/scan/image-tile API endpoint. This method enqueues the provided
+        scan parameters for processing and returns a response indicating the
+        request was successfully received. When `max_queue_size` is set and the queue is
+        full, the tile is handled according to `queue_full_policy`, as with
+        InlineAlgoQueueProcessor. The other messages are always queued right away.
+
+        :param ScanOngoing params: The request body for /v1/scan/image-tile.
+        :param Request request: The incoming HTTP request.
+
+        :return: A response object with status code 202, or 503 with a Retry-After header
+            if the tile was rejected because the queue is full.
+        :rtype: Response
+        '''
+        if not await self.__wait_for_room():
+            return self.__queue_full_response()
+        self.__queue.put_nowait(params)
+        return Response(status_code=202, headers=self.__queue_headers())
+
+    async def scan_end(self, params: ScanEnd, request: Request):
+        '''
+        Handles the /v1/scan/end API endpoint. This method enqueues the provided
+        scan parameters for processing and returns a response indicating the
+        request was successfully received.
+
+        :param ScanEnd params: The request body for /v1/scan/end.
+        :param Request request: The incoming HTTP request.
+
+        :return: A response object with status code 204.
+        :rtype: Response
+        '''
+        self.__queue.put_nowait(params)
+        return Response(status_code=204)
+
+    async def scan_abort(self, params: ScanAbort, request: Request):
+        '''
+        Handles the /v1/scan/abort API endpoint. The tiles of the slide being processed are
+        cancelled and their results are not posted, and its tiles still queued are skipped,
+        as with InlineAlgoQueueProcessor. The ScanAbort is then queued, so that
+        `on_scan_abort` runs in order with the other hooks.
+
+        :param ScanAbort params: The request body for /v1/scan/abort.
+        :param Request request: The incoming HTTP request.
+
+        :return: A response object with status code 204.
+        :rtype: Response
+        '''
+        self.__aborting[params.slide_name] = self.__aborting.get(params.slide_name, 0) + 1
+        self.__abort_session(params.slide_name)
+        self.__queue.put_nowait(params)
+        return Response(status_code=204)
+
+    async def queue_status(self):
+        '''
+        Handles the /v1/queue API endpoint, reporting the backlog of the algorithm.
+
+        :return: The number of messages waiting in the queue, the maximum queue size, the
+            number of tiles dropped and rejected because the queue was full, the number of
+            tiles in flight, and the tile counters of every active slide.
+        :rtype: dict
+        '''
+        return {
+            "queue_depth": self.__queue.qsize(),
+            "max_queue_size": self.config.max_queue_size,
+            "dropped_tiles": self.__dropped_tiles,
+            "rejected_tiles": self.__rejected_tiles,
+            "tiles_in_flight": sum(len(tasks) for tasks in self.__tile_tasks.values()),
+            "sessions": [
+                {
+                    "slide_name": session.slide_name,
+                    "algorithm_id": session.algorithm_id,
+                    "tiles_received": session.tiles_received,
+                    "tiles_processed": session.tiles_processed,
+                    "tiles_posted": session.tiles_posted,
+                }
+                for session in self.__sessions.values()
+            ],
+        }
+
+    async def ready(self):
+        '''
+        Handles the /ready API endpoint, see InlineAlgoQueueProcessor.ready.
+
+        :return: 200 once the model is warmed up, 503 otherwise or if the handling of
+            messages stopped on an error.
+        :rtype: Response
+        '''
+        status = self.__readiness.status()
+        if self.__error_event.is_set():
+            status.update(ready=False, state="failed", error=status["error"] or "handler error")
+        return Response(
+            content=dumps(status),
+            status_code=200 if status["ready"] else 503,
+            media_type="application/json",
+        )
+
+    async def __wait_for_room(self):
+        '''
+        Checks whether a tile fits in the queue, waiting for room with the "block" policy.
+        Messages are only added from the event loop, so the room found cannot be taken by
+        another request before the tile is enqueued.
+
+        :return: Whether the tile can be enqueued.
+        :rtype: bool
+        '''
+        if self.config.max_queue_size <= 0 or self.__queue.qsize() < self.config.max_queue_size:
+            return True
+        if self.config.queue_full_policy != "block":
+            return False
+        deadline = time.monotonic() + self.config.queue_block_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+            if self.__queue.qsize() < self.config.max_queue_size:
+                return True
+        return False
+
+    def __queue_full_response(self):
+        if self.config.queue_full_policy == "drop":
+            self.__dropped_tiles += 1
+            return Response(status_code=202, headers=self.__queue_headers())
+        self.__rejected_tiles += 1
+        headers = self.__queue_headers()
+        headers["Retry-After"] = str(self.config.retry_after)
+        return Response(status_code=503, headers=headers)
+
+    def __queue_headers(self):
+        return {"X-Queue-Depth": str(self.__queue.qsize())}
+
+    async def __warm_up(self):
+        '''
+        Runs the synthetic tiles of `get_warm_up_tiles` through `process` one at a time, or
+        through `process_batch` in batches of `batch_size`, discarding their results, and
+        records the readiness of the server. A failed warm-up is logged and leaves the
+        server not ready.
+        '''
+        self.__readiness.warming_up()
+        start_time = time.perf_counter()
+        try:
+            messages = warm_up_messages(await _call_hook(self.get_warm_up_tiles))
+            batch_size = max(self.config.batch_size, 1)
+            for start in range(0, len(messages), batch_size):
+                await self.__run_process(messages[start:start + batch_size])
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.exception("The warm-up of the algorithm failed")
+            self.__readiness.failed(e)
+            return
+        self.__readiness.warmed_up(len(messages), time.perf_counter() - start_time)
+
+    async def api_call_handler_loop(self):
+        '''
+        Hands out the queued messages in arrival order until the server shuts down.
+
+        Message Types:
+            - ScanStart: Opens a session for the slide and awaits the `on_scan_start`
+                         method.
+            - ScanOngoing: Starts a task processing the tile and posting its results, once
+                           fewer than `max_concurrency` tiles are in flight. When
+                           `batch_size` is greater than 1, the tiles of the same slide
+                           queued behind it are grouped and handed to `process_batch`.
+            - ScanEnd: Starts a task waiting for every tile of the slide, then sending a
+                       completion signal to the scanner and awaiting the `on_scan_end`
+                       method. Tiles of other slides keep flowing in the meantime.
+            - ScanAbort: Awaits the `on_scan_abort` method. The tiles and the ScanEnd of
+                         the slide queued before it are skipped, see `scan_abort`.
+
+        :raises Exception: Any exception encountered during the loop execution.
+        '''
+        try:
+            await self.__warm_up()
+            while True:
+                if self.__held_message is not None:
+                    message, self.__held_message = self.__held_message, None
+                else:
+                    message = await self.__queue.get()
+                if (
+                    isinstance(message, (ScanOngoing, ScanEnd))
+                    and message.slide_name in self.__aborting
+                ):
+                    continue
+                if isinstance(message, ScanStart):
+                    session = ScanSession(message.slide_name)
+                    session.start(message)
+                    self.__sessions[message.slide_name] = session
+                    self.__tile_tasks[session] = set()
+                    await _call_hook(self.on_scan_start, message)
+                elif isinstance(message, ScanOngoing):
+                    session = self.__get_session(message.slide_name)
+                    batch = self.__collect_batch(message)
+                    session.tiles_received += len(batch)
+                    await self.__concurrency.acquire()
+                    if session.aborted: # Aborted while waiting for a concurrency slot.
+                        self.__concurrency.release()
+                        continue
+                    task = self.__create_task(self.__handle_tiles(session, batch))
+                    # Released by a callback, as a task cancelled before it starts never
+                    # runs its finally clauses.
+                    task.add_done_callback(lambda _: self.__concurrency.release())
+                    self.__tile_tasks[session].add(task)
+                    task.add_done_callback(self.__tile_tasks[session].discard)
+                elif isinstance(message, ScanEnd):
+                    session = self.__sessions.pop(message.slide_name, None)
+                    if session is None:
+                        session = ScanSession(message.slide_name)
+                        self.__tile_tasks[session] = set()
+                    self.__ending[message.slide_name] = session
+                    self.__create_task(self.__complete_scan(session, message))
+                elif isinstance(message, ScanAbort):
+                    remaining = self.__aborting.pop(message.slide_name, 1) - 1
+                    if remaining > 0:
+                        self.__aborting[message.slide_name] = remaining
+                    self.__abort_session(message.slide_name)
+                    await _call_hook(self.on_scan_abort, message)
+
+        except Exception as e:
+            self.__error_event.set()
+            raise e
+
+    def __get_session(self, slide_name):
+        '''
+        Returns the session of a slide, opening one without scan parameters for tiles
+        received before any /v1/scan/start.
+        '''
+        session = self.__sessions.get(slide_name)
+        if session is None:
+            session = self.__sessions[slide_name] = ScanSession(slide_name)
+            self.__tile_tasks[session] = set()
+        return session
+
+    def __collect_batch(self, message):
+        '''
+        Groups a tile with the tiles of the same slide waiting in the queue right behind it,
+        up to `batch_size`. Any other message ends the batch and is handled next.
+
+        :param ScanOngoing message: The first tile of the batch.
+
+        :return: The ScanOngoing messages of the batch.
+        :rtype: list
+        '''
+        batch = [message]
+        while len(batch) < self.config.batch_size and not self.__queue.empty():
+            following = self.__queue.get_nowait()
+            if not (
+                isinstance(following, ScanOngoing)
+                and following.slide_name == message.slide_name
+            ):
+                self.__held_message = following
+                break
+            batch.append(following)
+        return batch
+
+    def __abort_session(self, slide_name):
+        '''
+        Closes the session of an aborted slide and cancels the tasks of its tiles, including
+        the session of a slide whose ScanEnd was already handled and which is waiting for
+        its tiles.
+        '''
+        for session in (self.__sessions.pop(slide_name, None), self.__ending.get(slide_name)):
+            if session is None:
+                continue
+            session.aborted = True
+            for task in self.__tile_tasks.pop(session, ()):
+                task.cancel()
+
+    def __create_task(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.__background_tasks.add(task)
+        task.add_done_callback(self.__background_tasks.discard)
+        return task
+
+    async def __run_process(self, messages):
+        '''
+        Runs `process_batch` on a batch of tiles, or `process` when batching is disabled.
+
+        :param list messages: The ScanOngoing messages of the batch.
+
+        :return: One result per message, in the same order.
+        :rtype: list
+        :raises ValueError: If `process_batch` does not return one result per message.
+        '''
+        if self.config.batch_size <= 1:
+            return [await _call_hook(self.process, message) for message in messages]
+        batch_results = await _call_hook(self.process_batch, messages)
+        if len(batch_results) != len(messages):
+            raise ValueError(
+                f"process_batch returned {len(batch_results)} results "
+                f"for {len(messages)} tiles"
+            )
+        return batch_results
+
+    async def __handle_tiles(self, session, messages):
+        '''
+        Processes a batch of tiles and posts their results, unless the scan of the slide
+        was aborted meanwhile. As in InlineAlgoQueueProcessor, an exception raised by
+        `process` stops the handling of messages: it is logged and the dispatcher is
+        cancelled.
+
+        :param ScanSession session: The session of the slide.
+        :param list messages: The ScanOngoing messages of the batch.
+        '''
+        try:
+            batch_results = await self.__run_process(messages)
+        except Exception: # pylint: disable=broad-exception-caught
+            self.__error_event.set()
+            logger.exception("Failed to process tiles %s of %s, no more messages are "
+                             "handled", [message.tile_name for message in messages],
+                             session.slide_name)
+            self.__dispatcher_task.cancel()
+            return
+        session.tiles_processed += len(messages)
+        for message, model_results in zip(messages, batch_results):
+            if model_results is not None and not session.aborted:
+                await self.__post_tile_results(session.algorithm_id, message, model_results)
+                session.tiles_posted += 1
+
+    async def __complete_scan(self, session, message):
+        '''
+        Waits for every tile of the slide, then signals the scanner that the algorithm is
+        done with the slide and runs the scan end hook. Nothing is sent if the scan was
+        aborted in the meantime.
+
+        :param ScanSession session: The session of the ended scan.
+        :param ScanEnd message: The ScanEnd message.
+        '''
+        try:
+            tile_tasks = list(self.__tile_tasks.get(session, ()))
+            await asyncio.gather(*tile_tasks, return_exceptions=True)
+        finally:
+            self.__tile_tasks.pop(session, None)
+            if self.__ending.get(session.slide_name) is session:
+                del self.__ending[session.slide_name]
+        if session.aborted:
+            return
+        data_json = {"algorithm_id": session.algorithm_id, "slide_name": session.slide_name}
+        await self.__post("/v1/algorithm-completed", json.dumps(data_json))
+        await _call_hook(self.on_scan_end, message)
+
+    async def __post_tile_results(self, algorithm_id, message, model_results):
+        '''
+        Wraps the results of one tile in a TileResults message and posts it to the
+        scanner.
+
+        :param str algorithm_id: The algorithm_id of the ongoing scan.
+        :param ScanOngoing message: The tile the results belong to.
+        :param model_results: The detections returned for the tile.
+        :type model_results: list or ColumnarDetections
+        '''
+        data = serialize_tile_results(
+            algorithm_id, message, model_results, trusted=self.config.trusted_results
+        )
+        await self.__post("/v1/tile-results", data)
+
+    async def __post(self, path, data):
+        '''
+        Posts a message to the scanner, retrying transient failures (connection errors,
+        timeouts and 5xx/429 responses) with exponential backoff. Failures are counted and
+        logged rather than raised.
+
+        :param str path: The path of the scanner endpoint, e.g. "/v1/tile-results".
+        :param data: The JSON body of the request.
+        :type data: str or bytes
+        '''
+        for attempt in range(self.config.post_retries + 1):
+            if attempt > 0:
+                self.__stats["retried"] += 1
+                await asyncio.sleep(self.config.retry_backoff * 2 ** (attempt - 1))
+            try:
+                response = await self.__client.post(path, content=data)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                error = e
+                continue
+            if response.status_code in RETRY_STATUS_CODES:
+                error = f"status code {response.status_code}"
+                continue
+            if response.status_code >= 400:
+                error = f"status code {response.status_code}"
+                break
+            self.__stats["sent"] += 1
+            return
+        self.__stats["failed"] += 1
+        logger.warning("Failed to post to %s%s: %s", self.__scanner_url, path, error)
+
+    def get_tile_image(self, message):
+        '''
+        Returns the pixels of the tile of a ScanOngoing message, reading the tile unless
+        they were attached to the message, e.g. for the synthetic tiles of the warm-up.
+        Meant to be called from a regular `process` function, which runs in a worker
+        thread. `async def process()` hooks await `get_tile_image_async` instead.
+
+        :param ScanOngoing message: The tile to load.
+
+        :return: The decoded pixels of the tile.
+        :rtype: numpy.ndarray
+        '''
+        if message.tile_image is not None:
+            return message.tile_image
+        return self.read_tile_image(message.tile_image_path)
+
+    async def get_tile_image_async(self, message):
+        '''
+        Returns the pixels of the tile of a ScanOngoing message like `get_tile_image`,
+        reading the tile in a worker thread so that the event loop is not blocked. Meant
+        to be awaited from `async def process()` hooks.
+
+        :param ScanOngoing message: The tile to load.
+
+        :return: The decoded pixels of the tile.
+        :rtype: numpy.ndarray
+        '''
+        if message.tile_image is not None:
+            return message.tile_image
+        return await asyncio.to_thread(self.read_tile_image, message.tile_image_path)
+
+    def read_tile_image(self, tile_image_path):
+        '''
+        Reads a tile image, see InlineAlgoQueueProcessor.read_tile_image.
+
+        :param str tile_image_path: The path of the tile image.
+
+        :return: The decoded pixels of the tile.
+        :rtype: numpy.ndarray
+        '''
+        return read_tile(tile_image_path)
+
+    def run(self):
+        import uvicorn # pylint: disable=import-outside-toplevel
+        uvicorn.run(
+            self.app,
+            host=self.host,
+            port=self.port,
+        )
+
+    async def on_server_start(self):
+        pass
+
+    async def on_server_end(self):
+        pass
+
+    async def get_warm_up_tiles(self):
+        return []
+
+    async def on_scan_start(self, message):
+        pass
+
+    async def process(self, message):
+        pass
+
+    async def process_batch(self, messages):
+        return await asyncio.gather(*(_call_hook(self.process, message) for message in messages))
+
+    async def on_scan_end(self, message):
+        pass
+
+    async def on_scan_abort(self, message):
+        pass
@@ -0,0 +1,402 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Cross-tile merging of the detections of a slide: objects detected twice, or cut in two
+by the border between two tiles, are merged as soon as the neighbors of their tiles have
+been processed.
+'''
+import time
+from collections import namedtuple
+import numpy as np
+from .detections import ColumnarDetections
+
+# The fields of a ScanOngoing message needed to post the results of its tile. Buffered
+# tiles keep them instead of the message, which may hold the pixels of the tile.
+TileKey = namedtuple("TileKey", ("slide_name", "tile_name", "row_idx", "col_idx"))
+
+# The offsets of the 8 neighbors of a tile in the grid, as (row, column).
+NEIGHBOR_OFFSETS = tuple(
+    (d_row, d_col) for d_row in (-1, 0, 1) for d_col in (-1, 0, 1) if d_row or d_col
+)
+
+
+def _detection_fields(detection):
+    '''
+    :param detection: A detection as a DetectionArray, a dict or a list.
+
+    :return: The bbox, confidence and class of the detection.
+    :rtype: tuple
+    '''
+    if isinstance(detection, dict):
+        return detection["bbox"], detection["confidence"], detection["class"]
+    if isinstance(detection, (list, tuple)):
+        return detection[:4], detection[4], detection[5]
+    return detection.bbox, detection.confidence, detection.class_
+
+
+def _with_box(detection, bbox, confidence):
+    '''
+    :return: A copy of the detection, in the same format, with another bbox and confidence.
+    '''
+    if isinstance(detection, dict):
+        return {**detection, "bbox": bbox, "confidence": confidence}
+    if isinstance(detection, (list, tuple)):
+        return [*bbox, confidence, *detection[5:]]
+    return detection.copy(update={"bbox": bbox, "confidence": confidence})
+
+
+def _iou_matrix(boxes_a, boxes_b):
+    '''
+    :param numpy.ndarray boxes_a: (N, 4) boxes as [x1, y1, x2, y2].
+    :param numpy.ndarray boxes_b: (M, 4) boxes as [x1, y1, x2, y2].
+
+    :return: The (N, M) intersections over union of every pair of boxes.
+    :rtype: numpy.ndarray
+    '''
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def _greedy_pairs(scores, threshold):
+    '''
+    Matches the rows and columns of a score matrix one to one, best scores first.
+
+    :param numpy.ndarray scores: The (N, M) scores of every pair.
+    :param float threshold: The minimum score of a match.
+
+    :return: The (row, column) of every match.
+    :rtype: list
+    '''
+    rows, cols = np.nonzero(scores >= threshold)
+    order = np.argsort(-scores[rows, cols], kind="stable")
+    used_rows, used_cols, pairs = set(), set(), []
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row not in used_rows and col not in used_cols:
+            used_rows.add(row)
+            used_cols.add(col)
+            pairs.append((row, col))
+    return pairs
+
+
+class _TileDetections:
+    '''
+    The detections of one processed tile, in slide coordinates, until they are emitted.
+    '''
+
+    def __init__(self, message, model_results, origin):
+        self.message = TileKey(
+            message.slide_name, message.tile_name, message.row_idx, message.col_idx
+        )
+        self.origin = origin # The (row, column) of the top left pixel of the tile.
+        self.post = model_results is not None # Whether process() returned results.
+        self.columnar = None # The ColumnarDetections returned by process(), if any.
+        if isinstance(model_results, ColumnarDetections):
+            self.columnar = model_results
+            self.items = None
+            boxes = model_results.boxes
+            self.scores = model_results.scores.astype(np.float64)
+            self.classes = model_results.class_names[model_results.class_ids]
+        else:
+            self.items = list(model_results or [])
+            fields = [_detection_fields(item) for item in self.items]
+            boxes = [bbox for bbox, _, _ in fields]
+            self.scores = np.array([confidence for _, confidence, _ in fields], dtype=np.float64)
+            self.classes = np.array([class_ for _, _, class_ in fields], dtype=object)
+        self.boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+        self.boxes[:, [0, 2]] += origin[1]
+        self.boxes[:, [1, 3]] += origin[0]
+        self.keep = np.ones(len(self.boxes), dtype=bool) # False once merged into another.
+        self.changed = np.zeros(len(self.boxes), dtype=bool) # Whether a box was grown.
+        self.added_time = time.monotonic()
+        self.emitted = False
+
+    def results(self):
+        '''
+        :return: The merged detections, in the format returned by process() and in tile
+            coordinates.
+        :rtype: list or ColumnarDetections
+        '''
+        boxes = self.boxes.copy()
+        boxes[:, [0, 2]] -= self.origin[1]
+        boxes[:, [1, 3]] -= self.origin[0]
+        if self.columnar is not None:
+            results = self.columnar.select(self.keep)
+            results.boxes = boxes[self.keep].astype(self.columnar.boxes.dtype, copy=False)
+            results.scores = self.scores[self.keep].astype(self.columnar.scores.dtype)
+            return results
+        return [
+            _with_box(item, boxes[index].tolist(), float(self.scores[index]))
+            if self.changed[index] else item
+            for index, item in enumerate(self.items)
+            if self.keep[index]
+        ]
+
+
+class DetectionMerger:
+    '''
+    Merges the detections of neighboring tiles of one slide. The detections of every
+    processed tile are kept in an index of the tile grid, keyed by row_idx and col_idx.
+    When a tile is added, the detections close to its borders are compared with those of
+    its processed neighbors, on arrays:
+
+    - Detections of two tiles overlapping by at least `iou_threshold` are duplicates, only
+      the most confident one is kept.
+    - Detections of the same class touching the border between two side by side tiles,
+      and overlapping along it by at least `min_border_overlap`, are the two halves of an
+      object cut by the border. They are replaced by their union, in the tile of the most
+      confident one, so the merged box extends past the border of its tile.
+
+    The results of a tile are emitted as soon as its 8 neighbors have been processed, or
+    once they waited `max_wait` seconds, so that results keep flowing during the scan.
+    Tiles at the top and left borders of the slide have no neighbors there; the tiles at
+    the bottom and right borders are emitted after `max_wait`, or at the end of the scan.
+
+    In "pixels" units a tile is placed at its own offsets and filed in the grid cell they
+    fall in, so tiles overlapping their neighbors are compared over the whole overlap. A
+    tile added at the position of another one, because it was sent again or because the
+    tiles overlap by more than half, is deduplicated against it and the other one is
+    emitted right away.
+
+    :param int tile_width: The width of the tiles in pixels.
+    :param int tile_height: The height of the tiles in pixels.
+    :param str tile_index_units: "grid" if row_idx and col_idx are the indices of the
+        tiles in the grid, "pixels" if they are the offsets of their top left pixel.
+    :param float iou_threshold: The overlap above which two detections are duplicates.
+    :param float border_margin: The distance in pixels from a border under which a
+        detection touches it.
+    :param float min_border_overlap: The overlap along the border, relative to the
+        smaller box, above which two detections touching it are merged.
+    :param float max_wait: The maximum time in seconds a tile waits for its neighbors.
+    :raises ValueError: If `tile_index_units` is not "grid" or "pixels".
+    '''
+
+    def __init__(
+        self,
+        tile_width,
+        tile_height,
+        tile_index_units="grid",
+        iou_threshold=0.5,
+        border_margin=4,
+        min_border_overlap=0.5,
+        max_wait=5,
+    ):
+        if tile_index_units not in ("grid", "pixels"):
+            raise ValueError(
+                f"tile_index_units must be 'grid' or 'pixels', not {tile_index_units!r}"
+            )
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.tile_index_units = tile_index_units
+        self.iou_threshold = iou_threshold
+        self.border_margin = border_margin
+        self.min_border_overlap = min_border_overlap
+        self.max_wait = max_wait
+        self.suppressed = 0 # Duplicate detections removed.
+        self.merged = 0 # Pairs of detections cut by a border merged into one.
+        self.__tiles = {} # The detections of the tiles not released yet, by grid position.
+        self.__processed = set() # The grid positions of every processed tile.
+
+    def add(self, message, model_results):
+        '''
+        Adds the results of a processed tile and merges them with its neighbors.
+
+        :param ScanOngoing message: The processed tile.
+        :param model_results: The detections returned by process(), or None.
+        :type model_results: list or ColumnarDetections
+
+        :return: The TileKey and results of the tiles whose results are final, including
+            tiles that waited `max_wait` seconds. Tiles whose process() returned None are
+            not included.
+        :rtype: list
+        '''
+        position = self.__grid_position(message)
+        if self.tile_index_units == "pixels":
+            origin = (message.row_idx, message.col_idx)
+        else:
+            origin = (position[0] * self.tile_height, position[1] * self.tile_width)
+        tile = _TileDetections(message, model_results, origin)
+        emitted = []
+        previous = self.__tiles.get(position)
+        if previous is not None:
+            self.__merge_pair(tile, previous, 0, 0)
+            if not previous.emitted:
+                emitted.extend(self.__emit(position, previous))
+        self.__tiles[position] = tile
+        self.__processed.add(position)
+        for d_row, d_col in NEIGHBOR_OFFSETS:
+            neighbor = self.__tiles.get((position[0] + d_row, position[1] + d_col))
+            if neighbor is not None:
+                self.__merge_pair(tile, neighbor, d_row, d_col)
+
+        ready = [position] + [
+            (position[0] + d_row, position[1] + d_col) for d_row, d_col in NEIGHBOR_OFFSETS
+        ]
+        deadline = time.monotonic() - self.max_wait
+        ready.extend(
+            other for other, other_tile in self.__tiles.items()
+            if not other_tile.emitted and other_tile.added_time <= deadline
+        )
+        for candidate in ready:
+            candidate_tile = self.__tiles.get(candidate)
+            if candidate_tile is None or candidate_tile.emitted:
+                continue
+            if self.__neighbors_processed(candidate) or candidate_tile.added_time <= deadline:
+                emitted.extend(self.__emit(candidate, candidate_tile))
+        return emitted
+
+    def flush(self):
+        '''
+        Emits the results of every tile still waiting for its neighbors, e.g. at the end of
+        the scan.
+
+        :return: The TileKey and results of these tiles.
+        :rtype: list
+        '''
+        emitted = []
+        for position, tile in list(self.__tiles.items()):
+            if not tile.emitted:
+                emitted.extend(self.__emit(position, tile))
+        self.__tiles.clear()
+        return emitted
+
+    def pending(self):
+        '''
+        :return: The number of tiles whose results are not emitted yet.
+        :rtype: int
+        '''
+        return sum(not tile.emitted for tile in self.__tiles.values())
+
+    def __grid_position(self, message):
+        if self.tile_index_units == "pixels":
+            return message.row_idx // self.tile_height, message.col_idx // self.tile_width
+        return message.row_idx, message.col_idx
+
+    def __neighbors_processed(self, position):
+        for d_row, d_col in NEIGHBOR_OFFSETS:
+            row, col = position[0] + d_row, position[1] + d_col
+            if row >= 0 and col >= 0 and (row, col) not in self.__processed:
+                return False
+        return True
+
+    def __emit(self, position, tile):
+        tile.emitted = True
+        # Released tiles are only kept while a neighbor may still be compared to them.
+        for candidate in [position] + [
+            (position[0] + d_row, position[1] + d_col) for d_row, d_col in NEIGHBOR_OFFSETS
+        ]:
+            candidate_tile = self.__tiles.get(candidate)
+            if (
+                candidate_tile is not None
+                and candidate_tile.emitted
+                and self.__neighbors_processed(candidate)
+            ):
+                del self.__tiles[candidate]
+        if not tile.post:
+            return []
+        return [(tile.message, tile.results())]
+
+    def __near_border(self, tile, neighbor, d_row, d_col):
+        '''
+        :return: The indices of the kept detections of the tile touching its border with
+            the neighbor at (d_row, d_col), or lying where the two tiles overlap. Every
+            kept detection of a tile at the same position is returned.
+        :rtype: numpy.ndarray
+        '''
+        mask = tile.keep.copy()
+        limits = (
+            (d_row, 1, 3, tile.origin[0], neighbor.origin[0], self.tile_height),
+            (d_col, 0, 2, tile.origin[1], neighbor.origin[1], self.tile_width),
+        )
+        for direction, low, high, start, neighbor_start, size in limits:
+            if direction < 0:
+                edge = max(start, neighbor_start + size)
+                mask &= tile.boxes[:, low] <= edge + self.border_margin
+            elif direction > 0:
+                edge = min(start + size, neighbor_start)
+                mask &= tile.boxes[:, high] >= edge - self.border_margin
+        return np.flatnonzero(mask)
+
+    def __merge_pair(self, tile, neighbor, d_row, d_col):
+        '''
+        Merges the detections of a new tile with those of its neighbor at (d_row, d_col).
+        The detections of a neighbor already emitted are left untouched, only the
+        duplicates of the new tile are removed.
+        '''
+        candidates = self.__near_border(tile, neighbor, d_row, d_col)
+        neighbor_candidates = self.__near_border(neighbor, tile, -d_row, -d_col)
+        if len(candidates) == 0 or len(neighbor_candidates) == 0:
+            return
+        ious = _iou_matrix(tile.boxes[candidates], neighbor.boxes[neighbor_candidates])
+        for row, col in _greedy_pairs(ious, self.iou_threshold):
+            index, neighbor_index = candidates[row], neighbor_candidates[col]
+            if neighbor.emitted or neighbor.scores[neighbor_index] >= tile.scores[index]:
+                tile.keep[index] = False
+            else:
+                neighbor.keep[neighbor_index] = False
+            self.suppressed += 1
+        if not neighbor.emitted and bool(d_row) != bool(d_col):
+            self.__join_cut_objects(
+                tile,
+                candidates[tile.keep[candidates]],
+                neighbor,
+                neighbor_candidates[neighbor.keep[neighbor_candidates]],
+                0 if d_row else 1,
+            )
+
+    def __join_cut_objects(self, tile, candidates, neighbor, neighbor_candidates, axis):
+        '''
+        Replaces the halves of the objects cut by the border between two side by side tiles
+        with their union.
+
+        :param int axis: The coordinate running along the border, 0 for x and 1 for y.
+        '''
+        boxes = tile.boxes[candidates]
+        neighbor_boxes = neighbor.boxes[neighbor_candidates]
+        start = np.maximum(boxes[:, None, axis], neighbor_boxes[None, :, axis])
+        end = np.minimum(boxes[:, None, axis + 2], neighbor_boxes[None, :, axis + 2])
+        extent = np.minimum(
+            (boxes[:, axis + 2] - boxes[:, axis])[:, None],
+            (neighbor_boxes[:, axis + 2] - neighbor_boxes[:, axis])[None, :],
+        )
+        overlap = np.divide(
+            np.clip(end - start, 0, None), extent,
+            out=np.zeros_like(extent), where=extent > 0,
+        )
+        overlap[tile.classes[candidates][:, None] != neighbor.classes[neighbor_candidates]] = 0
+        for row, col in _greedy_pairs(overlap, max(self.min_border_overlap, 1e-9)):
+            index, neighbor_index = candidates[row], neighbor_candidates[col]
+            if tile.scores[index] >= neighbor.scores[neighbor_index]:
+                winner, winner_index, loser, loser_index = tile, index, neighbor, neighbor_index
+            else:
+                winner, winner_index, loser, loser_index = neighbor, neighbor_index, tile, index
+            winner.boxes[winner_index, :2] = np.minimum(
+                winner.boxes[winner_index, :2], loser.boxes[loser_index, :2]
+            )
+            winner.boxes[winner_index, 2:] = np.maximum(
+                winner.boxes[winner_index, 2:], loser.boxes[loser_index, 2:]
+            )
+            winner.changed[winner_index] = True
+            loser.keep[loser_index] = False
+            self.merged += 1
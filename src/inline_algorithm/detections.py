@@ -0,0 +1,135 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+A columnar container for the detections of a tile, that `process` can return instead of
+a list of DetectionArray.
+'''
+import numpy as np
+
+
+class ColumnarDetections:
+    '''
+    The detections of a tile as NumPy arrays, the way detection models output them: one
+    row of `boxes`, `scores` and `class_ids` per detection, and a table of class names
+    indexed by `class_ids`. Filtering runs on the arrays, and the detections are only
+    turned into Python objects once, when the results are serialized.
+
+    :param boxes: The (N, 4) boxes, as [x1, y1, x2, y2] in tile pixels.
+    :type boxes: numpy.ndarray
+    :param scores: The (N,) confidences.
+    :type scores: numpy.ndarray
+    :param class_ids: The (N,) indices of the classes in `class_names`.
+    :type class_ids: numpy.ndarray
+    :param list class_names: The names of the classes.
+    :param bool compact: Whether to send the detections in the compact List[List] form,
+        [x1, y1, x2, y2, confidence, class], rather than as DetectionArray objects.
+    :raises ValueError: If the arrays do not have matching shapes, or a class id is not an
+        index of `class_names`.
+    '''
+
+    def __init__(self, boxes, scores, class_ids, class_names, compact=False):
+        boxes = np.asarray(boxes)
+        scores = np.asarray(scores)
+        class_ids = np.asarray(class_ids)
+        if boxes.ndim != 2 or boxes.shape[1] != 4:
+            raise ValueError(f"boxes must have a (N, 4) shape, not {boxes.shape}")
+        if scores.shape != (len(boxes),) or class_ids.shape != (len(boxes),):
+            raise ValueError(
+                f"scores and class_ids must have a ({len(boxes)},) shape, "
+                f"not {scores.shape} and {class_ids.shape}"
+            )
+        if not np.issubdtype(class_ids.dtype, np.integer) and len(class_ids) > 0:
+            raise ValueError(f"class_ids must be integers, not {class_ids.dtype}")
+        if len(class_ids) > 0 and not 0 <= class_ids.min() <= class_ids.max() < len(class_names):
+            raise ValueError(
+                f"class_ids must be between 0 and {len(class_names) - 1}, "
+                f"not {class_ids.min()} to {class_ids.max()}"
+            )
+        self.boxes = boxes
+        self.scores = scores
+        self.class_ids = class_ids.astype(np.intp, copy=False)
+        self.class_names = np.asarray(class_names, dtype=object)
+        self.compact = compact
+
+    def __len__(self):
+        return len(self.scores)
+
+    def select(self, indices):
+        '''
+        :param indices: A boolean mask or the indices of the detections to keep.
+        :type indices: numpy.ndarray
+
+        :return: The selected detections, in the order of `indices`.
+        :rtype: ColumnarDetections
+        '''
+        return ColumnarDetections(
+            self.boxes[indices],
+            self.scores[indices],
+            self.class_ids[indices],
+            self.class_names,
+            compact=self.compact,
+        )
+
+    def filter_confidence(self, threshold):
+        '''
+        :param float threshold: The minimum confidence of the detections to keep.
+
+        :return: The detections with a confidence of at least `threshold`.
+        :rtype: ColumnarDetections
+        '''
+        return self.select(self.scores >= threshold)
+
+    def top_k(self, k):
+        '''
+        :param int k: The maximum number of detections to keep.
+
+        :return: The `k` most confident detections, by decreasing confidence, none if `k`
+            is not positive.
+        :rtype: ColumnarDetections
+        '''
+        k = min(max(k, 0), len(self))
+        if 0 < k < len(self):
+            indices = np.argpartition(self.scores, len(self) - k)[len(self) - k:]
+        else:
+            indices = np.arange(len(self) - k, len(self))
+        return self.select(indices[np.argsort(self.scores[indices], kind="stable")[::-1]])
+
+    def to_detection_array(self):
+        '''
+        :return: The detections in the wire format of /v1/tile-results: a list of
+            DetectionArray dicts, with the same keys as validated ones, or of
+            [x1, y1, x2, y2, confidence, class] lists in compact mode.
+        :rtype: list
+        '''
+        if self.compact:
+            rows = np.empty((len(self), 6), dtype=object)
+            rows[:, :4] = self.boxes
+            rows[:, 4] = self.scores
+            rows[:, 5] = self.class_names[self.class_ids]
+            return rows.tolist()
+        return [
+            {"bbox": bbox, "confidence": confidence, "class": class_name,
+             "scan_at_other_mag": None}
+            for bbox, confidence, class_name in zip(
+                self.boxes.tolist(),
+                self.scores.tolist(),
+                self.class_names[self.class_ids].tolist(),
+            )
+        ]
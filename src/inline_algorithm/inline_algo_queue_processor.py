@@ -21,34 +21,126 @@ under the License.
 An implementation of the AbstractInlineAlgorithm to run within a FastAPI server 
 and utilizing a queue to manage events.
 '''
-import json
+import os
+import time
+import asyncio
+import logging
 from contextlib import asynccontextmanager
-from queue import Queue
+from dataclasses import replace
 from threading import Thread, Event
-import requests
 from fastapi import FastAPI, Request, APIRouter, Response
-import uvicorn
+import numpy as np
 from .abstract_inline_algorithm import AbstractInlineAlgorithm
-from .models import ScanStart, ScanOngoing, ScanEnd, ScanAbort, AoiResults, TileResults
+from .metrics import PipelineMetrics, SlideCounters
+from .processor_config import ProcessorConfig
+from .result_poster import ResultPoster
+from .result_sender import ResultSender
+from .scan_sessions import SessionScheduler
+from .tile_prefetcher import TilePrefetcher
+from .tile_buffer import SharedTileRing
+from .result_cache import TileResultCache, combine_results
+from .tile_reader import read_tile
+from .serialization import dumps
+from .tracing import SpanTracer, ProcessProfiler, NULL_SPAN
+from .readiness import Readiness
+from .worker_pool import WorkerPool, run_process, warm_up
+from .models import ScanStart, ScanOngoing, ScanEnd, ScanAbort
+
+logger = logging.getLogger(__name__)
 
 
 class InlineAlgoQueueProcessor(AbstractInlineAlgorithm):
     ''' 
     Initializes parameters such as port, host, and docker mode, and sets up a queue and
     an error event for managing a task that will read messages populated in a queue.
+    The queue keeps one session per slide, holding the parameters of its ScanStart, so
+    several slides can be scanned at the same time and their tiles are interleaved fairly.
+    Before the first message is handled the model is warmed up with the synthetic tiles of
+    `get_warm_up_tiles`, and /ready only reports the server ready once they are processed.
 
     :param int port: The port number the FastAPI app will run on.
     :param str host: The host address the FastAPI app will bind to
     :param bool docker_mode: A flag indicating if the application is running in Docker mode.
+    :param ProcessorConfig config: The options of the pipeline, the defaults of
+        ProcessorConfig if not given.
+    :param options: Options overriding the ones of `config`, as keyword arguments named
+        after the fields of ProcessorConfig, e.g. `num_workers=4`.
+    :raises TypeError: If an option is not a field of ProcessorConfig.
+    :raises ValueError: If an option has an invalid value, see ProcessorConfig.
     '''
 
-    def __init__(self, port, host, docker_mode=True):
+    def __init__(self, port, host, docker_mode=True, config=None, **options):
+        config = replace(config or ProcessorConfig(), **options)
         self.port = port
         self.host = host
         self.docker_mode = docker_mode
-
-        self.__queue = Queue() # A queue to manage API messages.
+        self.config = config # The options of the pipeline.
+
+        # The pipeline metrics served on /metrics, if enabled.
+        self.__metrics = PipelineMetrics() if config.enable_metrics else None
+        # Records the spans of the pipeline stages, if enabled.
+        self.__tracer = SpanTracer(config.trace_buffer_size) if config.enable_tracing else None
+        # Captures cProfile statistics of process() on demand, if enabled.
+        self.__profiler = ProcessProfiler() if config.enable_profiling else None
+        self.__queue = SessionScheduler( # A queue of API messages per slide.
+            queue_wait_histogram=self.__metrics.queue_wait if self.__metrics else None,
+            tracer=self.__tracer,
+        )
+        self.__dropped_tiles = 0 # Tiles accepted but dropped because the queue was full.
+        self.__rejected_tiles = 0 # Tiles rejected because the queue was full.
+        # Processes the tiles in a pool of threads or processes, if num_workers > 1.
+        self.__pool = None
+        if config.num_workers > 1:
+            self.__pool = WorkerPool(
+                self, config.num_workers, config.worker_mode, self.__profiler
+            )
+        hostname = "host.docker.internal" if docker_mode else "localhost"
+        # Posts results to the scanner off the inference path.
+        self.__result_sender = ResultSender(
+            f"http://{hostname}:8001",
+            num_connections=config.sender_connections,
+            max_queue_size=config.sender_queue_size,
+            max_retries=config.post_retries,
+            timeout=config.post_timeout,
+            retry_backoff=config.retry_backoff,
+            latency_histogram=self.__metrics.post_latency if self.__metrics else None,
+            batch_max_messages=config.result_batch_size,
+            batch_max_bytes=config.result_batch_max_bytes,
+            batch_interval=config.result_batch_interval_ms / 1000,
+            tracer=self.__tracer,
+        )
+        # Merges, serializes and queues the results of the tiles to the result sender.
+        self.__result_poster = ResultPoster(
+            self.__result_sender,
+            trusted_results=config.trusted_results,
+            merger_options=config.merger_options(),
+            metrics=self.__metrics,
+            tracer=self.__tracer,
+        )
+        self.__result_cache = None # Caches the results of tiles by content, if enabled.
+        if config.result_cache_enabled:
+            self.__result_cache = TileResultCache(
+                model_version=config.model_version,
+                max_entries=config.result_cache_entries,
+                disk_path=config.result_cache_dir,
+                max_disk_bytes=config.result_cache_disk_bytes,
+            )
+        self.__prefetcher = None # Reads tiles ahead of process(), if enabled.
+        if config.prefetch_workers > 0:
+            self.__prefetcher = TilePrefetcher(
+                self.read_tile_image,
+                num_readers=config.prefetch_workers,
+                max_tiles=config.prefetch_depth,
+                max_bytes=config.prefetch_max_bytes,
+                # The readers hash the tiles for the result cache, off the handler thread.
+                on_loaded=self.__result_cache.prepare if self.__result_cache else None,
+            )
+        # Holds the pixels of the tiles uploaded to /v1/scan/image-tile/raw, if enabled.
+        self.__tile_ring = None
+        if config.raw_tile_buffer_bytes > 0:
+            self.__tile_ring = SharedTileRing(config.raw_tile_buffer_bytes)
         self.__error_event = Event() # An event to handle error states.
+        self.__readiness = Readiness() # Whether the model is warmed up, served on /ready.
         self.app = FastAPI(lifespan=self.lifespan) # The FastAPI application instance.
         self.__router = APIRouter() # The FastAPI router for handling routes.
 
@@ -60,9 +152,71 @@ class InlineAlgoQueueProcessor(AbstractInlineAlgorithm):
         self.__router.add_api_route(
             "/v1/scan/image-tile", self.scan_ongoing, methods=["POST"]
         )
+        if self.__tile_ring is not None:
+            self.__router.add_api_route(
+                "/v1/scan/image-tile/raw", self.scan_ongoing_raw, methods=["POST"]
+            )
         self.__router.add_api_route("/v1/scan/abort", self.scan_abort, methods=["PUT"])
+        self.__router.add_api_route("/v1/queue", self.queue_status, methods=["GET"])
+        self.__router.add_api_route("/ready", self.ready, methods=["GET"])
+        if self.__metrics is not None:
+            self.__init_metrics()
+            self.__router.add_api_route("/metrics", self.metrics, methods=["GET"])
+        if self.__tracer is not None:
+            self.__router.add_api_route("/debug/trace", self.debug_trace, methods=["GET"])
+        if self.__profiler is not None:
+            self.__router.add_api_route(
+                "/debug/profile", self.start_profile, methods=["POST"]
+            )
+            self.__router.add_api_route(
+                "/debug/profile", self.profile_report, methods=["GET"]
+            )
         self.app.include_router(self.__router)
 
+    def __init_metrics(self):
+        sender_stats = self.__result_sender.stats
+        collectors = (
+            ("inline_algorithm_queue_depth", "Messages waiting in the queue.", "gauge",
+             self.__queue.qsize),
+            ("inline_algorithm_tiles_dropped_total", "Tiles dropped because the queue was full.",
+             "counter", lambda: self.__dropped_tiles),
+            ("inline_algorithm_tiles_rejected_total", "Tiles rejected because the queue was full.",
+             "counter", lambda: self.__rejected_tiles),
+            ("inline_algorithm_post_queue_depth", "Messages waiting to be posted to the scanner.",
+             "gauge", self.__result_sender.qsize),
+            ("inline_algorithm_posts_sent_total", "Messages posted to the scanner.",
+             "counter", lambda: sender_stats()["sent"]),
+            ("inline_algorithm_posts_failed_total", "Messages that could not be posted.",
+             "counter", lambda: sender_stats()["failed"]),
+            ("inline_algorithm_posts_retried_total", "Retries of posts to the scanner.",
+             "counter", lambda: sender_stats()["retried"]),
+            ("inline_algorithm_posts_dropped_total",
+             "Messages dropped because the outbound queue was full.",
+             "counter", lambda: sender_stats()["dropped"]),
+            ("inline_algorithm_posts_cancelled_total",
+             "Messages dropped because the scan of their slide was aborted.",
+             "counter", lambda: sender_stats()["cancelled"]),
+            ("inline_algorithm_post_batches_total", "Batches of tile results queued to be posted.",
+             "counter", lambda: sender_stats()["batches"]),
+            ("inline_algorithm_ready", "Whether the model is warmed up and tiles are served.",
+             "gauge", lambda: int(self.__readiness.ready)),
+        )
+        if self.__result_cache is not None:
+            cache_stats = self.__result_cache.stats
+            collectors += (
+                ("inline_algorithm_result_cache_hits_total",
+                 "Tiles whose results were found in the result cache.",
+                 "counter", lambda: cache_stats()["hits"]),
+                ("inline_algorithm_result_cache_misses_total",
+                 "Tiles whose results were not found in the result cache.",
+                 "counter", lambda: cache_stats()["misses"]),
+                ("inline_algorithm_result_cache_bytes_saved_total",
+                 "Bytes of the tiles whose results were found in the result cache.",
+                 "counter", lambda: cache_stats()["bytes_saved"]),
+            )
+        for collector in collectors:
+            self.__metrics.add_collector(*collector)
+
     @asynccontextmanager
     async def lifespan(self, app: FastAPI):
         '''
@@ -73,17 +227,73 @@ class InlineAlgoQueueProcessor(AbstractInlineAlgorithm):
         startup and self.on_server_end() will be called when the FastAPI application 
         gracefully shutdown.
 
+        When a worker pool is configured, it is started here, see WorkerPool.
+
+        The handler thread warms the model up before handling the first message, the
+        server accepts requests meanwhile and /ready reports when it is done.
+
         :param obj app: The FastAPI application instance.
         '''
+        self.__result_sender.start()
+        if self.__pool is not None:
+            self.__pool.start(
+                self.__post_batch_results,
+                self.__complete_scan,
+                self.__release_tiles,
+                self.__error_event,
+            )
+        if self.__pool is None or self.config.worker_mode == "thread":
+            self.on_server_start()
         thread_handle = Thread(
             target=self.api_call_handler_loop,
             daemon=True,
         )
         thread_handle.start()
-        self.on_server_start()
         yield
+        if self.__pool is not None:
+            self.__pool.shutdown()
+        if self.__prefetcher is not None:
+            self.__prefetcher.shutdown()
+        if self.__tile_ring is not None:
+            self.__tile_ring.close()
+        self.__result_sender.stop()
         self.on_server_end()
 
+    @property
+    def result_sender(self):
+        '''
+        The ResultSender posting messages to the scanner, e.g. to read its `stats()`.
+        '''
+        return self.__result_sender
+
+    @property
+    def result_cache(self):
+        '''
+        The TileResultCache of the tile results, e.g. to read its `stats()`, or None if
+        result caching is disabled.
+        '''
+        return self.__result_cache
+
+    def __getstate__(self):
+        '''
+        Drops the server state (FastAPI app, queues, threads and pools) when the
+        algorithm is pickled to the workers of a process pool. Attributes set by
+        subclasses are kept.
+        '''
+        return {
+            key: value
+            for key, value in self.__dict__.items()
+            if key != "app" and not key.startswith("_InlineAlgoQueueProcessor__")
+        }
+
+    def __setstate__(self, state):
+        '''
+        Restores the algorithm in a worker of a process pool. Workers trace nothing, their
+        `process` calls are traced by the server process.
+        '''
+        self.__dict__.update(state)
+        self.__tracer = None
+
     async def scan_start(self, params: ScanStart, request: Request):
         '''
         Handles the /v1/scan/start API endpoint. This method enqueues the provided
@@ -112,11 +322,293 @@ class InlineAlgoQueueProcessor(AbstractInlineAlgorithm):
         :param ScanOngoing params: The request body for /v1/scan/image-tile.
         :param Request request: The incoming HTTP request.
 
-        :return: A response object with status code 202.
+        When `max_queue_size` is set and the queue is full, the tile is handled according
+        to `queue_full_policy`. Every response carries the current queue depth in an
+        X-Queue-Depth header so that the scanner can pace itself.
+
+        :return: A response object with status code 202, or 503 with a Retry-After header
+            if the tile was rejected because the queue is full.
         :rtype: Response
         '''
-        self.__queue.put(params)
-        return Response(status_code=202)
+        with self.__span("http.image-tile", params.slide_name, params.tile_name):
+            if not await self.__wait_for_room():
+                return self.__queue_full_response()
+            if self.__prefetcher is not None:
+                self.__prefetcher.submit(params)
+            self.__queue.put(params)
+            if self.__metrics is not None:
+                self.__metrics.tiles.inc(params.slide_name, SlideCounters.RECEIVED)
+            return Response(status_code=202, headers=self.__queue_headers())
+
+    async def scan_ongoing_raw(
+        self,
+        request: Request,
+        slide_name: str,
+        tile_name: str,
+        row_idx: int,
+        col_idx: int,
+        width: int,
+        height: int,
+        channels: int = 3,
+        dtype: str = "uint8",
+    ):
+        '''
+        Handles the /v1/scan/image-tile/raw API endpoint, only served when
+        `raw_tile_buffer_bytes` is set. The body of the request holds the pixels of the
+        tile, row by row and with interleaved channels, and the fields of a ScanOngoing
+        message are passed in the query string together with the shape and type of the
+        pixels. The pixels are streamed into the shared memory ring buffer and the tile is
+        enqueued like the ones of /v1/scan/image-tile, with an empty `tile_image_path`;
+        `get_tile_image` returns them as a read-only array of shape (height, width) or
+        (height, width, channels), without copying them again. Their room in the buffer is
+        reclaimed once `process` has returned, so the array must not be kept after that.
+
+        When the ring buffer is full, the tile waits for room and is rejected like a tile
+        finding the queue full.
+
+        :param Request request: The incoming HTTP request.
+        :param str slide_name: The slide_name of the tile.
+        :param str tile_name: The tile_name of the tile.
+        :param int row_idx: The row_idx of the tile.
+        :param int col_idx: The col_idx of the tile.
+        :param int width: The width of the tile in pixels.
+        :param int height: The height of the tile in pixels.
+        :param int channels: The number of channels of the pixels.
+        :param str dtype: The NumPy type of the pixel values, e.g. "uint8" or "<u2".
+
+        :return: A response object with status code 202, 400 if the body does not match the
+            shape of the tile or its Content-Length is invalid, 411 if the request has no
+            Content-Length, 413 if the tile does not fit in the ring buffer, or 503 with a
+            Retry-After header if the tile was rejected because the queue or the ring
+            buffer is full.
+        :rtype: Response
+        '''
+        with self.__span("http.image-tile-raw", slide_name, tile_name):
+            try:
+                pixel_type = np.dtype(dtype)
+            except TypeError:
+                pixel_type = None
+            if pixel_type is None or pixel_type.kind not in "biuf":
+                return Response(status_code=400, content=f"Unsupported dtype {dtype!r}")
+            shape = (height, width) if channels == 1 else (height, width, channels)
+            nbytes = height * width * channels * pixel_type.itemsize
+            content_length = request.headers.get("content-length")
+            if content_length is None:
+                return Response(status_code=411, content="The Content-Length header is missing")
+            if not content_length.isdigit():
+                return Response(
+                    status_code=400, content=f"Invalid Content-Length {content_length!r}"
+                )
+            if min(shape) <= 0 or int(content_length) != nbytes:
+                return Response(
+                    status_code=400,
+                    content=f"Expected {nbytes} bytes of pixels for a tile of shape {shape}",
+                )
+            if nbytes > self.__tile_ring.capacity:
+                return Response(status_code=413, content="The tile is larger than the ring buffer")
+            if not await self.__wait_for_room():
+                return self.__queue_full_response()
+            message = ScanOngoing(
+                slide_name=slide_name,
+                tile_name=tile_name,
+                tile_image_path="",
+                row_idx=row_idx,
+                col_idx=col_idx,
+            )
+            shared_tile = await self.__allocate_tile(message, shape, dtype)
+            if shared_tile is None:
+                return self.__queue_full_response()
+            buffer = shared_tile.buffer()
+            received = 0
+            try:
+                async for chunk in request.stream():
+                    if received + len(chunk) > nbytes:
+                        break
+                    buffer[received:received + len(chunk)] = chunk
+                    received += len(chunk)
+            finally:
+                buffer.release()
+            if received != nbytes:
+                self.__tile_ring.release(message)
+                return Response(
+                    status_code=400,
+                    content=f"Expected {nbytes} bytes of pixels for a tile of shape {shape}",
+                )
+            message.attach_tile_image(shared_tile)
+            if self.__result_cache is not None:
+                await asyncio.to_thread(self.__result_cache.prepare, message)
+            self.__queue.put(message)
+            if self.__metrics is not None:
+                self.__metrics.tiles.inc(slide_name, SlideCounters.RECEIVED)
+            return Response(status_code=202, headers=self.__queue_headers())
+
+    async def metrics(self):
+        '''
+        Handles the /metrics API endpoint, only served when `enable_metrics` is set.
+
+        :return: The pipeline metrics in the Prometheus text exposition format.
+        :rtype: Response
+        '''
+        return Response(
+            content=self.__metrics.render(),
+            media_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+    async def debug_trace(self, slide_name: str | None = None):
+        '''
+        Handles the /debug/trace API endpoint, only served when `enable_tracing` is set.
+        Open the trace in chrome://tracing or https://ui.perfetto.dev.
+
+        :param str slide_name: Only export the spans of this slide, or every span kept.
+
+        :return: The spans in the Chrome trace event JSON format.
+        :rtype: Response
+        '''
+        return Response(
+            content=dumps(self.__tracer.chrome_trace(slide_name)),
+            media_type="application/json",
+        )
+
+    async def start_profile(self, calls: int = 20, every: int = 1):
+        '''
+        Handles POST /debug/profile, only served when `enable_profiling` is set. Starts a
+        cProfile capture of `process`, or of `process_batch`, discarding the previous one.
+        In process mode the calls run in the workers and are not profiled.
+
+        :param int calls: The number of calls to profile.
+        :param int every: Profile one call in `every`.
+
+        :return: The status of the capture.
+        :rtype: dict
+        '''
+        self.__profiler.start(calls, every)
+        return self.__profiler.status()
+
+    async def profile_report(self, sort: str = "cumulative", limit: int = 40):
+        '''
+        Handles GET /debug/profile, only served when `enable_profiling` is set.
+
+        :param str sort: A value of pstats.SortKey, e.g. "cumulative" or "time".
+        :param int limit: The number of functions listed.
+
+        :return: The statistics of the calls profiled so far, as text, or 400 if `sort` is
+            not a value of pstats.SortKey.
+        :rtype: Response
+        '''
+        status = self.__profiler.status()
+        try:
+            report = await asyncio.to_thread(self.__profiler.report, sort, limit)
+        except ValueError as e:
+            return Response(status_code=400, content=str(e))
+        header = f"Profiled calls: {status['profiled']}, remaining: {status['remaining']}\n"
+        return Response(content=header + report, media_type="text/plain; charset=utf-8")
+
+    async def queue_status(self):
+        '''
+        Handles the /v1/queue API endpoint, reporting the backlog of the algorithm.
+
+        :return: The number of messages waiting in the queue, the maximum queue size, the
+            number of tiles dropped and rejected because the queue was full, the queue
+            depth and tile counters of every active slide and, when they are enabled, the
+            usage of the ring buffer of raw tile uploads and the result cache statistics.
+        :rtype: dict
+        '''
+        status = {
+            "queue_depth": self.__queue.qsize(),
+            "max_queue_size": self.config.max_queue_size,
+            "dropped_tiles": self.__dropped_tiles,
+            "rejected_tiles": self.__rejected_tiles,
+            "sessions": [
+                {
+                    "slide_name": session.slide_name,
+                    "algorithm_id": session.algorithm_id,
+                    "queue_depth": len(session.messages),
+                    "tiles_received": session.tiles_received,
+                    "tiles_processed": session.tiles_processed,
+                    "tiles_posted": session.tiles_posted,
+                    "tiles_cancelled": session.tiles_cancelled,
+                }
+                for session in self.__queue.sessions()
+            ],
+        }
+        if self.__tile_ring is not None:
+            status["raw_tile_buffer"] = self.__tile_ring.stats()
+        if self.__result_cache is not None:
+            status["result_cache"] = self.__result_cache.stats()
+        return status
+
+    async def ready(self):
+        '''
+        Handles the /ready API endpoint, meant as the readiness probe of the container.
+
+        :return: 200 once the model is warmed up, 503 while it is warming up, if the
+            warm-up failed or if the handler thread stopped on an error. The body holds the
+            state of the server and the number of synthetic tiles processed at warm-up and
+            its duration, see Readiness.
+        :rtype: Response
+        '''
+        status = self.__readiness.status()
+        if self.__error_event.is_set():
+            status.update(ready=False, state="failed", error=status["error"] or "handler error")
+        return Response(
+            content=dumps(status),
+            status_code=200 if status["ready"] else 503,
+            media_type="application/json",
+        )
+
+    async def __wait_for_room(self):
+        '''
+        Checks whether a tile fits in the queue, waiting for room with the "block" policy.
+        Messages are only added from the event loop, so the room found cannot be taken by
+        another request before the tile is enqueued.
+
+        :return: Whether the tile can be enqueued.
+        :rtype: bool
+        '''
+        if self.config.max_queue_size <= 0 or self.__queue.qsize() < self.config.max_queue_size:
+            return True
+        if self.config.queue_full_policy != "block":
+            return False
+        deadline = time.monotonic() + self.config.queue_block_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+            if self.__queue.qsize() < self.config.max_queue_size:
+                return True
+        return False
+
+    async def __allocate_tile(self, message, shape, dtype):
+        '''
+        Reserves room in the ring buffer for the pixels of a raw tile, waiting for tiles to
+        be processed with the "block" policy like `__wait_for_room`.
+
+        :return: The handle of the tile, or None if no room was found.
+        :rtype: SharedTile
+        '''
+        shared_tile = self.__tile_ring.allocate(message, shape, dtype)
+        if shared_tile is not None or self.config.queue_full_policy != "block":
+            return shared_tile
+        deadline = time.monotonic() + self.config.queue_block_timeout
+        while shared_tile is None and time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+            shared_tile = self.__tile_ring.allocate(message, shape, dtype)
+        return shared_tile
+
+    def __queue_full_response(self):
+        if self.config.queue_full_policy == "drop":
+            self.__dropped_tiles += 1
+            return Response(status_code=202, headers=self.__queue_headers())
+        self.__rejected_tiles += 1
+        headers = self.__queue_headers()
+        headers["Retry-After"] = str(self.config.retry_after)
+        return Response(status_code=503, headers=headers)
+
+    def __queue_headers(self):
+        return {"X-Queue-Depth": str(self.__queue.qsize())}
+
+    def __span(self, name, slide_name, tile_name):
+        if self.__tracer is None:
+            return NULL_SPAN
+        return self.__tracer.span(name, slide_name, tile_name)
 
     async def scan_end(self, params: ScanEnd, request: Request):
         '''
@@ -137,9 +629,12 @@ class InlineAlgoQueueProcessor(AbstractInlineAlgorithm):
 
     async def scan_abort(self, params: ScanAbort, request: Request):
         '''
-        Handles the /v1/scan/abort API endpoint. This method enqueues the provided
-        scan parameters for processing and returns a response indicating the
-        request was successfully received.
+        Handles the /v1/scan/abort API endpoint. The abort takes effect right away: the
+        tiles of the slide still queued are dropped without being processed, and their
+        prefetches cancelled, the batches of the slide not started by the worker pool are
+        cancelled, the results of the slide waiting to be posted are dropped, and the
+        results of the tiles being processed will not be posted. The ScanAbort is then
+        queued ahead of the tiles of the other slides, to run the `on_scan_abort` hook.
 
         Refer to the API documentation links at the top of this page for more information.
 
@@ -149,7 +644,13 @@ class InlineAlgoQueueProcessor(AbstractInlineAlgorithm):
         :return: A response object with status code 204.
         :rtype: Response
         '''
-        self.__queue.put(params)
+        session, dropped = self.__queue.abort(params)
+        self.__release_tiles(dropped)
+        if session is not None:
+            # cancel may wait for a batch of the slide being queued under backpressure
+            await asyncio.to_thread(self.__result_sender.cancel, params.slide_name)
+            if self.__pool is not None:
+                self.__pool.cancel(session)
         return Response(status_code=204)
 
     def api_call_handler_loop(self):
@@ -163,66 +664,222 @@ class InlineAlgoQueueProcessor(AbstractInlineAlgorithm):
         This method runs in an infinite loop until an exception occurs, setting an error
         event if an exception is raised.
 
+        Messages are taken from the sessions of the slides being scanned in turn, and
+        every message is handled with the parameters of its own slide's ScanStart.
+
         Message Types:
-            - ScanStart: Triggers the `on_scan_start` method.
-            - ScanOngoing: Processes tile data and sends results to a specific URL.
+            - ScanStart: Records the scan parameters in the slide's session, with a
+                         DetectionMerger if `merge_detections` is set, and triggers the
+                         `on_scan_start` method.
+            - ScanOngoing: Processes tile data and sends results to a specific URL. When
+                           `batch_size` is greater than 1, consecutive tiles of the same
+                           slide are grouped and handed to `process_batch`.
             - ScanEnd: Sends a completion signal to a specific URL and triggers the
                        `on_scan_end` method.
-            - ScanAbort: Triggers the `on_scan_abort` method.
+            - ScanAbort: Triggers the `on_scan_abort` method. It is queued ahead of the
+                         tiles, which /v1/scan/abort already dropped, see `scan_abort`.
 
         :raises BaseException: Any exception encountered during the loop execution.
         '''
         try:
+            self.__warm_up()
             while True:
-                message = self.__queue.get()
+                session, message = self.__queue.get()
                 if isinstance(message, ScanStart):
-                    algorithm_id = message.algorithm_id
-                    slide_name = message.slide_name
+                    session.start(message)
+                    self.__result_poster.start_scan(session, message)
                     self.on_scan_start(message)
                 elif isinstance(message, ScanOngoing):
-                    slide_name = message.slide_name
-                    tile_name = message.tile_name
-                    row_idx = message.row_idx
-                    col_idx = message.col_idx
-                    model_results = self.process(message)
-                    if model_results is not None:
-                        results_dict = {
-                            "row_idx": row_idx,
-                            "col_idx": col_idx,
-                            "detection_array": model_results,
-                        }
-                        results = AoiResults(**results_dict)
-                        data_json = {
-                            "algorithm_id": algorithm_id,
-                            "slide_name": slide_name,
-                            "tile_name": tile_name,
-                            "results": results.dict(by_alias=True),
-                        }
-                        tile_results = TileResults(**data_json)
-                        tile_results_dict = tile_results.dict(by_alias=True)
-                        hostname = (
-                            "host.docker.internal" if self.docker_mode else "localhost"
-                        )
-                        url = f"http://{hostname}:8001/v1/tile-results"
-                        requests.post(url, data=json.dumps(tile_results_dict), timeout=1)
+                    batch = self.__collect_batch(session, message)
+                    if self.__prefetcher is not None:
+                        for tile in batch:
+                            self.__prefetcher.dequeued(tile)
+                    self.__dispatch(session, batch)
                 elif isinstance(message, ScanEnd):
-                    data_json = {"algorithm_id": algorithm_id, "slide_name": slide_name}
-                    hostname = (
-                        "host.docker.internal" if self.docker_mode else "localhost"
-                    )
-                    url = f"http://{hostname}:8001/v1/algorithm-completed"
-                    requests.post(url, data=json.dumps(data_json), timeout=1)
-                    self.on_scan_end(message)
+                    if self.__pool is None:
+                        self.__complete_scan(session, message)
+                    else:
+                        self.__pool.end_scan(session, message)
                 elif isinstance(message, ScanAbort):
-                    algorithm_id = ""
-                    slide_name = ""
+                    self.__result_poster.abort_scan(session)
                     self.on_scan_abort(message)
 
         except BaseException as e:
             self.__error_event.set()
             raise e
 
+    def __warm_up(self):
+        '''
+        Warms the model up, on the handler thread or in every worker process in process
+        mode, and records the readiness of the server. A failed warm-up is logged and
+        leaves the server not ready, the tiles received are still processed.
+        '''
+        self.__readiness.warming_up()
+        start_time = time.perf_counter()
+        try:
+            if self.__pool is not None and self.config.worker_mode == "process":
+                tiles = self.__pool.wait_for_workers()
+            else:
+                tiles = warm_up(self)
+        except Exception as e: # pylint: disable=broad-exception-caught
+            logger.exception("The warm-up of the algorithm failed")
+            self.__readiness.failed(e)
+            return
+        self.__readiness.warmed_up(tiles, time.perf_counter() - start_time)
+
+    def __dispatch(self, session, batch):
+        '''
+        Processes a batch on the handler thread and posts its results, or hands it to the
+        worker pool. With the result cache, only the tiles whose results are not cached
+        are processed, and the results of the whole batch are still posted together and
+        in order.
+
+        :param ScanSession session: The session of the slide.
+        :param list batch: The tiles of the batch.
+        '''
+        cached_results, missed = None, batch
+        if self.__result_cache is not None:
+            cached_results, missed = self.__result_cache.lookup_batch(batch, self.__tracer)
+        if self.__pool is not None:
+            self.__pool.submit(session, batch, missed, cached_results)
+            return
+        batch_results, timing = (
+            run_process(self, missed, self.__profiler) if missed else ([], None)
+        )
+        self.__post_batch_results(
+            session, batch, combine_results(cached_results, batch_results), timing
+        )
+
+    def __collect_batch(self, session, first_message):
+        '''
+        Drains up to `batch_size` tiles of the slide's session, waiting at most
+        `batch_timeout_ms` after the first one. Any other message of the slide ends the
+        batch, so ScanEnd and ScanAbort act as batch boundaries.
+
+        :param ScanSession session: The session of the slide.
+        :param ScanOngoing first_message: The tile that opens the batch.
+
+        :return: The tiles of the batch, in queue order.
+        :rtype: list
+        '''
+        batch = [first_message]
+        deadline = time.monotonic() + self.config.batch_timeout_ms / 1000
+        while len(batch) < self.config.batch_size:
+            message = self.__queue.get_tile(session, deadline - time.monotonic())
+            if message is None:
+                break
+            batch.append(message)
+        return batch
+
+    def __post_batch_results(self, session, batch, batch_results, timing):
+        '''
+        Releases the tiles of a processed batch and posts their results.
+
+        :param ScanSession session: The session of the slide.
+        :param list batch: The tiles of the batch.
+        :param list batch_results: The results of every tile.
+        :param tuple timing: The timing of `process` returned by `run_process`, or None if
+            every result came from the result cache.
+        '''
+        if timing is not None:
+            start_time, duration, pid, tid = timing
+            if self.__metrics is not None:
+                self.__metrics.process_duration.observe(duration)
+            if self.__tracer is not None:
+                self.__tracer.record(
+                    "process", session.slide_name, batch[0].tile_name,
+                    start_time, start_time + duration, {"tiles": len(batch)}, pid, tid,
+                )
+        for message, model_results in zip(batch, batch_results):
+            if self.__prefetcher is not None:
+                self.__prefetcher.release(message)
+            if self.__tile_ring is not None:
+                self.__tile_ring.release(message)
+            if self.__result_cache is not None:
+                self.__result_cache.store(message, model_results)
+            session.tiles_processed += 1
+            if self.__metrics is not None:
+                self.__metrics.tiles.inc(session.slide_name, SlideCounters.PROCESSED)
+            if not session.aborted:
+                self.__result_poster.post(session, message, model_results)
+
+    def __release_tiles(self, tiles):
+        '''
+        Releases the resources held for tiles that will not be processed, or whose results
+        will not be posted: their prefetch slot or pending prefetch, their room in the ring
+        buffer of raw tiles and their pending result cache entry.
+
+        :param list tiles: The discarded tiles.
+        '''
+        for tile in tiles:
+            if self.__prefetcher is not None:
+                self.__prefetcher.release(tile)
+            if self.__tile_ring is not None:
+                self.__tile_ring.release(tile)
+            if self.__result_cache is not None:
+                self.__result_cache.discard(tile)
+
+    def __complete_scan(self, session, message):
+        '''
+        Signals the scanner that the algorithm is done with the slide and runs the scan
+        end hook. The results still waiting for the neighbors of their tiles are posted
+        first. Nothing is sent if the scan was aborted in the meantime.
+
+        :param ScanSession session: The session of the ended scan.
+        :param ScanEnd message: The ScanEnd message.
+        '''
+        if session.aborted:
+            return
+        self.__result_poster.complete_scan(session)
+        if self.__tracer is not None and self.config.trace_dir is not None:
+            self.__write_trace(session)
+        self.on_scan_end(message)
+
+    def __write_trace(self, session):
+        '''
+        Writes the trace of a scan to `trace_dir`. Posts still in flight are not part of it.
+
+        :param ScanSession session: The session of the ended scan.
+        '''
+        os.makedirs(self.config.trace_dir, exist_ok=True)
+        path = os.path.join(
+            self.config.trace_dir, f"{session.slide_name}.{int(time.time())}.trace.json"
+        )
+        trace = self.__tracer.chrome_trace(session.slide_name, since=session.created_time)
+        with open(path, "wb") as trace_file:
+            trace_file.write(dumps(trace))
+
+    def get_tile_image(self, message):
+        '''
+        Returns the pixels of the tile of a ScanOngoing message, using the prefetched ones
+        when available and reading the tile otherwise. Meant to be called from `process`.
+
+        :param ScanOngoing message: The tile to load.
+
+        :return: The decoded pixels of the tile.
+        :rtype: numpy.ndarray
+        '''
+        with self.__span("load_image", message.slide_name, message.tile_name):
+            tile_image = message.tile_image
+            if tile_image is None:
+                tile_image = self.read_tile_image(message.tile_image_path)
+        return tile_image
+
+    def read_tile_image(self, tile_image_path):
+        '''
+        Reads a tile image. Uncompressed BMPs are memory-mapped into a read-only array,
+        other formats are decoded. Override it to use a different decoder, it is also
+        used by the prefetch stage.
+
+        :param str tile_image_path: The path of the tile image.
+
+        :return: The decoded pixels of the tile.
+        :rtype: numpy.ndarray
+        '''
+        return read_tile(tile_image_path)
+
     def run(self):
+        import uvicorn # pylint: disable=import-outside-toplevel
         uvicorn.run(
             self.app,
             host=self.host,
@@ -235,12 +892,18 @@ class InlineAlgoQueueProcessor(AbstractInlineAlgorithm):
     def on_server_end(self):
         pass
 
+    def get_warm_up_tiles(self):
+        return []
+
     def on_scan_start(self, message):
         pass
 
     def process(self, message):
         pass
 
+    def process_batch(self, messages):
+        return [self.process(message) for message in messages]
+
     def on_scan_end(self, message):
         pass
 
@@ -0,0 +1,205 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Pipeline metrics rendered in the Prometheus text exposition format.
+
+Recording is meant for the hot path: histograms and counters are preallocated lists
+updated without allocations, under a lock held for a few operations. Metrics are recorded
+from several threads: tiles are counted as received on the event loop, as processed and
+posted on the handler or completion thread, and posts are timed on every sender thread.
+The scrape reads a consistent copy under the same lock.
+'''
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+
+# Upper bounds in seconds of the latency histogram buckets, from 100us to 10s.
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+
+class Histogram:
+    '''
+    A Prometheus histogram with fixed buckets.
+
+    :param str name: The metric name.
+    :param str documentation: The HELP text of the metric.
+    :param tuple buckets: The sorted upper bounds of the buckets, +Inf is implied.
+    '''
+    __slots__ = ("name", "documentation", "buckets", "counts", "total", "count", "__lock")
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.__lock = Lock()
+
+    def observe(self, value):
+        '''
+        Records one sample.
+
+        :param float value: The sample, in seconds for latencies.
+        '''
+        index = bisect_left(self.buckets, value)
+        with self.__lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def render(self, lines):
+        '''
+        Appends the exposition lines of the histogram.
+
+        :param list lines: The lines of the exposition.
+        '''
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} histogram")
+        with self.__lock:
+            counts, total, count = list(self.counts), self.total, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total}")
+        lines.append(f"{self.name}_count {count}")
+
+
+class SlideCounters:
+    '''
+    Tiles received, processed and posted per slide. Only the `max_slides` most recently
+    started slides are kept.
+
+    :param int max_slides: The maximum number of slides kept.
+    '''
+    RECEIVED = 0
+    PROCESSED = 1
+    POSTED = 2
+    NAMES = (
+        ("inline_algorithm_tiles_received_total", "Tiles received on /v1/scan/image-tile."),
+        ("inline_algorithm_tiles_processed_total", "Tiles processed by the algorithm."),
+        ("inline_algorithm_tiles_posted_total", "Tile results queued to the scanner."),
+    )
+
+    def __init__(self, max_slides=100):
+        self.max_slides = max_slides
+        self.__counters = OrderedDict()
+        self.__lock = Lock()
+
+    def inc(self, slide_name, index):
+        '''
+        Increments a counter of a slide, adding the slide if needed.
+
+        :param str slide_name: The name of the slide.
+        :param int index: RECEIVED, PROCESSED or POSTED.
+        '''
+        with self.__lock:
+            counters = self.__counters.get(slide_name)
+            if counters is None:
+                counters = self.__counters[slide_name] = [0, 0, 0]
+                while len(self.__counters) > self.max_slides:
+                    self.__counters.popitem(last=False)
+            counters[index] += 1
+
+    def render(self, lines):
+        '''
+        Appends the exposition lines of the counters.
+
+        :param list lines: The lines of the exposition.
+        '''
+        with self.__lock:
+            slides = [(slide_name, list(counters)) for slide_name, counters in
+                      self.__counters.items()]
+        for index, (name, documentation) in enumerate(self.NAMES):
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} counter")
+            for slide_name, counters in slides:
+                lines.append(f'{name}{{slide_name="{_escape(slide_name)}"}} {counters[index]}')
+
+
+class PipelineMetrics:
+    '''
+    The metrics of the InlineAlgoQueueProcessor pipeline: per slide tile counters, and
+    histograms of the time tiles wait in the queue, of `process` calls, of the
+    serialization of results and of the result posts. Values owned by other components,
+    such as the queue depth, are read at scrape time through collectors.
+
+    :param int max_slides: The maximum number of slides with tile counters.
+    '''
+
+    def __init__(self, max_slides=100):
+        self.tiles = SlideCounters(max_slides)
+        self.queue_wait = Histogram(
+            "inline_algorithm_queue_wait_seconds",
+            "Time between a tile being enqueued and dequeued.",
+        )
+        self.process_duration = Histogram(
+            "inline_algorithm_process_duration_seconds",
+            "Duration of process() or process_batch() calls.",
+        )
+        self.serialization = Histogram(
+            "inline_algorithm_serialization_seconds",
+            "Time to validate and serialize the results of a tile.",
+        )
+        self.post_latency = Histogram(
+            "inline_algorithm_post_latency_seconds",
+            "Latency of successful posts to the scanner.",
+        )
+        self.__collectors = []
+
+    def add_collector(self, name, documentation, metric_type, collect):
+        '''
+        Adds a metric whose value is read when the metrics are rendered.
+
+        :param str name: The metric name.
+        :param str documentation: The HELP text of the metric.
+        :param str metric_type: "gauge" or "counter".
+        :param callable collect: Returns the current value.
+        '''
+        self.__collectors.append((name, documentation, metric_type, collect))
+
+    def render(self):
+        '''
+        :return: The metrics in the Prometheus text exposition format.
+        :rtype: str
+        '''
+        lines = []
+        for name, documentation, metric_type, collect in self.__collectors:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {collect()}")
+        self.tiles.render(lines)
+        for histogram in (
+            self.queue_wait,
+            self.process_duration,
+            self.serialization,
+            self.post_latency,
+        ):
+            histogram.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(label_value):
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
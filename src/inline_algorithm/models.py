@@ -20,8 +20,9 @@ under the License.
 
 Defining Pydantic models
 '''
+from concurrent.futures import Future
 from typing import List, Union
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
 class ScanStart(BaseModel):
     '''
@@ -46,6 +47,47 @@ class ScanOngoing(BaseModel):
     tile_image_path: str
     row_idx: int
     col_idx: int
+    _tile_image = PrivateAttr(default=None)
+    _tile_digest = PrivateAttr(default=None)
+
+    @property
+    def tile_image(self):
+        '''
+        The decoded pixels of the tile if they were attached by the SDK, e.g. by the
+        prefetch stage or from a raw tile upload, otherwise None. Waits for a prefetch
+        that is still running.
+        '''
+        if hasattr(self._tile_image, "result"):
+            return self._tile_image.result()
+        return self._tile_image
+
+    def attach_tile_image(self, tile_image):
+        '''
+        Attaches the decoded pixels of the tile, or a future resolving to them.
+        '''
+        self._tile_image = tile_image
+
+    @property
+    def tile_digest(self):
+        '''
+        The content digest of the tile and the number of bytes hashed, if the result cache
+        computed them ahead of the handler thread, otherwise None.
+        '''
+        return self._tile_digest
+
+    def attach_tile_digest(self, tile_digest):
+        '''
+        Attaches the content digest of the tile and the number of bytes hashed.
+        '''
+        self._tile_digest = tile_digest
+
+    def resolve_tile_image(self):
+        '''
+        Replaces a prefetch future by the pixels it resolves to, e.g. before the message is
+        pickled to a worker process. Other attached pixels are left as they are.
+        '''
+        if isinstance(self._tile_image, Future):
+            self._tile_image = self._tile_image.result()
 
 class ScanEnd(BaseModel):
     '''
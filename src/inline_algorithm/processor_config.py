@@ -0,0 +1,192 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+The options of the InlineAlgoQueueProcessor pipeline.
+'''
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ProcessorConfig:
+    '''
+    The options of InlineAlgoQueueProcessor, validated when the config is built. The
+    defaults process one tile at a time on the handler thread and post every result on
+    its own, as the processor always did.
+
+    :param int batch_size: The maximum number of tiles of the same slide handed to
+        `process_batch` at once. The default of 1 keeps the one `process` call per tile
+        behaviour.
+    :param float batch_timeout_ms: The maximum time in milliseconds to wait for more tiles
+        once the first tile of a batch has been dequeued.
+    :param int num_workers: The number of tiles (or batches) processed at the same time.
+        The default of 1 runs `process` on the handler thread.
+    :param int max_concurrency: The maximum number of tiles (or batches) processed at the
+        same time by AsyncInlineAlgoQueueProcessor, which ignores `num_workers`.
+    :param str worker_mode: "thread" to run `process` in a thread pool sharing one model,
+        or "process" to run it in a pool of processes. In process mode the algorithm is
+        pickled to every worker and `on_server_start` runs once in each of them instead
+        of in the server process.
+    :param int sender_connections: The number of keep-alive connections (and sender
+        threads) used to post results to the scanner.
+    :param int sender_queue_size: The maximum number of results waiting to be posted.
+    :param int post_retries: The number of retries of a post that failed transiently.
+    :param float post_timeout: The timeout in seconds of one post to the scanner.
+    :param float retry_backoff: The delay in seconds before the first retry of a post,
+        doubled on every following one.
+    :param int result_batch_size: The maximum number of tile results of a slide posted
+        together to /v1/tile-results/batch. The default of 1 posts every tile on its own.
+    :param int result_batch_max_bytes: The size in bytes after which a batch of tile
+        results is posted.
+    :param float result_batch_interval_ms: The time in milliseconds after which a batch of
+        tile results is posted, however few results it holds. Pending batches are always
+        posted before /v1/algorithm-completed.
+    :param int prefetch_workers: The number of threads reading tiles ahead of `process`
+        as soon as they are enqueued. The default of 0 disables prefetching.
+    :param int prefetch_depth: The maximum number of prefetched tiles held at once.
+    :param int prefetch_max_bytes: The maximum memory in bytes held by prefetched tiles,
+        or None to only bound their number.
+    :param int max_queue_size: The maximum number of messages waiting in the queue before
+        /v1/scan/image-tile applies `queue_full_policy`. The default of 0 means unbounded.
+    :param str queue_full_policy: What /v1/scan/image-tile does with a tile when the queue
+        is full: "block" waits up to `queue_block_timeout` seconds for room and then
+        rejects it, "reject" answers 503 with a Retry-After header right away, and "drop"
+        accepts the tile without processing it. Dropped and rejected tiles are counted.
+    :param float queue_block_timeout: The time in seconds a tile waits for room in the
+        queue with the "block" policy.
+    :param int retry_after: The Retry-After value in seconds of rejected tiles.
+    :param bool enable_metrics: Whether to record pipeline metrics and serve them in the
+        Prometheus text format on /metrics.
+    :param bool trusted_results: Whether to skip validating the results returned by
+        `process`. They are then encoded as returned, so they must already follow the
+        DetectionArray or List[List] format.
+    :param bool merge_detections: Whether to merge the detections of neighboring tiles,
+        removing duplicates and joining the objects cut by tile borders, see
+        DetectionMerger. The results of a tile are then posted once its neighbors have been
+        processed, or after `merge_max_wait_ms`, and the remaining ones before
+        /v1/algorithm-completed.
+    :param str tile_index_units: "grid" if the row_idx and col_idx of the tiles are their
+        indices in the grid, "pixels" if they are the offsets of their top left pixel.
+    :param float merge_iou_threshold: The overlap above which the detections of two
+        neighboring tiles are duplicates.
+    :param float merge_border_margin: The distance in pixels from a tile border under which
+        a detection touches it.
+    :param float merge_max_wait_ms: The maximum time in milliseconds the results of a tile
+        wait for its neighbors.
+    :param int raw_tile_buffer_bytes: The size in bytes of the shared memory ring buffer
+        holding the tiles uploaded to /v1/scan/image-tile/raw. The default of 0 does not
+        serve that endpoint.
+    :param int result_cache_entries: The number of tile results cached in memory, keyed by
+        the content of the tiles and `model_version`. Tiles whose results are cached are
+        not handed to `process`, their cached results are posted instead. Looking a tile up
+        hashes all of it: with `prefetch_workers` the tiles are hashed by the prefetch
+        readers, and raw uploads by their request handler, otherwise the handler thread
+        hashes them. The default of 0 caches nothing in memory.
+    :param str result_cache_dir: A directory caching tile results on disk, across runs,
+        or None to not cache them on disk.
+    :param int result_cache_disk_bytes: The maximum size in bytes of `result_cache_dir`,
+        the least recently used results are evicted first.
+    :param str model_version: The version of the model, part of the cache keys. Change it
+        whenever the model or its parameters change.
+    :param bool enable_tracing: Whether to record the spans of the pipeline stages of every
+        tile: the /v1/scan/image-tile handlers, the queue wait, the result cache lookup,
+        `get_tile_image`, `process`, the detection merge, the serialization and the post
+        of the results. Traces are served in the Chrome trace format on /debug/trace.
+    :param int trace_buffer_size: The number of spans kept, the oldest are overwritten.
+    :param str trace_dir: A directory the trace of every scan is written to at its
+        ScanEnd, as <slide_name>.<timestamp>.trace.json, if tracing is enabled.
+    :param bool enable_profiling: Whether to serve /debug/profile, starting and reporting
+        cProfile captures of `process` on demand.
+    :raises ValueError: If `worker_mode`, `tile_index_units` or `queue_full_policy` is not
+        one of their values.
+    '''
+    # pylint: disable=too-many-instance-attributes
+    batch_size: int = 1
+    batch_timeout_ms: float = 10
+    num_workers: int = 1
+    max_concurrency: int = 16
+    worker_mode: str = "thread"
+    sender_connections: int = 1
+    sender_queue_size: int = 1024
+    post_retries: int = 3
+    post_timeout: float = 1
+    retry_backoff: float = 0.1
+    result_batch_size: int = 1
+    result_batch_max_bytes: int = 1024 * 1024
+    result_batch_interval_ms: float = 50
+    prefetch_workers: int = 0
+    prefetch_depth: int = 8
+    prefetch_max_bytes: int | None = None
+    max_queue_size: int = 0
+    queue_full_policy: str = "block"
+    queue_block_timeout: float = 1
+    retry_after: int = 1
+    enable_metrics: bool = False
+    trusted_results: bool = False
+    merge_detections: bool = False
+    tile_index_units: str = "grid"
+    merge_iou_threshold: float = 0.5
+    merge_border_margin: float = 4
+    merge_max_wait_ms: float = 5000
+    raw_tile_buffer_bytes: int = 0
+    result_cache_entries: int = 0
+    result_cache_dir: str | None = None
+    result_cache_disk_bytes: int = 1024 ** 3
+    model_version: str = ""
+    enable_tracing: bool = False
+    trace_buffer_size: int = 65536
+    trace_dir: str | None = None
+    enable_profiling: bool = False
+
+    def __post_init__(self):
+        if self.worker_mode not in ("thread", "process"):
+            raise ValueError(
+                f"worker_mode must be 'thread' or 'process', not {self.worker_mode!r}"
+            )
+        if self.tile_index_units not in ("grid", "pixels"):
+            raise ValueError(
+                f"tile_index_units must be 'grid' or 'pixels', not {self.tile_index_units!r}"
+            )
+        if self.queue_full_policy not in ("block", "reject", "drop"):
+            raise ValueError(
+                "queue_full_policy must be 'block', 'reject' or 'drop', "
+                f"not {self.queue_full_policy!r}"
+            )
+
+    @property
+    def result_cache_enabled(self):
+        '''
+        Whether tile results are cached, in memory or on disk.
+        '''
+        return self.result_cache_entries > 0 or self.result_cache_dir is not None
+
+    def merger_options(self):
+        '''
+        :return: The keyword arguments of the DetectionMerger of every slide, besides the
+            tile size, or None if `merge_detections` is not set.
+        :rtype: dict
+        '''
+        if not self.merge_detections:
+            return None
+        return {
+            "tile_index_units": self.tile_index_units,
+            "iou_threshold": self.merge_iou_threshold,
+            "border_margin": self.merge_border_margin,
+            "max_wait": self.merge_max_wait_ms / 1000,
+        }
@@ -0,0 +1,133 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+The warm-up of the algorithm and the readiness of the server reported on /ready. Models
+often initialize lazily, or compile their graphs, on their first calls, so synthetic tiles
+are run through process() before the scanner is told the server is ready, instead of
+slowing down the first tiles of the first scan.
+'''
+from threading import Event, Lock
+from .models import ScanOngoing
+
+# The slide name of the synthetic tiles run at warm-up.
+WARM_UP_SLIDE_NAME = "__warm_up__"
+
+
+def warm_up_messages(tiles):
+    '''
+    Wraps the synthetic tiles returned by `get_warm_up_tiles` in ScanOngoing messages.
+
+    :param list tiles: NumPy arrays, attached to messages without a tile image path so that
+        `get_tile_image` returns them, or ScanOngoing messages, used as they are.
+
+    :return: The messages to run through `process`.
+    :rtype: list
+    '''
+    messages = []
+    for index, tile in enumerate(tiles or ()):
+        if not isinstance(tile, ScanOngoing):
+            tile_image = tile
+            tile = ScanOngoing(
+                slide_name=WARM_UP_SLIDE_NAME,
+                tile_name=f"warm_up_{index}",
+                tile_image_path="",
+                row_idx=0,
+                col_idx=index,
+            )
+            tile.attach_tile_image(tile_image)
+        messages.append(tile)
+    return messages
+
+
+class Readiness:
+    '''
+    The state of the server reported on /ready: "starting" until the warm-up begins,
+    "warming_up" while the synthetic tiles are processed, then "ready", or "failed" if the
+    warm-up raised.
+    '''
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__ready = Event() # Set once the warm-up has completed.
+        self.__state = "starting"
+        self.__tiles = 0 # The synthetic tiles processed.
+        self.__seconds = 0.0 # The duration of the warm-up.
+        self.__error = None # Why the warm-up failed.
+
+    @property
+    def ready(self):
+        '''
+        Whether the warm-up has completed.
+        '''
+        return self.__ready.is_set()
+
+    def warming_up(self):
+        '''
+        Records that the warm-up has begun.
+        '''
+        with self.__lock:
+            self.__state = "warming_up"
+
+    def warmed_up(self, tiles, seconds):
+        '''
+        Records that the warm-up has completed and the server is ready.
+
+        :param int tiles: The number of synthetic tiles processed, by every worker.
+        :param float seconds: The duration of the warm-up.
+        '''
+        with self.__lock:
+            self.__state = "ready"
+            self.__tiles = tiles
+            self.__seconds = seconds
+        self.__ready.set()
+
+    def failed(self, error):
+        '''
+        Records that the warm-up raised, the server then never reports ready.
+
+        :param error: The exception raised, or its description.
+        '''
+        with self.__lock:
+            self.__state = "failed"
+            self.__error = str(error) or type(error).__name__
+
+    def wait(self, timeout=None):
+        '''
+        :param float timeout: The maximum time in seconds to wait.
+
+        :return: Whether the server is ready.
+        :rtype: bool
+        '''
+        return self.__ready.wait(timeout)
+
+    def status(self):
+        '''
+        :return: Whether the server is ready, its state, the number of synthetic tiles
+            processed and the duration of the warm-up, and the error it raised if any.
+        :rtype: dict
+        '''
+        with self.__lock:
+            return {
+                "ready": self.__ready.is_set(),
+                "state": self.__state,
+                "warm_up_tiles": self.__tiles,
+                "warm_up_seconds": round(self.__seconds, 6),
+                "error": self.__error,
+            }
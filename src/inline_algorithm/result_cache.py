@@ -0,0 +1,299 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+A cache of the results of process(), keyed by the content of the tiles, so that tiles
+sent again byte for byte, e.g. by rescans or retries of the scanner, are not inferred
+twice.
+'''
+import os
+import mmap
+import pickle
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from .tracing import NULL_SPAN
+
+# Returned by `lookup` when the results of a tile are not cached.
+MISS = object()
+
+DISK_SUFFIX = ".pickle"
+
+
+def tile_digest(message, model_version=""):
+    '''
+    Hashes the content of a tile together with the version of the model. Tiles uploaded
+    raw, which have no path, are hashed from their pixels, and other tiles from the bytes
+    of their file.
+
+    :param ScanOngoing message: The tile to hash.
+    :param str model_version: The version of the model producing the results.
+
+    :return: The hexadecimal BLAKE2b digest of the tile and the number of bytes hashed.
+    :rtype: tuple
+    '''
+    digest = hashlib.blake2b(model_version.encode(), digest_size=16)
+    if not message.tile_image_path:
+        tile_image = message.tile_image
+        digest.update(f"|{tile_image.dtype.str}{tile_image.shape}|".encode())
+        digest.update(memoryview(tile_image).cast("B"))
+        return digest.hexdigest(), tile_image.nbytes
+    digest.update(b"|file|")
+    with open(message.tile_image_path, "rb") as tile_file:
+        size = os.fstat(tile_file.fileno()).st_size
+        if size > 0:
+            with mmap.mmap(tile_file.fileno(), 0, access=mmap.ACCESS_READ) as tile_bytes:
+                digest.update(tile_bytes)
+    return digest.hexdigest(), size
+
+
+def combine_results(cached_results, missed_results):
+    '''
+    :param list cached_results: The cached results of the tiles of a batch, or MISS, or
+        None if the result cache is disabled.
+    :param list missed_results: The results of `process` for the missed tiles, in order.
+
+    :return: The results of every tile of the batch.
+    :rtype: list
+    '''
+    if cached_results is None:
+        return missed_results
+    missed_results = iter(missed_results)
+    return [
+        next(missed_results) if results is MISS else results
+        for results in cached_results
+    ]
+
+
+class TileResultCache:
+    '''
+    Caches the results of tiles by the digest of their content and of the model version,
+    in an LRU of `max_entries` results in memory and, optionally, in a directory of up to
+    `max_disk_bytes` bytes evicting the least recently used results first. The directory
+    outlives the server, results are written with pickle, so it must only be writable by
+    the algorithm.
+
+    `lookup` is called with the tiles about to be processed and remembers the digest of
+    the misses, `store` is called with their results once they are processed. Hashing a
+    tile reads all of it, so `prepare` hashes the tiles ahead of `lookup` on other threads,
+    e.g. the prefetch readers, leaving only a dictionary lookup to the handler thread.
+
+    :param str model_version: The version of the model, part of every key so that the
+        results of another version are never returned.
+    :param int max_entries: The maximum number of results held in memory.
+    :param str disk_path: The directory of the on-disk tier, or None for memory only.
+    :param int max_disk_bytes: The maximum size in bytes of the on-disk tier.
+    '''
+
+    def __init__(self, model_version="", max_entries=1024, disk_path=None,
+                 max_disk_bytes=1024 ** 3):
+        self.model_version = model_version
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+
+        self.__lock = Lock()
+        self.__memory = OrderedDict() # The cached results by key, least recently used first.
+        self.__disk = OrderedDict() # The size of the cached files by key, in the same order.
+        self.__disk_bytes = 0
+        self.__pending = {} # The keys of the missed tiles, by message id.
+        self.__hits = 0
+        self.__disk_hits = 0
+        self.__misses = 0
+        self.__bytes_saved = 0 # The bytes of the tiles whose results were cached.
+        if disk_path is not None:
+            os.makedirs(disk_path, exist_ok=True)
+            self.__load_disk_index()
+
+    def prepare(self, message):
+        '''
+        Hashes a tile ahead of its `lookup` and attaches the digest to the message. Tiles
+        that cannot be read are left to `lookup`.
+
+        :param ScanOngoing message: A tile that was just read or received.
+        '''
+        try:
+            message.attach_tile_digest(tile_digest(message, self.model_version))
+        except OSError:
+            pass
+
+    def lookup(self, message):
+        '''
+        :param ScanOngoing message: A tile about to be processed. If it is being prefetched
+            its digest is computed by the reader, which is waited for.
+
+        :return: The cached results of the tile, or MISS. Tiles that cannot be read are
+            missed without being cached, `process` handles them as usual.
+        '''
+        digest = message.tile_digest
+        if digest is None and message.tile_image_path:
+            try:
+                message.resolve_tile_image()
+            except Exception: # pylint: disable=broad-exception-caught
+                pass # process() reports the errors of the tile.
+            digest = message.tile_digest
+        try:
+            key, size = digest or tile_digest(message, self.model_version)
+        except OSError:
+            with self.__lock:
+                self.__misses += 1
+            return MISS
+        with self.__lock:
+            if key in self.__memory:
+                self.__memory.move_to_end(key)
+                self.__hits += 1
+                self.__bytes_saved += size
+                return self.__memory[key]
+            on_disk = key in self.__disk
+        model_results = self.__read_disk(key) if on_disk else MISS
+        with self.__lock:
+            if model_results is MISS:
+                self.__misses += 1
+                self.__pending[id(message)] = key
+            else:
+                self.__hits += 1
+                self.__disk_hits += 1
+                self.__bytes_saved += size
+                self.__remember(key, model_results)
+        return model_results
+
+    def lookup_batch(self, batch, tracer=None):
+        '''
+        Looks the tiles of a batch up, see `lookup`.
+
+        :param list batch: The tiles about to be processed.
+        :param SpanTracer tracer: Records the span of every lookup, if given.
+
+        :return: The cached results of every tile, or MISS, and the missed tiles.
+        :rtype: tuple
+        '''
+        cached_results = []
+        for tile in batch:
+            span = NULL_SPAN if tracer is None else tracer.span(
+                "cache_lookup", tile.slide_name, tile.tile_name
+            )
+            with span:
+                cached_results.append(self.lookup(tile))
+        missed = [tile for tile, results in zip(batch, cached_results) if results is MISS]
+        return cached_results, missed
+
+    def store(self, message, model_results):
+        '''
+        Caches the results of a tile missed by `lookup`. Other tiles are ignored.
+
+        :param ScanOngoing message: The processed tile.
+        :param model_results: The results returned by `process` for the tile.
+        '''
+        with self.__lock:
+            key = self.__pending.pop(id(message), None)
+            if key is None:
+                return
+            self.__remember(key, model_results)
+        if self.disk_path is not None:
+            self.__write_disk(key, model_results)
+
+    def discard(self, message):
+        '''
+        Forgets a tile missed by `lookup` that will not be processed.
+
+        :param ScanOngoing message: The discarded tile.
+        '''
+        with self.__lock:
+            self.__pending.pop(id(message), None)
+
+    def stats(self):
+        '''
+        :return: The hits, in memory and on disk, the misses, the hit rate, the bytes of the
+            tiles whose inference was saved, and the size of both tiers.
+        :rtype: dict
+        '''
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                "hits": self.__hits,
+                "disk_hits": self.__disk_hits,
+                "misses": self.__misses,
+                "hit_rate": self.__hits / lookups if lookups else 0.0,
+                "bytes_saved": self.__bytes_saved,
+                "entries": len(self.__memory),
+                "disk_entries": len(self.__disk),
+                "disk_bytes": self.__disk_bytes,
+            }
+
+    def __remember(self, key, model_results):
+        self.__memory[key] = model_results
+        self.__memory.move_to_end(key)
+        while len(self.__memory) > self.max_entries:
+            self.__memory.popitem(last=False)
+
+    def __file_path(self, key):
+        return os.path.join(self.disk_path, key + DISK_SUFFIX)
+
+    def __load_disk_index(self):
+        '''
+        Indexes the results cached on disk by a previous run, oldest first.
+        '''
+        entries = []
+        for entry in os.scandir(self.disk_path):
+            if entry.is_file() and entry.name.endswith(DISK_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(DISK_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.__disk[key] = size
+            self.__disk_bytes += size
+
+    def __read_disk(self, key):
+        try:
+            with open(self.__file_path(key), "rb") as cache_file:
+                model_results = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self.__lock:
+                self.__disk_bytes -= self.__disk.pop(key, 0)
+            return MISS
+        with self.__lock:
+            if key in self.__disk:
+                self.__disk.move_to_end(key)
+        return model_results
+
+    def __write_disk(self, key, model_results):
+        '''
+        Writes the results to a temporary file renamed into place, so that a crash never
+        leaves a partial entry, then evicts the least recently used files over the limit.
+        '''
+        data = pickle.dumps(model_results, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_disk_bytes:
+            return
+        path = self.__file_path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as cache_file:
+            cache_file.write(data)
+        os.replace(temporary_path, path)
+        evicted = []
+        with self.__lock:
+            self.__disk_bytes += len(data) - self.__disk.pop(key, 0)
+            self.__disk[key] = len(data)
+            while self.__disk_bytes > self.max_disk_bytes:
+                evicted_key, size = self.__disk.popitem(last=False)
+                self.__disk_bytes -= size
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            try:
+                os.remove(self.__file_path(evicted_key))
+            except FileNotFoundError:
+                pass
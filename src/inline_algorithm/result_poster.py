@@ -0,0 +1,139 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+The path of the results of processed tiles to the scanner: the merge of the detections
+across tiles, the serialization of the results and their queueing to the ResultSender.
+'''
+import json
+import time
+from .detection_merge import DetectionMerger
+from .metrics import SlideCounters
+from .serialization import serialize_tile_results
+from .tracing import NULL_SPAN
+
+
+class ResultPoster:
+    '''
+    Posts the results of the tiles of a slide with the `algorithm_id` of its ScanStart, and
+    the completion of its scan, counting the posted tiles in its session. When detections
+    are merged, the results of a tile go through the DetectionMerger of its slide first,
+    and are posted once its neighbors have been processed.
+
+    :param ResultSender result_sender: Posts the messages to the scanner.
+    :param bool trusted_results: Whether to skip validating the results, see
+        `serialize_tile_results`.
+    :param dict merger_options: The keyword arguments of the DetectionMerger of every
+        slide besides the tile size, or None to not merge detections.
+    :param PipelineMetrics metrics: Records the serialization time and counts the posted
+        tiles, if given.
+    :param SpanTracer tracer: Records the spans of the merge and of the serialization, if
+        given.
+    '''
+
+    def __init__(self, result_sender, trusted_results=False, merger_options=None,
+                 metrics=None, tracer=None):
+        self.result_sender = result_sender
+        self.trusted_results = trusted_results
+        self.merger_options = merger_options
+        self.metrics = metrics
+        self.tracer = tracer
+
+    def start_scan(self, session, message):
+        '''
+        Gives the session of a slide its DetectionMerger, if detections are merged.
+
+        :param ScanSession session: The session of the slide.
+        :param ScanStart message: The ScanStart of the slide.
+        '''
+        if self.merger_options is not None:
+            session.detection_merger = DetectionMerger(
+                message.tile_width, message.tile_height, **self.merger_options
+            )
+
+    def post(self, session, message, model_results):
+        '''
+        Posts the results of a tile, or hands them to the DetectionMerger of the slide
+        and posts the results it releases.
+
+        :param ScanSession session: The session of the slide.
+        :param ScanOngoing message: The tile the results belong to.
+        :param model_results: The detections returned for the tile, or None.
+        :type model_results: list or ColumnarDetections
+        '''
+        if session.detection_merger is not None:
+            span = NULL_SPAN if self.tracer is None else self.tracer.span(
+                "merge", message.slide_name, message.tile_name
+            )
+            with span:
+                merged = session.detection_merger.add(message, model_results)
+            for merged_message, merged_results in merged:
+                self.__post(session, merged_message, merged_results)
+        elif model_results is not None:
+            self.__post(session, message, model_results)
+
+    def complete_scan(self, session):
+        '''
+        Posts the results still waiting for the neighbors of their tiles, then the
+        completion of the scan once every message queued before it has been sent.
+
+        :param ScanSession session: The session of the ended scan.
+        '''
+        if session.detection_merger is not None:
+            for merged_message, merged_results in session.detection_merger.flush():
+                self.__post(session, merged_message, merged_results)
+        data_json = {"algorithm_id": session.algorithm_id, "slide_name": session.slide_name}
+        self.result_sender.send(
+            "/v1/algorithm-completed", json.dumps(data_json), barrier=True
+        )
+
+    def abort_scan(self, session):
+        '''
+        Drops the results of an aborted scan waiting for the neighbors of their tiles.
+
+        :param ScanSession session: The session of the aborted scan.
+        '''
+        session.detection_merger = None
+
+    def __post(self, session, message, model_results):
+        '''
+        Wraps the results of one tile in a TileResults message and queues it to the
+        scanner.
+
+        :param ScanSession session: The session of the slide.
+        :param message: The tile the results belong to.
+        :type message: ScanOngoing or TileKey
+        :param model_results: The detections returned for the tile.
+        :type model_results: list or ColumnarDetections
+        '''
+        start_time = time.perf_counter()
+        data = serialize_tile_results(
+            session.algorithm_id, message, model_results, trusted=self.trusted_results
+        )
+        if self.metrics is not None:
+            self.metrics.serialization.observe(time.perf_counter() - start_time)
+        if self.tracer is not None:
+            self.tracer.record(
+                "serialize", message.slide_name, message.tile_name,
+                start_time, time.perf_counter(),
+            )
+        self.result_sender.send("/v1/tile-results", data, batch_key=message.slide_name)
+        session.tiles_posted += 1
+        if self.metrics is not None:
+            self.metrics.tiles.inc(session.slide_name, SlideCounters.POSTED)
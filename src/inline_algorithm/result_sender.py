@@ -0,0 +1,419 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+A background sender posting algorithm messages to the scanner over pooled keep-alive
+connections, so that inference never waits on the scanner's HTTP responses.
+
+Messages can optionally be coalesced: the tile results of a slide are then posted together
+to the batch endpoint, as a JSON array, instead of one request per tile.
+
+requests is only imported once a sender is started, so the processes that never post,
+such as the workers of a process pool, do not pay for it.
+'''
+import itertools
+import logging
+import time
+from queue import Queue, Full
+from threading import Thread, Condition, Lock
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying, anything else is either a success or a permanent failure.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Appended to the path of coalesced messages, e.g. /v1/tile-results/batch.
+BATCH_PATH_SUFFIX = "/batch"
+
+
+class ResultSender:
+    '''
+    Posts messages from a bounded outbound queue on one or more sender threads sharing a
+    pool of keep-alive connections. Transient failures (connection errors, timeouts and
+    5xx/429 responses) are retried with exponential backoff; failed and dropped messages
+    are counted rather than raised. Only single tile results are dropped when the queue
+    stays full, barriers and batches wait for room however long it takes. The messages of
+    a slide still waiting to be sent can be cancelled, e.g. when its scan is aborted.
+
+    :param str base_url: The scanner URL the message paths are appended to.
+    :param int num_connections: The number of keep-alive connections, and of sender
+        threads using them. With more than one, tile results may arrive out of order.
+    :param int max_queue_size: The maximum number of messages waiting to be sent.
+    :param float enqueue_timeout: The time in seconds `send` waits for room in a full
+        queue before dropping a message that is neither a barrier nor a batch.
+    :param int max_retries: The number of retries of a transient failure.
+    :param float retry_backoff: The delay in seconds before the first retry, doubled on
+        every following one.
+    :param float timeout: The timeout in seconds of one POST request.
+    :param Histogram latency_histogram: A histogram recording the latency of every
+        successful post, if given.
+    :param int batch_max_messages: The maximum number of messages coalesced into one
+        post. The default of 1 disables batching.
+    :param int batch_max_bytes: The size in bytes after which a batch is posted.
+    :param float batch_interval: The time in seconds after which a batch is posted,
+        however few messages it holds.
+    :param SpanTracer tracer: A tracer recording every post as a span, if given.
+    '''
+
+    def __init__(
+        self,
+        base_url,
+        num_connections=1,
+        max_queue_size=1024,
+        enqueue_timeout=1,
+        max_retries=3,
+        retry_backoff=0.1,
+        timeout=1,
+        latency_histogram=None,
+        batch_max_messages=1,
+        batch_max_bytes=1024 * 1024,
+        batch_interval=0.05,
+        tracer=None,
+    ):
+        self.base_url = base_url
+        self.num_connections = num_connections
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self.latency_histogram = latency_histogram
+        self.batch_max_messages = batch_max_messages
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_interval = batch_interval
+        self.tracer = tracer
+
+        self.__queue = Queue(maxsize=max_queue_size)
+        self.__sequence = itertools.count()
+        # Keeps sequence numbers in queue order when batches are flushed by another thread.
+        # It is never held while waiting for room in the queue.
+        self.__enqueue_lock = Lock()
+        # The batches being filled, by (path, batch_key): messages, size and start time.
+        self.__batches = {}
+        self.__batch_condition = Condition()
+        # The first sequence number not cancelled, by batch key.
+        self.__cancelled = {}
+        self.__stopping = False
+        self.__in_progress = set() # Sequence numbers of the messages being sent.
+        # Registers messages in progress as they are dequeued, see sender_loop.
+        self.__dequeue_lock = Lock()
+        self.__in_progress_condition = Condition()
+        self.__stats_lock = Lock()
+        self.__stats = {
+            "sent": 0,
+            "failed": 0,
+            "retried": 0,
+            "dropped": 0,
+            "batches": 0,
+            "cancelled": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+        }
+        self.__threads = []
+        self.__flush_thread = None
+        self.__session = None # The requests session, opened by start().
+        self.__errors = () # The transient and permanent requests errors.
+
+    def start(self):
+        '''
+        Opens the pool of keep-alive connections and starts the sender threads.
+        '''
+        if self.__session is None:
+            import requests # pylint: disable=import-outside-toplevel
+            from requests.adapters import HTTPAdapter # pylint: disable=import-outside-toplevel
+            self.__session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self.num_connections,
+                pool_block=True,
+            )
+            self.__session.mount("http://", adapter)
+            self.__session.mount("https://", adapter)
+            self.__session.headers["Content-Type"] = "application/json"
+            self.__errors = (
+                (requests.ConnectionError, requests.Timeout), requests.RequestException
+            )
+        for _ in range(self.num_connections):
+            thread_handle = Thread(target=self.sender_loop, daemon=True)
+            thread_handle.start()
+            self.__threads.append(thread_handle)
+        if self.batch_max_messages > 1:
+            self.__stopping = False
+            self.__flush_thread = Thread(target=self.flush_loop, daemon=True)
+            self.__flush_thread.start()
+
+    def stop(self, timeout=5):
+        '''
+        Lets the sender threads drain the queue and stops them.
+
+        :param float timeout: The time in seconds to wait for every sender thread.
+        '''
+        if self.__flush_thread is not None:
+            with self.__batch_condition:
+                self.__stopping = True
+                self.__batch_condition.notify()
+            self.__flush_thread.join(timeout)
+            self.__flush_thread = None
+        self.flush()
+        for _ in self.__threads:
+            try:
+                self.__queue.put(None, timeout=timeout)
+            except Full:
+                break
+        for thread_handle in self.__threads:
+            thread_handle.join(timeout)
+        self.__threads = []
+        if self.__session is not None:
+            self.__session.close()
+            self.__session = None
+
+    def send(self, path, data, barrier=False, batch_key=None):
+        '''
+        Queues a message to be posted. This only waits when the queue is full, and at most
+        `enqueue_timeout` seconds, after which the message is dropped and counted. Barriers
+        and batches are never dropped, they wait until there is room.
+
+        :param str path: The path of the scanner endpoint, e.g. "/v1/tile-results".
+        :param data: The JSON body of the request.
+        :type data: str or bytes
+        :param bool barrier: Whether the message may only be posted once every message
+            queued before it has been sent, as needed by /v1/algorithm-completed. Pending
+            batches are flushed first.
+        :param str batch_key: When batching is enabled, messages to the same path with the
+            same key, e.g. the slide name, are coalesced into a JSON array posted to
+            `path + "/batch"`. Messages queued with a key can also be cancelled together.
+
+        :return: Whether the message was queued, or added to a batch. Always True for
+            barriers.
+        :rtype: bool
+        '''
+        if batch_key is not None and self.batch_max_messages > 1:
+            return self.__add_to_batch(path, batch_key, data)
+        if barrier:
+            self.flush()
+        return self.__enqueue(path, data, barrier, batch_key=batch_key)
+
+    def cancel(self, batch_key):
+        '''
+        Drops the messages queued with `batch_key`, and its pending batches, instead of
+        posting them. Messages being posted are not interrupted, and messages queued
+        afterwards with the same key are posted as usual. It may wait for a batch being
+        queued while the queue is full, so it should not be called from an event loop.
+
+        :param str batch_key: The key the messages were queued with, e.g. the slide name.
+        '''
+        with self.__batch_condition:
+            for key in [key for key in self.__batches if key[1] == batch_key]:
+                self.__count("cancelled", len(self.__batches.pop(key)[0]))
+        with self.__enqueue_lock:
+            self.__cancelled[batch_key] = next(self.__sequence)
+
+    def flush(self):
+        '''
+        Queues every pending batch to be posted.
+        '''
+        with self.__batch_condition:
+            for key in list(self.__batches):
+                self.__flush_batch(key)
+
+    def flush_loop(self):
+        '''
+        Queues the batches that have been filling for `batch_interval` seconds, until the
+        sender is stopped.
+        '''
+        with self.__batch_condition:
+            while not self.__stopping:
+                now = time.monotonic()
+                timeout = self.batch_interval
+                for key, (_, _, start_time) in list(self.__batches.items()):
+                    age = now - start_time
+                    if age >= self.batch_interval:
+                        self.__flush_batch(key)
+                    else:
+                        timeout = min(timeout, self.batch_interval - age)
+                self.__batch_condition.wait(timeout)
+
+    def __add_to_batch(self, path, batch_key, data):
+        if isinstance(data, str):
+            data = data.encode()
+        key = (path, batch_key)
+        with self.__batch_condition:
+            batch = self.__batches.get(key)
+            if batch is None:
+                batch = self.__batches[key] = [[], 0, time.monotonic()]
+                self.__batch_condition.notify()
+            batch[0].append(data)
+            batch[1] += len(data)
+            if len(batch[0]) >= self.batch_max_messages or batch[1] >= self.batch_max_bytes:
+                return self.__flush_batch(key)
+        return True
+
+    def __flush_batch(self, key):
+        path, batch_key = key
+        messages, _, _ = self.__batches.pop(key)
+        self.__enqueue(
+            path + BATCH_PATH_SUFFIX, b"[" + b",".join(messages) + b"]", False, len(messages),
+            batch_key, block=True,
+        )
+        self.__count("batches")
+        return True
+
+    def __enqueue(self, path, data, barrier, num_messages=1, batch_key=None, block=False):
+        '''
+        Queues a message with the next sequence number, waiting for room in a full queue
+        without holding the enqueue lock.
+
+        :param bool block: Whether to wait for room however long it takes instead of
+            dropping the message after `enqueue_timeout`. Barriers, and batches which hold
+            many results, must never be dropped.
+
+        :return: Whether the message was queued.
+        :rtype: bool
+        '''
+        block = block or barrier
+        deadline = time.monotonic() + self.enqueue_timeout
+        while True:
+            with self.__enqueue_lock:
+                item = (next(self.__sequence), path, data, barrier, batch_key, num_messages)
+                try:
+                    self.__queue.put_nowait(item)
+                    return True
+                except Full:
+                    pass
+            if not block and time.monotonic() >= deadline:
+                self.__count("dropped", num_messages)
+                logger.warning("Outbound queue is full, dropped the message to %s", path)
+                return False
+            time.sleep(0.005)
+
+    def join(self):
+        '''
+        Blocks until every queued message has been sent or has failed. Pending batches are
+        flushed first.
+        '''
+        self.flush()
+        self.__queue.join()
+
+    def qsize(self):
+        '''
+        :return: The number of messages waiting to be sent.
+        :rtype: int
+        '''
+        return self.__queue.qsize()
+
+    def stats(self):
+        '''
+        :return: The counts of sent, failed, retried, dropped and cancelled messages, the
+            number of batches queued, and the total and maximum send latency in seconds of
+            the sent ones. A batch counts as one sent, failed or retried message, and as one
+            dropped or cancelled message per message it holds.
+        :rtype: dict
+        '''
+        with self.__stats_lock:
+            return dict(self.__stats)
+
+    def sender_loop(self):
+        '''
+        Sends queued messages until the stop sentinel is received. Errors are counted and
+        logged, they never stop the loop.
+
+        A message is registered as in progress in the same critical section it is dequeued
+        in. Messages are dequeued in sequence order, so a barrier dequeued by another thread
+        right afterwards always sees, and waits for, every message queued before it.
+        '''
+        while True:
+            item, cancelled = self.__dequeue()
+            try:
+                if item is None:
+                    return
+                sequence, path, data, barrier, batch_key, num_messages = item
+                if cancelled:
+                    self.__count("cancelled", num_messages)
+                    continue
+                if barrier:
+                    with self.__in_progress_condition:
+                        self.__in_progress_condition.wait_for(
+                            lambda sequence=sequence: all(
+                                other >= sequence for other in self.__in_progress
+                            )
+                        )
+                start_time = time.perf_counter()
+                try:
+                    self.__post(path, data)
+                finally:
+                    if self.tracer is not None:
+                        self.tracer.record(
+                            "post", batch_key, path, start_time, time.perf_counter(),
+                            {"messages": num_messages},
+                        )
+                    with self.__in_progress_condition:
+                        self.__in_progress.discard(sequence)
+                        self.__in_progress_condition.notify_all()
+            finally:
+                self.__queue.task_done()
+
+    def __dequeue(self):
+        with self.__dequeue_lock:
+            item = self.__queue.get()
+            if item is None:
+                return None, False
+            sequence, batch_key = item[0], item[4]
+            cancelled = sequence < self.__cancelled.get(batch_key, -1)
+            if not cancelled:
+                with self.__in_progress_condition:
+                    self.__in_progress.add(sequence)
+        return item, cancelled
+
+    def __post(self, path, data):
+        url = self.base_url + path
+        transient_errors, request_error = self.__errors
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.__count("retried")
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            start_time = time.perf_counter()
+            try:
+                response = self.__session.post(url, data=data, timeout=self.timeout)
+            except transient_errors as e:
+                error = e
+                continue
+            except request_error as e:
+                error = e
+                break
+            if response.status_code in RETRY_STATUS_CODES:
+                error = f"status code {response.status_code}"
+                continue
+            if response.status_code >= 400:
+                error = f"status code {response.status_code}"
+                break
+            self.__record_latency(time.perf_counter() - start_time)
+            return
+        self.__count("failed")
+        logger.warning("Failed to post to %s: %s", url, error)
+
+    def __count(self, name, count=1):
+        with self.__stats_lock:
+            self.__stats[name] += count
+
+    def __record_latency(self, latency):
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(latency)
+        with self.__stats_lock:
+            self.__stats["sent"] += 1
+            self.__stats["latency_total"] += latency
+            self.__stats["latency_max"] = max(self.__stats["latency_max"], latency)
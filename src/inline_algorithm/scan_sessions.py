@@ -0,0 +1,256 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Per-slide scan sessions and a fair scheduler interleaving the messages of the slides
+being scanned at the same time.
+'''
+import time
+from collections import deque
+from threading import Condition
+from .models import ScanStart, ScanOngoing, ScanEnd, ScanAbort
+
+
+class ScanSession:
+    '''
+    The state of one scan of a slide: the parameters of its ScanStart, its queued
+    messages, its tile counters and whether it was aborted.
+
+    :param str slide_name: The name of the slide.
+    '''
+
+    def __init__(self, slide_name):
+        self.slide_name = slide_name
+        self.created_time = time.perf_counter() # When the first message of the scan came.
+        self.scan_start = None # The ScanStart message of the scan, once handled.
+        self.has_scan_start = False # Whether a ScanStart was queued in this session.
+        self.messages = deque() # The queued messages of the scan, in arrival order.
+        self.enqueue_times = deque() # The perf_counter() time each message was queued at.
+        self.tiles_received = 0
+        self.tiles_processed = 0
+        self.tiles_posted = 0
+        self.tiles_cancelled = 0 # Queued tiles dropped because the scan was aborted.
+        self.aborted = False # Whether a ScanAbort was received for the scan.
+        self.detection_merger = None # Merges the detections of neighboring tiles, if enabled.
+
+    @property
+    def algorithm_id(self):
+        '''
+        The algorithm_id of the ongoing scan, or an empty string if the slide has not
+        been started.
+        '''
+        if self.scan_start is None:
+            return ""
+        return self.scan_start.algorithm_id
+
+    def start(self, scan_start):
+        '''
+        Records the parameters of the scan once its ScanStart is handled.
+
+        :param ScanStart scan_start: The ScanStart message of the scan.
+        '''
+        self.scan_start = scan_start
+
+
+class SessionScheduler:
+    '''
+    A registry of scan sessions keyed by slide name, replacing a single FIFO queue.
+    Messages keep their arrival order within a session, while `get` hands out the
+    messages of the sessions with queued messages in turn, so that the tail of one scan
+    overlaps fairly with the start of the next one. A ScanStart for a slide whose
+    session already has one opens a new session, the previous one keeps draining.
+
+    Control messages have priority over tiles: a session whose next message is a
+    ScanStart, ScanEnd or ScanAbort is served before the sessions whose next message is a
+    tile, and `abort` drops the queued tiles of a slide so that its ScanAbort is handled
+    right away.
+
+    :param Histogram queue_wait_histogram: A histogram recording the time every tile
+        waited in the queue, if given.
+    :param SpanTracer tracer: A tracer recording the time every tile waited in the queue
+        as a span, if given.
+    '''
+
+    def __init__(self, queue_wait_histogram=None, tracer=None):
+        self.queue_wait_histogram = queue_wait_histogram
+        self.tracer = tracer
+        self.__sessions = {} # The active sessions, by slide name.
+        self.__ready = deque() # The sessions with queued messages, in turn order.
+        self.__size = 0 # The number of queued messages over every session.
+        self.__condition = Condition()
+
+    def put(self, message):
+        '''
+        Queues a message in the session of its slide, creating the session if needed.
+
+        :param message: A ScanStart, ScanOngoing, ScanEnd or ScanAbort message.
+        '''
+        with self.__condition:
+            session = self.__sessions.get(message.slide_name)
+            if session is None or (isinstance(message, ScanStart) and session.has_scan_start):
+                session = ScanSession(message.slide_name)
+                self.__sessions[message.slide_name] = session
+            if isinstance(message, ScanStart):
+                session.has_scan_start = True
+            if not session.messages:
+                self.__schedule(session, message)
+            session.messages.append(message)
+            session.enqueue_times.append(time.perf_counter())
+            if isinstance(message, ScanOngoing):
+                session.tiles_received += 1
+            self.__size += 1
+            self.__condition.notify()
+
+    def get(self, timeout=None):
+        '''
+        Returns the next message of the next session in turn, blocking until a message
+        is queued. A session is removed from the registry once its ScanEnd or ScanAbort
+        has been handed out and no other message is queued for its slide.
+
+        :param float timeout: The maximum time in seconds to wait, or None to wait forever.
+
+        :return: The session and its message, or (None, None) on timeout.
+        :rtype: tuple
+        '''
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__ready, timeout):
+                return None, None
+            session = self.__ready.popleft()
+            message = self.__pop(session)
+            if session.messages:
+                self.__schedule(session, session.messages[0])
+            elif (
+                isinstance(message, (ScanEnd, ScanAbort))
+                and self.__sessions.get(session.slide_name) is session
+            ):
+                del self.__sessions[session.slide_name]
+            return session, message
+
+    def abort(self, message):
+        '''
+        Queues a ScanAbort ahead of the messages of the other slides. The tiles and the
+        ScanEnd queued for the slide are dropped, only a ScanStart not handled yet is kept
+        in front of the ScanAbort, and the session is marked as aborted so that the tiles
+        already dequeued can be discarded too.
+
+        :param ScanAbort message: The ScanAbort message.
+
+        :return: The aborted session, or None if the slide has no active session, and the
+            dropped tiles.
+        :rtype: tuple
+        '''
+        with self.__condition:
+            session = self.__sessions.get(message.slide_name)
+            if session is None:
+                self.put(message)
+                return None, []
+            kept, dropped = [], []
+            for queued_message, enqueue_time in zip(session.messages, session.enqueue_times):
+                if isinstance(queued_message, ScanStart):
+                    kept.append((queued_message, enqueue_time))
+                elif isinstance(queued_message, ScanOngoing):
+                    dropped.append(queued_message)
+            self.__size -= len(session.messages) - len(kept)
+            session.tiles_cancelled += len(dropped)
+            session.aborted = True
+            session.messages = deque(queued_message for queued_message, _ in kept)
+            session.enqueue_times = deque(enqueue_time for _, enqueue_time in kept)
+            if session in self.__ready:
+                self.__ready.remove(session)
+            self.__schedule(session, message)
+            session.messages.append(message)
+            session.enqueue_times.append(time.perf_counter())
+            self.__size += 1
+            self.__condition.notify()
+            return session, dropped
+
+    def get_tile(self, session, timeout):
+        '''
+        Returns the next message of the given session if it is a tile, waiting at most
+        `timeout` seconds for one to be queued. Used to fill batches with the tiles of a
+        single slide.
+
+        :param ScanSession session: The session to read from.
+        :param float timeout: The maximum time in seconds to wait.
+
+        :return: The next tile, or None if the next message is not a tile or none came.
+        :rtype: ScanOngoing
+        '''
+        deadline = time.monotonic() + timeout
+        with self.__condition:
+            while not session.messages:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.__sessions.get(session.slide_name) is not session:
+                    return None
+                self.__condition.wait(remaining)
+            if not isinstance(session.messages[0], ScanOngoing):
+                return None
+            message = self.__pop(session)
+            if not session.messages:
+                self.__ready.remove(session)
+            return message
+
+    def get_session(self, slide_name):
+        '''
+        :param str slide_name: The name of the slide.
+
+        :return: The active session of the slide, or None.
+        :rtype: ScanSession
+        '''
+        with self.__condition:
+            return self.__sessions.get(slide_name)
+
+    def sessions(self):
+        '''
+        :return: The active sessions.
+        :rtype: list
+        '''
+        with self.__condition:
+            return list(self.__sessions.values())
+
+    def qsize(self):
+        '''
+        :return: The number of queued messages over every session.
+        :rtype: int
+        '''
+        return self.__size
+
+    def __schedule(self, session, next_message):
+        '''
+        Adds a session to the turn order, in front of it if its next message is a control
+        message.
+        '''
+        if isinstance(next_message, ScanOngoing):
+            self.__ready.append(session)
+        else:
+            self.__ready.appendleft(session)
+
+    def __pop(self, session):
+        self.__size -= 1
+        enqueue_time = session.enqueue_times.popleft()
+        message = session.messages.popleft()
+        if isinstance(message, ScanOngoing):
+            if self.queue_wait_histogram is not None:
+                self.queue_wait_histogram.observe(time.perf_counter() - enqueue_time)
+            if self.tracer is not None:
+                self.tracer.record(
+                    "queue_wait", message.slide_name, message.tile_name,
+                    enqueue_time, time.perf_counter(),
+                )
+        return message
@@ -0,0 +1,121 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Serialization of the results of a tile into the JSON body of /v1/tile-results.
+
+The detections are validated once, through AoiResults, and the TileResults envelope is
+written as a plain dict, since its other fields come from already validated messages.
+ColumnarDetections are checked when they are built, and converted without validation.
+Either way the body has the keys of a validated TileResults.
+JSON is encoded with orjson when it is installed, and with the standard library otherwise.
+'''
+import json
+from pydantic import BaseModel
+from .detections import ColumnarDetections
+from .models import AoiResults
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    '''
+    Encodes the values the JSON encoders do not support natively: Pydantic models, such
+    as DetectionArray, and NumPy arrays and scalars.
+    '''
+    if isinstance(value, BaseModel):
+        return value.dict(by_alias=True)
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    '''
+    Encodes a message to JSON.
+
+    :param data: The message.
+
+    :return: The UTF-8 encoded JSON.
+    :rtype: bytes
+    '''
+    if orjson is not None:
+        # pylint: disable=no-member
+        return orjson.dumps(data, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, default=_default).encode()
+
+
+def _complete_detections(detection_array):
+    '''
+    Adds the optional keys of DetectionArray that trusted detection dicts leave out, so
+    that the body has the same schema as validated results. Lists are left as they are.
+    '''
+    return [
+        {**detection, "scan_at_other_mag": None}
+        if isinstance(detection, dict) and "scan_at_other_mag" not in detection
+        else detection
+        for detection in detection_array
+    ]
+
+
+def serialize_tile_results(algorithm_id, message, model_results, trusted=False):
+    '''
+    Builds the body of /v1/tile-results for the results of one tile.
+
+    :param str algorithm_id: The algorithm_id of the ongoing scan.
+    :param ScanOngoing message: The tile the results belong to.
+    :param model_results: The detections returned for the tile.
+    :type model_results: list or ColumnarDetections
+    :param bool trusted: Whether to skip validating the detections. They are then encoded
+        as returned, so they must already follow the DetectionArray or List[List] format;
+        DetectionArray instances and NumPy values are accepted. The optional
+        `scan_at_other_mag` key is added to detection dicts that leave it out.
+
+    :return: The UTF-8 encoded JSON body.
+    :rtype: bytes
+    :raises pydantic.ValidationError: If the detections are invalid and not trusted.
+    '''
+    if isinstance(model_results, ColumnarDetections):
+        model_results = model_results.to_detection_array()
+        trusted = True
+    elif trusted:
+        model_results = _complete_detections(model_results)
+    if trusted:
+        results = {
+            "detection_array": model_results,
+            "row_idx": message.row_idx,
+            "col_idx": message.col_idx,
+            "z_stack_to_preserve": None,
+        }
+    else:
+        results = AoiResults(
+            detection_array=model_results,
+            row_idx=message.row_idx,
+            col_idx=message.col_idx,
+        ).dict(by_alias=True)
+    return dumps({
+        "algorithm_id": algorithm_id,
+        "slide_name": message.slide_name,
+        "tile_name": message.tile_name,
+        "results": results,
+        "scan_at_other_mag": None,
+    })
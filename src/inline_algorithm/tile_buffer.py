@@ -0,0 +1,195 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+A ring buffer in shared memory holding the pixels of the tiles uploaded to
+/v1/scan/image-tile/raw, so that they reach process() without touching the filesystem and
+without being copied again, including in the workers of a process pool.
+'''
+from collections import deque
+from multiprocessing import shared_memory
+from threading import Lock
+import numpy as np
+
+# Allocations start on cache line boundaries.
+ALIGNMENT = 64
+
+# The shared memory blocks attached by this process, by name.
+_ATTACHED = {}
+
+
+def _attach(name):
+    memory = _ATTACHED.get(name)
+    if memory is None:
+        memory = _ATTACHED[name] = shared_memory.SharedMemory(name=name)
+    return memory
+
+
+class SharedTile:
+    '''
+    A handle to the pixels of a tile in a SharedTileRing. It is pickled as the name of the
+    shared memory block and the position of the tile, so a worker process maps the same
+    memory instead of receiving a copy of the pixels.
+
+    :param str name: The name of the shared memory block.
+    :param int offset: The offset of the pixels in the block.
+    :param tuple shape: The shape of the tile array.
+    :param str dtype: The type of the pixels.
+    '''
+
+    def __init__(self, name, offset, shape, dtype):
+        self.name = name
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+    @property
+    def nbytes(self):
+        '''
+        The size of the pixels in bytes.
+        '''
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def buffer(self):
+        '''
+        :return: A writable view of the bytes of the tile, to receive its pixels.
+        :rtype: memoryview
+        '''
+        return _attach(self.name).buf[self.offset:self.offset + self.nbytes]
+
+    def result(self):
+        '''
+        Returns the pixels as a read-only array view of the shared memory, named like
+        `Future.result` so that ScanOngoing resolves it like a prefetched tile. The view
+        is only valid until the tile is released, once process() has returned.
+
+        :rtype: numpy.ndarray
+        '''
+        tile_image = np.ndarray(
+            self.shape, dtype=self.dtype, buffer=_attach(self.name).buf, offset=self.offset
+        )
+        tile_image.flags.writeable = False
+        return tile_image
+
+
+class SharedTileRing:
+    '''
+    Allocates the tiles of uploaded pixels in one shared memory block of a fixed size,
+    in arrival order. Tiles are usually released in the same order, once processed, so the
+    free space is the contiguous region between the newest and the oldest allocations.
+    A tile released out of order is reclaimed when every tile allocated before it has been
+    released too.
+
+    :param int capacity: The size in bytes of the shared memory block.
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.__memory = shared_memory.SharedMemory(create=True, size=capacity)
+        _ATTACHED[self.__memory.name] = self.__memory
+        self.__lock = Lock()
+        # The start and end offsets of the live allocations and whether they were
+        # released, in allocation order.
+        self.__allocations = deque()
+        self.__head = 0 # The offset of the next allocation.
+        # The allocation of every tile not released yet, by message id.
+        self.__entries = {}
+
+    def allocate(self, message, shape, dtype):
+        '''
+        Reserves room for the pixels of the tile of a message.
+
+        :param ScanOngoing message: The message of the tile.
+        :param tuple shape: The shape of the tile array.
+        :param str dtype: The type of the pixels.
+
+        :return: The handle of the tile, to fill through its `buffer()`, or None if the
+            ring has no room left for it.
+        :rtype: SharedTile
+        '''
+        shared_tile = SharedTile(self.__memory.name, 0, shape, np.dtype(dtype).str)
+        size = -(-max(shared_tile.nbytes, 1) // ALIGNMENT) * ALIGNMENT
+        with self.__lock:
+            offset = self.__find_room(size)
+            if offset is None:
+                return None
+            allocation = [offset, offset + size, False]
+            self.__allocations.append(allocation)
+            self.__entries[id(message)] = allocation
+            self.__head = offset + size
+        shared_tile.offset = offset
+        return shared_tile
+
+    def release(self, message):
+        '''
+        Frees the room of the tile of a message. Messages that hold no tile of the ring are
+        ignored.
+
+        :param ScanOngoing message: The processed or discarded message.
+        '''
+        with self.__lock:
+            allocation = self.__entries.pop(id(message), None)
+            if allocation is None:
+                return
+            allocation[2] = True
+            while self.__allocations and self.__allocations[0][2]:
+                self.__allocations.popleft()
+            if not self.__allocations:
+                self.__head = 0
+
+    def stats(self):
+        '''
+        :return: The number of tiles held in the ring and the bytes they take, including
+            the tiles released out of order and not reclaimed yet.
+        :rtype: dict
+        '''
+        with self.__lock:
+            if not self.__allocations:
+                used = 0
+            else:
+                used = (self.__head - self.__allocations[0][0]) % self.capacity or self.capacity
+            return {"tiles": len(self.__entries), "bytes": used, "capacity": self.capacity}
+
+    def close(self):
+        '''
+        Releases the shared memory block. Views of the pixels still referenced elsewhere
+        keep the mapping alive until they are garbage collected.
+        '''
+        _ATTACHED.pop(self.__memory.name, None)
+        try:
+            self.__memory.close()
+        except BufferError:
+            pass
+        self.__memory.unlink()
+
+    def __find_room(self, size):
+        if size > self.capacity:
+            return None
+        if not self.__allocations:
+            return 0
+        tail = self.__allocations[0][0]
+        if self.__head > tail:
+            # The live allocations are contiguous, there is room after them and, by
+            # wrapping around, before them.
+            if self.__head + size <= self.capacity:
+                return self.__head
+            return 0 if size <= tail else None
+        # The allocations wrapped around, the only room is between the newest and the
+        # oldest of them.
+        return self.__head if self.__head + size <= tail else None
@@ -0,0 +1,168 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+A bounded reader pool loading tiles ahead of process(), so that disk reads and decoding
+overlap with the inference of the tiles queued in front of them.
+'''
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from .tile_reader import load_pixels
+
+
+class TilePrefetcher:
+    '''
+    Starts reading the tile of a ScanOngoing message as soon as it is enqueued and
+    attaches the pending result to the message. Tiles arriving while `max_tiles` tiles
+    are already prefetched, or while the prefetched pixels take `max_bytes` or more, wait
+    in arrival order for a slot to be released. Tiles dequeued before getting a slot are
+    read on demand instead.
+
+    Tiles returned as views of memory-mapped files, such as uncompressed BMPs, are copied
+    into memory by the reader thread: the file would otherwise only be read when
+    `process` first touches the pixels, and `max_bytes` would count mapped bytes rather
+    than memory in use.
+
+    :param callable read_tile_image: Reads the tile at the given path into an array.
+    :param int num_readers: The number of reader threads.
+    :param int max_tiles: The maximum number of prefetched tiles not yet released.
+    :param int max_bytes: The maximum memory in bytes held by prefetched tiles, or None
+        for no limit besides `max_tiles`.
+    :param callable on_loaded: Called with every message whose tile was read, on the
+        reader thread and before the pending result resolves, e.g. to hash the tile.
+    '''
+
+    def __init__(self, read_tile_image, num_readers=2, max_tiles=8, max_bytes=None,
+                 on_loaded=None):
+        self.read_tile_image = read_tile_image
+        self.max_tiles = max_tiles
+        self.max_bytes = max_bytes
+        self.on_loaded = on_loaded
+
+        self.__executor = ThreadPoolExecutor(
+            max_workers=num_readers,
+            thread_name_prefix="inline-algorithm-prefetch",
+        )
+        self.__lock = Lock()
+        # The future and the size in bytes of every prefetched tile, by message id.
+        self.__entries = {}
+        self.__held_bytes = 0
+        # The messages waiting for a prefetch slot, by message id, in arrival order.
+        self.__waiting = {}
+
+    def submit(self, message):
+        '''
+        Starts prefetching the tile of the message if the limits allow it.
+
+        :param ScanOngoing message: The enqueued message.
+
+        :return: Whether the tile is being prefetched, rather than waiting for a slot.
+        :rtype: bool
+        '''
+        with self.__lock:
+            if self.__waiting or not self.__has_room():
+                self.__waiting[id(message)] = message
+                return False
+            entry = self.__reserve(message)
+        self.__start(message, entry)
+        return True
+
+    def dequeued(self, message):
+        '''
+        Withdraws a message that is about to be processed from the waiting messages, its
+        tile will be read on demand.
+
+        :param ScanOngoing message: The dequeued message.
+        '''
+        with self.__lock:
+            self.__waiting.pop(id(message), None)
+
+    def release(self, message):
+        '''
+        Frees the prefetch slot of the message once its tile has been processed, or
+        cancels the prefetch if it has not started yet, then hands the freed room to the
+        waiting messages.
+
+        :param ScanOngoing message: The processed message.
+        '''
+        with self.__lock:
+            self.__waiting.pop(id(message), None)
+            entry = self.__entries.pop(id(message), None)
+            if entry is not None:
+                self.__held_bytes -= entry[1]
+            started = []
+            while self.__waiting and self.__has_room():
+                waiting_message = self.__waiting.pop(next(iter(self.__waiting)))
+                started.append((waiting_message, self.__reserve(waiting_message)))
+        if entry is not None and entry[0] is not None:
+            entry[0].cancel()
+        for waiting_message, waiting_entry in started:
+            self.__start(waiting_message, waiting_entry)
+
+    def stats(self):
+        '''
+        :return: The number of prefetched tiles not yet released, the bytes they hold and
+            the number of tiles waiting for a slot.
+        :rtype: dict
+        '''
+        with self.__lock:
+            return {
+                "tiles": len(self.__entries),
+                "bytes": self.__held_bytes,
+                "waiting": len(self.__waiting),
+            }
+
+    def shutdown(self):
+        '''
+        Stops the reader threads, cancelling the prefetches that have not started.
+        '''
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def __has_room(self):
+        if len(self.__entries) >= self.max_tiles:
+            return False
+        return self.max_bytes is None or self.__held_bytes < self.max_bytes
+
+    def __reserve(self, message):
+        entry = [None, 0]
+        self.__entries[id(message)] = entry
+        return entry
+
+    def __start(self, message, entry):
+        key = id(message)
+        future = self.__executor.submit(self.__read, message)
+        entry[0] = future
+        message.attach_tile_image(future)
+        future.add_done_callback(lambda future: self.__on_done(key, future))
+
+    def __read(self, message):
+        tile_image = load_pixels(self.read_tile_image(message.tile_image_path))
+        if self.on_loaded is not None:
+            self.on_loaded(message)
+        return tile_image
+
+    def __on_done(self, key, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        nbytes = getattr(future.result(), "nbytes", 0)
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                entry[1] = nbytes
+                self.__held_bytes += nbytes
@@ -0,0 +1,212 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Helpers to load the tile images referenced by ScanOngoing messages as NumPy arrays.
+
+Uncompressed BMPs, as written by the scanner, are memory-mapped and exposed as read-only
+views without any decoding or copying. Other images fall back to Pillow or OpenCV, which
+are only imported by the first of them, as they take longer to import than the whole
+server otherwise needs to start.
+'''
+import mmap
+import struct
+import numpy as np
+
+# The Pillow Image module and the OpenCV module, once imported, or None if not installed.
+_DECODERS = None
+
+# BITMAPFILEHEADER: signature, file size, two reserved fields and the pixel data offset.
+BMP_FILE_HEADER = struct.Struct("<2sIHHI")
+# The leading fields of BITMAPINFOHEADER and of its larger V4/V5 successors.
+BMP_INFO_HEADER = struct.Struct("<IiiHHIIiiII")
+BI_RGB = 0
+
+
+class UnsupportedBmpError(ValueError):
+    '''
+    Raised by `read_bmp` for BMP variants that cannot be exposed as a plain array view,
+    such as compressed, palette or 16 bit images.
+    '''
+
+
+def read_bmp(tile_image_path, rgb=True):
+    '''
+    Memory-maps an uncompressed 24 or 32 bit BMP, or an 8 bit grayscale one, and returns
+    a read-only view of its pixels. Bottom-up row order and BGR channel order are handled
+    with strided views, so no pixel is read until it is used. The file stays mapped as
+    long as the returned array, or a view of it, is alive.
+
+    :param str tile_image_path: The path of the BMP file.
+    :param bool rgb: Whether to return the channels in RGB order, otherwise they are
+        returned in the BGR order used by OpenCV. The alpha channel of 32 bit images is
+        dropped either way.
+
+    :return: A read-only array of shape (height, width, 3), or (height, width) for 8 bit
+        grayscale images.
+    :rtype: numpy.ndarray
+    :raises UnsupportedBmpError: If the file is not a BMP that can be mapped as is.
+    '''
+    with open(tile_image_path, "rb") as file:
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            raise UnsupportedBmpError(f"{tile_image_path} is empty") from e
+
+    if len(buffer) < BMP_FILE_HEADER.size + BMP_INFO_HEADER.size:
+        raise UnsupportedBmpError(f"{tile_image_path} is too small to be a BMP")
+    signature, _, _, _, data_offset = BMP_FILE_HEADER.unpack_from(buffer, 0)
+    (
+        info_size,
+        width,
+        height,
+        planes,
+        bit_count,
+        compression,
+        _,
+        _,
+        _,
+        colors_used,
+        _,
+    ) = BMP_INFO_HEADER.unpack_from(buffer, BMP_FILE_HEADER.size)
+    if signature != b"BM" or info_size < BMP_INFO_HEADER.size or planes != 1:
+        raise UnsupportedBmpError(f"{tile_image_path} is not a supported BMP")
+    if compression != BI_RGB or bit_count not in (8, 24, 32) or width <= 0 or height == 0:
+        raise UnsupportedBmpError(
+            f"{tile_image_path} uses an unsupported BMP variant "
+            f"({bit_count} bit, compression {compression})"
+        )
+    if bit_count == 8 and not _is_grayscale_palette(
+        buffer, BMP_FILE_HEADER.size + info_size, colors_used or 256
+    ):
+        raise UnsupportedBmpError(f"{tile_image_path} uses a color palette")
+
+    rows = abs(height)
+    channels = bit_count // 8
+    row_stride = (width * bit_count + 31) // 32 * 4
+    if data_offset + row_stride * rows > len(buffer):
+        raise UnsupportedBmpError(f"{tile_image_path} is truncated")
+
+    pixels = np.ndarray(
+        shape=(rows, width, channels),
+        dtype=np.uint8,
+        buffer=buffer,
+        offset=data_offset,
+        strides=(row_stride, channels, 1),
+    )
+    if height > 0:
+        pixels = pixels[::-1]
+    if channels == 1:
+        return pixels[..., 0]
+    if rgb:
+        return pixels[..., 2::-1]
+    return pixels[..., :3]
+
+
+def _is_grayscale_palette(buffer, palette_offset, palette_size):
+    palette_bytes = palette_size * 4
+    if palette_size != 256 or palette_offset + palette_bytes > len(buffer):
+        return False
+    palette = np.frombuffer(buffer, dtype=np.uint8, count=palette_bytes, offset=palette_offset)
+    palette = palette.reshape(256, 4)[:, :3]
+    return bool(np.all(palette == np.arange(256, dtype=np.uint8)[:, None]))
+
+
+def _import_decoders():
+    global _DECODERS # pylint: disable=global-statement
+    if _DECODERS is None:
+        # pylint: disable=import-outside-toplevel
+        try:
+            from PIL import Image
+        except ImportError:
+            Image = None
+        cv2 = None
+        if Image is None:
+            try:
+                import cv2
+            except ImportError:
+                pass
+        _DECODERS = (Image, cv2)
+    return _DECODERS
+
+
+def decode_tile(tile_image_path):
+    '''
+    Decodes a tile image of any format supported by Pillow, or OpenCV when Pillow is not
+    installed, into an RGB NumPy array of shape (height, width, 3), or (height, width)
+    for grayscale tiles.
+
+    :param str tile_image_path: The path of the tile image.
+
+    :return: The decoded pixels.
+    :rtype: numpy.ndarray
+    :raises ImportError: If neither Pillow nor OpenCV is installed.
+    :raises ValueError: If the image cannot be decoded.
+    '''
+    image_module, cv2 = _import_decoders()
+    if image_module is not None:
+        with image_module.open(tile_image_path) as image:
+            return np.asarray(image)
+    if cv2 is not None:
+        image = cv2.imread(tile_image_path, cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise ValueError(f"Could not decode {tile_image_path}")
+        if image.ndim == 3:
+            image = image[..., 2::-1]
+        return image
+    raise ImportError(
+        "Pillow or OpenCV is required to decode non BMP tile images: pip install Pillow"
+    )
+
+
+def load_pixels(tile_image):
+    '''
+    Reads the pixels of a view of a memory-mapped file, such as the arrays returned by
+    `read_bmp`, into memory, so that the disk is read now rather than when the pixels are
+    first used. Other arrays are returned as they are.
+
+    :param numpy.ndarray tile_image: The pixels of a tile.
+
+    :return: The pixels, in memory. Copies of memory-mapped views are writable.
+    :rtype: numpy.ndarray
+    '''
+    base = tile_image
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, mmap.mmap):
+        return np.array(tile_image)
+    return tile_image
+
+
+def read_tile(tile_image_path):
+    '''
+    Loads a tile image as an RGB NumPy array, memory-mapping uncompressed BMPs with
+    `read_bmp` and decoding anything else with `decode_tile`.
+
+    :param str tile_image_path: The path of the tile image.
+
+    :return: The pixels of the tile. Arrays of memory-mapped BMPs are read-only.
+    :rtype: numpy.ndarray
+    '''
+    if tile_image_path.lower().endswith(".bmp"):
+        try:
+            return read_bmp(tile_image_path)
+        except UnsupportedBmpError:
+            pass
+    return decode_tile(tile_image_path)
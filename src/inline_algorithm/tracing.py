@@ -0,0 +1,257 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+Per-tile tracing of the pipeline stages, exported in the Chrome trace event format that
+chrome://tracing and Perfetto open, and on demand cProfile capture of process().
+
+Spans are recorded on the hot path without locks: every span is one tuple written to a
+preallocated ring, at a slot taken from an atomic counter. When the ring is full the
+oldest spans are overwritten.
+'''
+import io
+import os
+import time
+import itertools
+import threading
+from contextlib import nullcontext
+from threading import Lock, get_ident
+
+# The context manager used in place of a span when tracing is disabled.
+NULL_SPAN = nullcontext()
+
+
+class _Span:
+    '''
+    Records a span from the time it is entered to the time it exits.
+    '''
+    __slots__ = ("tracer", "name", "slide_name", "tile_name", "start_time")
+
+    def __init__(self, tracer, name, slide_name, tile_name):
+        self.tracer = tracer
+        self.name = name
+        self.slide_name = slide_name
+        self.tile_name = tile_name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(
+            self.name, self.slide_name, self.tile_name, self.start_time, time.perf_counter()
+        )
+
+
+class SpanTracer:
+    '''
+    A ring buffer of the spans of the pipeline stages. A span is the name of a stage, the
+    slide and tile it worked on, its start and end times from `time.perf_counter`, and
+    the process and thread that ran it.
+
+    :param int capacity: The number of spans kept, the oldest ones are overwritten.
+    '''
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+        self.__spans = [None] * capacity
+        self.__counter = itertools.count() # next() is atomic, it hands out the slots.
+        self.__recorded = 0
+        self.__pid = os.getpid()
+
+    def span(self, name, slide_name=None, tile_name=None):
+        '''
+        :param str name: The name of the stage.
+        :param str slide_name: The slide the stage works on.
+        :param str tile_name: The tile the stage works on.
+
+        :return: A context manager recording the span of its block.
+        '''
+        return _Span(self, name, slide_name, tile_name)
+
+    def record(self, name, slide_name, tile_name, start_time, end_time, args=None,
+               pid=None, tid=None):
+        '''
+        Records a span measured by the caller.
+
+        :param str name: The name of the stage.
+        :param str slide_name: The slide the stage worked on.
+        :param str tile_name: The tile the stage worked on.
+        :param float start_time: The `time.perf_counter` time the stage started at.
+        :param float end_time: The `time.perf_counter` time the stage ended at.
+        :param dict args: Other values shown with the span.
+        :param int pid: The process that ran the stage, this one by default.
+        :param int tid: The thread that ran the stage, the calling one by default.
+        '''
+        self.__recorded = index = next(self.__counter)
+        self.__spans[index % self.capacity] = (
+            name, slide_name, tile_name, start_time, end_time, args,
+            pid or self.__pid, tid or get_ident(),
+        )
+
+    def stats(self):
+        '''
+        :return: The number of spans recorded and of spans overwritten.
+        :rtype: dict
+        '''
+        recorded = self.__recorded + 1 if self.__spans[0] is not None else 0
+        return {"recorded": recorded, "overwritten": max(0, recorded - self.capacity)}
+
+    def chrome_trace(self, slide_name=None, since=None):
+        '''
+        Exports the spans in the Chrome trace event format, as complete events in
+        microseconds, one track per process and thread.
+
+        :param str slide_name: Only export the spans of this slide, or every span if None.
+        :param float since: Only export the spans started after this `time.perf_counter`
+            time, e.g. the start of a scan.
+
+        :return: The trace, to be encoded to JSON.
+        :rtype: dict
+        '''
+        spans = [span for span in list(self.__spans) if span is not None]
+        spans = [
+            span for span in spans
+            if (slide_name is None or span[1] == slide_name)
+            and (since is None or span[3] >= since)
+        ]
+        spans.sort(key=lambda span: span[3])
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events = []
+        tracks = set()
+        for name, span_slide, tile_name, start_time, end_time, args, pid, tid in spans:
+            event_args = {"slide_name": span_slide, "tile_name": tile_name}
+            if args:
+                event_args.update(args)
+            events.append({
+                "name": name,
+                "cat": "inline_algorithm",
+                "ph": "X",
+                "ts": start_time * 1e6,
+                "dur": (end_time - start_time) * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": event_args,
+            })
+            tracks.add((pid, tid))
+        for pid, tid in sorted(tracks):
+            if pid == self.__pid:
+                thread_name = thread_names.get(tid, str(tid))
+            else:
+                thread_name = f"worker process {pid}"
+            events.append({
+                "name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                "args": {"name": thread_name},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class ProcessProfiler:
+    '''
+    Captures cProfile statistics of `process` on demand: once started, one call in `every`
+    is profiled until `calls` calls have been, and the statistics of all of them are added
+    up. Only one call is profiled at a time, the calls running in other threads meanwhile
+    are not. When no capture is running the cost of a call is one comparison.
+
+    cProfile and pstats are only imported by the first profiled call.
+    '''
+
+    def __init__(self):
+        self.__lock = Lock() # Held while a call is being profiled.
+        self.__remaining = 0 # The number of calls left to profile.
+        self.__every = 1
+        self.__calls = 0 # The calls seen since the capture started.
+        self.__profiled = 0 # The calls profiled since the capture started.
+        self.__stats = None
+
+    def start(self, calls, every=1):
+        '''
+        Starts a new capture, discarding the statistics of the previous one.
+
+        :param int calls: The number of calls to profile.
+        :param int every: Profile one call in `every`.
+        '''
+        with self.__lock:
+            self.__every = max(1, every)
+            self.__calls = 0
+            self.__profiled = 0
+            self.__stats = None
+            self.__remaining = calls
+
+    def run(self, function, *args):
+        '''
+        Calls the function, profiling the call if it is sampled.
+
+        :param callable function: The function to call, e.g. `process_batch`.
+
+        :return: The result of the function.
+        '''
+        if self.__remaining <= 0:
+            return function(*args)
+        self.__calls += 1
+        if self.__calls % self.__every:
+            return function(*args)
+        if not self.__lock.acquire(blocking=False): # pylint: disable=consider-using-with
+            return function(*args)
+        try:
+            if self.__remaining <= 0:
+                return function(*args)
+            import pstats # pylint: disable=import-outside-toplevel
+            import cProfile # pylint: disable=import-outside-toplevel
+            profile = cProfile.Profile()
+            try:
+                return profile.runcall(function, *args)
+            finally:
+                if self.__stats is None:
+                    self.__stats = pstats.Stats(profile)
+                else:
+                    self.__stats.add(profile)
+                self.__profiled += 1
+                self.__remaining -= 1
+        finally:
+            self.__lock.release()
+
+    def status(self):
+        '''
+        :return: The number of calls profiled and of calls left to profile.
+        :rtype: dict
+        '''
+        return {"profiled": self.__profiled, "remaining": self.__remaining}
+
+    def report(self, sort="cumulative", limit=40):
+        '''
+        :param str sort: A value of pstats.SortKey, e.g. "cumulative" or "time".
+        :param int limit: The number of functions listed.
+
+        :return: The statistics of the capture as text, empty if no call was profiled.
+        :rtype: str
+        :raises ValueError: If `sort` is not a value of pstats.SortKey.
+        '''
+        import pstats # pylint: disable=import-outside-toplevel
+        sort_keys = [key.value for key in pstats.SortKey] # pylint: disable=not-an-iterable
+        if sort not in sort_keys:
+            raise ValueError(f"Unknown sort key {sort!r}, expected one of {sort_keys}")
+        with self.__lock:
+            if self.__stats is None:
+                return ""
+            output = io.StringIO()
+            self.__stats.stream = output
+            self.__stats.sort_stats(sort).print_stats(limit)
+            return output.getvalue()
@@ -0,0 +1,281 @@
+'''
+Licensed to the Apache Software Foundation (ASF) under one
+or more contributor license agreements.  See the NOTICE file
+distributed with this work for additional information
+regarding copyright ownership.  The ASF licenses this file
+to you under the Apache License, Version 2.0 (the
+"License"); you may not use this file except in compliance
+with the License.  You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing,
+software distributed under the License is distributed on an
+"AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+KIND, either express or implied.  See the License for the
+specific language governing permissions and limitations
+under the License.
+
+---
+
+The calls of process() or process_batch() on batches of tiles, on the handler thread or
+in a pool of threads or processes whose results are handed back in submission order.
+'''
+import os
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait
+from queue import Queue, Empty
+from threading import Thread, get_ident
+from .readiness import warm_up_messages
+from .result_cache import combine_results
+
+# The algorithm instance owned by a worker process of the process pool.
+_WORKER_ALGORITHM = None
+
+
+def _init_worker(algorithm, warm_up_queue):
+    '''
+    Initializer of the process pool workers. Keeps the unpickled algorithm for the
+    lifetime of the worker and runs its server start hook, so that every worker loads
+    its own model, then warms the model up.
+
+    :param InlineAlgoQueueProcessor algorithm: The algorithm, without its server state.
+    :param multiprocessing.Queue warm_up_queue: Receives the number of synthetic tiles
+        processed by the worker and the error its warm-up raised, if any.
+    '''
+    global _WORKER_ALGORITHM # pylint: disable=global-statement
+    _WORKER_ALGORITHM = algorithm
+    _WORKER_ALGORITHM.on_server_start()
+    try:
+        warm_up_queue.put((warm_up(algorithm), None))
+    except Exception as e: # pylint: disable=broad-exception-caught
+        warm_up_queue.put((0, repr(e)))
+
+
+def warm_up(algorithm):
+    '''
+    Runs the synthetic tiles returned by `get_warm_up_tiles` through `process_batch`, in
+    batches of `batch_size`, or through `process`, discarding their results.
+
+    :param InlineAlgoQueueProcessor algorithm: The algorithm to warm up.
+
+    :return: The number of synthetic tiles processed.
+    :rtype: int
+    '''
+    messages = warm_up_messages(algorithm.get_warm_up_tiles())
+    batch_size = max(algorithm.config.batch_size, 1)
+    for start in range(0, len(messages), batch_size):
+        run_process(algorithm, messages[start:start + batch_size])
+    return len(messages)
+
+
+def _process_tiles(algorithm, messages):
+    if algorithm.config.batch_size <= 1:
+        return [algorithm.process(message) for message in messages]
+    return algorithm.process_batch(messages)
+
+
+def run_process(algorithm, messages, profiler=None):
+    '''
+    Runs `process_batch` on a batch of tiles, or `process` when batching is disabled.
+
+    :param InlineAlgoQueueProcessor algorithm: The algorithm to run.
+    :param list messages: The ScanOngoing messages of the batch.
+    :param ProcessProfiler profiler: Profiles the call when it is sampled, if given.
+
+    :return: One result per message, in the same order, and the timing of the call: its
+        `time.perf_counter` start time, its duration in seconds, and the process and
+        thread that ran it.
+    :rtype: tuple
+    :raises ValueError: If `process_batch` does not return one result per message.
+    '''
+    start_time = time.perf_counter()
+    if profiler is None:
+        batch_results = _process_tiles(algorithm, messages)
+    else:
+        batch_results = profiler.run(_process_tiles, algorithm, messages)
+    duration = time.perf_counter() - start_time
+    if len(batch_results) != len(messages):
+        raise ValueError(
+            f"process_batch returned {len(batch_results)} results "
+            f"for {len(messages)} tiles"
+        )
+    return batch_results, (start_time, duration, os.getpid(), get_ident())
+
+
+def _run_process_in_worker(messages):
+    return run_process(_WORKER_ALGORITHM, messages)
+
+
+class WorkerPool:
+    '''
+    Processes batches of tiles in a pool of threads or processes, and hands their results
+    back in the order the batches were submitted, on a completion thread, so that results
+    stay consistent with a serial run. A scan end is only handed back once every batch
+    submitted before it has finished, hence /v1/algorithm-completed is never sent while
+    tiles of that slide are still in flight. The batches of aborted scans are waited for,
+    so that their tiles can be released, and discarded.
+
+    :param InlineAlgoQueueProcessor algorithm: The algorithm, pickled to every worker in
+        process mode.
+    :param int num_workers: The number of batches processed at the same time.
+    :param str worker_mode: "thread" or "process", see ProcessorConfig.
+    :param ProcessProfiler profiler: Profiles the calls of a thread pool, if given.
+    '''
+
+    def __init__(self, algorithm, num_workers, worker_mode="thread", profiler=None):
+        self.algorithm = algorithm
+        self.num_workers = num_workers
+        self.worker_mode = worker_mode
+        self.profiler = profiler
+
+        self.__executor = None
+        # Work handed to the pool, in submission order, waiting for its results.
+        self.__completion_queue = Queue(maxsize=2 * max(num_workers, 1))
+        # Receives the warm-up outcome of every worker process, in process mode.
+        self.__warm_up_queue = None
+        self.__post_results = None
+        self.__complete_scan = None
+        self.__release_tiles = None
+        self.__error_event = None
+
+    def start(self, post_results, complete_scan, release_tiles, error_event):
+        '''
+        Creates the pool and starts the completion thread.
+
+        :param callable post_results: Called with the session, the tiles of a batch, the
+            results of every tile and the timing of `process`, see `run_process`.
+        :param callable complete_scan: Called with the session and the ScanEnd message of
+            an ended scan.
+        :param callable release_tiles: Called with the tiles of a batch of an aborted scan.
+        :param threading.Event error_event: Set when the completion thread stops on an
+            error, such as an exception raised by `process`.
+        '''
+        self.__post_results = post_results
+        self.__complete_scan = complete_scan
+        self.__release_tiles = release_tiles
+        self.__error_event = error_event
+        if self.worker_mode == "process":
+            context = multiprocessing.get_context("spawn")
+            self.__warm_up_queue = context.Queue()
+            self.__executor = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(self.algorithm, self.__warm_up_queue),
+            )
+        else:
+            self.__executor = ThreadPoolExecutor(
+                max_workers=self.num_workers,
+                thread_name_prefix="inline-algorithm-worker",
+            )
+        Thread(target=self.completion_loop, daemon=True).start()
+
+    def shutdown(self):
+        '''
+        Cancels the batches not started yet and stops the pool without waiting for it.
+        '''
+        self.__executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, session, batch, missed=None, cached_results=None):
+        '''
+        Hands a batch to the pool, waiting while `2 * num_workers` batches are in flight.
+
+        :param ScanSession session: The session of the slide.
+        :param list batch: The tiles of the batch.
+        :param list missed: The tiles of the batch to process, if only some of them are,
+            e.g. the ones not found in the result cache.
+        :param list cached_results: The results of the tiles of the batch that are not
+            processed, or MISS, see `combine_results`.
+        '''
+        missed = batch if missed is None else missed
+        if not missed:
+            future = Future()
+            future.set_result(([], None))
+        elif self.worker_mode == "process":
+            # Futures cannot be pickled, hand the prefetched pixels to the worker.
+            # Raw tiles are pickled as a handle to the shared memory.
+            for tile in missed:
+                tile.resolve_tile_image()
+            future = self.__executor.submit(_run_process_in_worker, missed)
+        else:
+            future = self.__executor.submit(run_process, self.algorithm, missed, self.profiler)
+        self.__completion_queue.put((session, batch, future, cached_results))
+
+    def end_scan(self, session, message):
+        '''
+        Hands a ScanEnd back once every batch submitted before it has finished.
+
+        :param ScanSession session: The session of the ended scan.
+        :param ScanEnd message: The ScanEnd message.
+        '''
+        self.__completion_queue.put((session, message, None, None))
+
+    def cancel(self, session):
+        '''
+        Cancels the batches of a slide not started by the pool yet.
+
+        :param ScanSession session: The session of the aborted scan.
+        '''
+        with self.__completion_queue.mutex:
+            futures = [
+                future for queued_session, _, future, _ in self.__completion_queue.queue
+                if queued_session is session and future is not None
+            ]
+        for future in futures:
+            future.cancel()
+
+    def wait_for_workers(self):
+        '''
+        Starts every worker process, which are otherwise started one by one as tiles are
+        submitted, and waits until all of them have loaded their model and warmed up.
+
+        :return: The number of synthetic tiles processed by the workers.
+        :rtype: int
+        :raises RuntimeError: If the warm-up of a worker raised.
+        :raises BrokenProcessPool: If a worker died, e.g. in `on_server_start`.
+        '''
+        # A new worker is started by every submit while none of them is idle.
+        probes = [self.__executor.submit(os.getpid) for _ in range(self.num_workers)]
+        tiles = 0
+        for _ in range(self.num_workers):
+            while True:
+                try:
+                    worker_tiles, error = self.__warm_up_queue.get(timeout=0.1)
+                    break
+                except Empty:
+                    for probe in probes:
+                        if probe.done():
+                            probe.result()
+            if error is not None:
+                raise RuntimeError(f"The warm-up of a worker process failed: {error}")
+            tiles += worker_tiles
+        return tiles
+
+    def completion_loop(self):
+        '''
+        Hands back the results of the pool in submission order, until an exception occurs,
+        setting the error event if an exception is raised.
+
+        :raises BaseException: Any exception encountered during the loop execution,
+            including the exceptions raised by `process`.
+        '''
+        try:
+            while True:
+                session, payload, future, cached_results = self.__completion_queue.get()
+                if future is None:
+                    self.__complete_scan(session, payload)
+                elif session.aborted:
+                    wait([future])
+                    self.__release_tiles(payload)
+                else:
+                    batch_results, timing = future.result()
+                    self.__post_results(
+                        session, payload, combine_results(cached_results, batch_results),
+                        timing,
+                    )
+
+        except BaseException as e:
+            self.__error_event.set()
+            raise e
@@ -0,0 +1,69 @@
+'''
+Tests of the cross-tile merging of detections.
+'''
+from inline_algorithm.detection_merge import DetectionMerger, TileKey
+from inline_algorithm.models import ScanOngoing
+
+TILE_SIZE = 100
+
+
+def _tile(row_idx, col_idx, tile_name=None):
+    return ScanOngoing(
+        slide_name="slide",
+        tile_name=tile_name or f"tile_{row_idx}_{col_idx}",
+        tile_image_path="",
+        row_idx=row_idx,
+        col_idx=col_idx,
+    )
+
+
+def _detection(x1, y1, x2, y2, confidence=0.9):
+    return {"bbox": [x1, y1, x2, y2], "confidence": confidence, "class": "cell"}
+
+
+def _posted(emitted):
+    return {key.tile_name: results for key, results in emitted}
+
+
+def test_duplicate_tile_is_not_dropped():
+    merger = DetectionMerger(TILE_SIZE, TILE_SIZE, max_wait=60)
+    assert merger.add(_tile(0, 0), [_detection(10, 10, 20, 20)]) == []
+    emitted = merger.add(
+        _tile(0, 0, "tile_0_0_again"), [_detection(10, 10, 20, 20), _detection(50, 50, 60, 60)]
+    )
+    posted = _posted(emitted)
+    assert posted == {"tile_0_0": [_detection(10, 10, 20, 20)]}
+    posted.update(_posted(merger.flush()))
+    # The detection sent twice is posted once, the new one is kept.
+    assert posted["tile_0_0_again"] == [_detection(50, 50, 60, 60)]
+    assert merger.suppressed == 1
+    assert merger.pending() == 0
+
+
+def test_overlapping_stride_in_pixels():
+    # Tiles of 100 pixels every 60 pixels: the tiles at 0 and 60 both fall in cell 0.
+    merger = DetectionMerger(TILE_SIZE, TILE_SIZE, tile_index_units="pixels", max_wait=60)
+    posted = {}
+    # An object at x 70-90 of the slide, seen by the first two tiles.
+    posted.update(_posted(merger.add(_tile(0, 0), [_detection(70, 10, 90, 30, 0.8)])))
+    posted.update(_posted(merger.add(
+        _tile(0, 60), [_detection(10, 10, 30, 30, 0.9), _detection(70, 50, 90, 70, 0.5)]
+    )))
+    # An object at x 130-150, seen by the last two tiles away from their borders.
+    posted.update(_posted(merger.add(_tile(0, 120), [_detection(10, 50, 30, 70, 0.9)])))
+    posted.update(_posted(merger.flush()))
+    assert set(posted) == {"tile_0_0", "tile_0_60", "tile_0_120"}
+    assert posted["tile_0_0"] == []
+    # Boxes are returned in the coordinates of their own tile.
+    assert posted["tile_0_60"] == [_detection(10, 10, 30, 30, 0.9)]
+    assert posted["tile_0_120"] == [_detection(10, 50, 30, 70, 0.9)]
+    assert merger.suppressed == 2
+
+
+def test_buffered_tiles_do_not_keep_the_message():
+    merger = DetectionMerger(TILE_SIZE, TILE_SIZE, max_wait=60)
+    message = _tile(0, 0)
+    message.attach_tile_image(bytearray(1024))
+    merger.add(message, [_detection(10, 10, 20, 20)])
+    (key, _), = merger.flush()
+    assert key == TileKey("slide", "tile_0_0", 0, 0)
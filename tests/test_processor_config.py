@@ -0,0 +1,47 @@
+'''
+Tests of the options of the InlineAlgoQueueProcessor pipeline.
+'''
+import pytest
+
+from inline_algorithm.inline_algo_queue_processor import InlineAlgoQueueProcessor
+from inline_algorithm.processor_config import ProcessorConfig
+
+
+class _Algorithm(InlineAlgoQueueProcessor):
+    def process(self, message):
+        return []
+
+
+@pytest.mark.parametrize("option", [
+    {"worker_mode": "fork"},
+    {"tile_index_units": "microns"},
+    {"queue_full_policy": "wait"},
+])
+def test_config_rejects_unknown_values(option):
+    with pytest.raises(ValueError):
+        ProcessorConfig(**option)
+
+
+def test_keyword_options_override_the_config():
+    config = ProcessorConfig(num_workers=2, batch_size=4)
+    algorithm = _Algorithm(8000, "localhost", docker_mode=False, config=config, batch_size=8)
+    assert algorithm.config == ProcessorConfig(num_workers=2, batch_size=8)
+    assert config.batch_size == 4
+
+
+def test_unknown_option_is_rejected():
+    with pytest.raises(TypeError):
+        _Algorithm(8000, "localhost", docker_mode=False, num_worker=2)
+
+
+def test_async_processor_takes_the_config():
+    pytest.importorskip("httpx")
+    from inline_algorithm.async_inline_algo_queue_processor import AsyncInlineAlgoQueueProcessor
+    algorithm = AsyncInlineAlgoQueueProcessor(
+        8000, "localhost", docker_mode=False, config=ProcessorConfig(batch_size=4),
+        max_concurrency=2,
+    )
+    assert algorithm.config == ProcessorConfig(batch_size=4, max_concurrency=2)
+    assert AsyncInlineAlgoQueueProcessor(8000, "localhost").config.sender_connections == 8
+    with pytest.raises(TypeError):
+        AsyncInlineAlgoQueueProcessor(8000, "localhost", concurrency=2)
@@ -0,0 +1,69 @@
+'''
+Tests of the cache of tile results keyed by the content of the tiles.
+'''
+import pickle
+
+import numpy as np
+
+from inline_algorithm.models import ScanOngoing
+from inline_algorithm.result_cache import DISK_SUFFIX, MISS, TileResultCache
+
+
+def _tile(value):
+    # A raw tile, hashed from its pixels.
+    message = ScanOngoing(
+        slide_name="slide", tile_name=f"tile_{value}", tile_image_path="",
+        row_idx=0, col_idx=value,
+    )
+    message.attach_tile_image(np.full((4, 4, 3), value, dtype=np.uint8))
+    return message
+
+
+def _results(value):
+    return [[0, 0, 1, 1, value / 10, "cell"]]
+
+
+def _process(cache, value):
+    message = _tile(value)
+    model_results = cache.lookup(message)
+    if model_results is MISS:
+        cache.store(message, _results(value))
+    return model_results
+
+
+def test_memory_evicts_the_least_recently_used_results():
+    cache = TileResultCache(max_entries=2)
+    for value in (1, 2):
+        assert _process(cache, value) is MISS
+    assert _process(cache, 1) == _results(1)
+    assert _process(cache, 3) is MISS
+    assert _process(cache, 2) is MISS
+    assert _process(cache, 3) == _results(3)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 4, 2)
+
+
+def test_disk_evicts_the_least_recently_used_files(tmp_path):
+    size = len(pickle.dumps(_results(1), protocol=pickle.HIGHEST_PROTOCOL))
+    cache = TileResultCache(max_entries=1, disk_path=str(tmp_path), max_disk_bytes=2 * size)
+    for value in (1, 2):
+        assert _process(cache, value) is MISS
+    assert _process(cache, 1) == _results(1)
+    assert _process(cache, 3) is MISS
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["disk_entries"], stats["disk_bytes"]) == (1, 2, 2 * size)
+    assert len(list(tmp_path.glob("*" + DISK_SUFFIX))) == 2
+
+    reopened = TileResultCache(max_entries=1, disk_path=str(tmp_path), max_disk_bytes=2 * size)
+    assert reopened.stats()["disk_entries"] == 2
+    assert _process(reopened, 1) == _results(1)
+    assert _process(reopened, 3) == _results(3)
+    assert _process(reopened, 2) is MISS
+    assert reopened.stats()["disk_hits"] == 2
+
+
+def test_model_version_is_part_of_the_key():
+    cache = TileResultCache(model_version="1")
+    assert _process(cache, 1) is MISS
+    assert _process(cache, 1) == _results(1)
+    assert _process(TileResultCache(model_version="2"), 1) is MISS
@@ -0,0 +1,86 @@
+'''
+Tests of the background sender posting messages to the scanner.
+'''
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+from inline_algorithm.result_sender import ResultSender
+
+
+class _Scanner(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    received = []
+    lock = Lock()
+    delay = 0
+
+    def do_POST(self): # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.delay)
+        with self.lock:
+            self.received.append(self.path)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args): # pylint: disable=arguments-differ
+        pass
+
+
+def test_barrier_waits_for_messages_dequeued_by_other_threads():
+    server = ThreadingHTTPServer(("localhost", 0), _Scanner)
+    Thread(target=server.serve_forever, daemon=True).start()
+    sender = ResultSender(f"http://localhost:{server.server_port}", num_connections=4)
+    queue = sender._ResultSender__queue # pylint: disable=protected-access
+    dequeue = queue.get
+
+    def slow_dequeue(*args, **kwargs):
+        # Widens the window between dequeuing a tile and posting it.
+        item = dequeue(*args, **kwargs)
+        if item is not None and not item[3]:
+            time.sleep(0.005)
+        return item
+
+    queue.get = slow_dequeue
+    sender.start()
+    try:
+        for _ in range(20):
+            _Scanner.received.clear()
+            sender.send("/v1/tile-results", json.dumps({}))
+            sender.send("/v1/algorithm-completed", json.dumps({}), barrier=True)
+            sender.join()
+            assert _Scanner.received == ["/v1/tile-results", "/v1/algorithm-completed"]
+    finally:
+        sender.stop()
+        server.shutdown()
+
+
+def test_full_queue_never_drops_barriers_or_batches():
+    server = ThreadingHTTPServer(("localhost", 0), _Scanner)
+    Thread(target=server.serve_forever, daemon=True).start()
+    _Scanner.received.clear()
+    _Scanner.delay = 0.05
+    sender = ResultSender(
+        f"http://localhost:{server.server_port}",
+        max_queue_size=1,
+        enqueue_timeout=0.01,
+        batch_max_messages=2,
+    )
+    sender.start()
+    try:
+        for _ in range(4):
+            sender.send("/v1/tile-results", json.dumps({}))
+        for _ in range(4):
+            sender.send("/v1/tile-results", json.dumps({}), batch_key="slide")
+        assert sender.send("/v1/algorithm-completed", json.dumps({}), barrier=True)
+        sender.join()
+        stats = sender.stats()
+        assert stats["dropped"] > 0
+        assert stats["batches"] == 2
+        assert _Scanner.received.count("/v1/tile-results/batch") == 2
+        assert _Scanner.received[-1] == "/v1/algorithm-completed"
+    finally:
+        _Scanner.delay = 0
+        sender.stop()
+        server.shutdown()
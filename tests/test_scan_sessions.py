@@ -0,0 +1,77 @@
+'''
+Tests of the scheduler interleaving the messages of the slides being scanned.
+'''
+from inline_algorithm.models import ScanStart, ScanOngoing, ScanEnd, ScanAbort
+from inline_algorithm.scan_sessions import SessionScheduler
+
+
+def _start(slide_name):
+    return ScanStart(
+        algorithm_id="algorithm", slide_name=slide_name, stain_name="stain",
+        organ_name="organ", tile_width=1, tile_height=1, path_to_output="output",
+    )
+
+
+def _tile(slide_name, index):
+    return ScanOngoing(
+        slide_name=slide_name, tile_name=f"tile_{index}", tile_image_path="",
+        row_idx=0, col_idx=index,
+    )
+
+
+def _drain(scheduler):
+    messages = []
+    while True:
+        _, message = scheduler.get(timeout=0)
+        if message is None:
+            return messages
+        messages.append(message)
+
+
+def _names(messages):
+    return [(type(message).__name__, message.slide_name) for message in messages]
+
+
+def test_slides_are_served_in_turn():
+    scheduler = SessionScheduler()
+    for index in range(3):
+        scheduler.put(_tile("a", index))
+    for index in range(2):
+        scheduler.put(_tile("b", index))
+    messages = _drain(scheduler)
+    assert [(message.slide_name, message.col_idx) for message in messages] == [
+        ("a", 0), ("b", 0), ("a", 1), ("b", 1), ("a", 2),
+    ]
+    assert scheduler.qsize() == 0
+
+
+def test_control_messages_jump_ahead_of_tiles():
+    scheduler = SessionScheduler()
+    scheduler.put(_tile("a", 0))
+    scheduler.put(_tile("a", 1))
+    scheduler.put(_start("b"))
+    scheduler.put(_tile("b", 0))
+    scheduler.put(ScanEnd(slide_name="b"))
+    assert _names(_drain(scheduler)) == [
+        ("ScanStart", "b"), ("ScanOngoing", "a"), ("ScanOngoing", "b"),
+        ("ScanEnd", "b"), ("ScanOngoing", "a"),
+    ]
+
+
+def test_abort_drops_the_queued_tiles_of_the_slide():
+    scheduler = SessionScheduler()
+    scheduler.put(_start("a"))
+    for index in range(3):
+        scheduler.put(_tile("a", index))
+        scheduler.put(_tile("b", index))
+    scheduler.put(ScanEnd(slide_name="a"))
+    session, dropped = scheduler.abort(ScanAbort(slide_name="a"))
+    assert session.aborted
+    assert [message.col_idx for message in dropped] == [0, 1, 2]
+    assert session.tiles_cancelled == 3
+    assert scheduler.qsize() == 5
+    assert _names(_drain(scheduler)) == [
+        ("ScanStart", "a"), ("ScanAbort", "a"),
+        ("ScanOngoing", "b"), ("ScanOngoing", "b"), ("ScanOngoing", "b"),
+    ]
+    assert scheduler.get_session("a") is None
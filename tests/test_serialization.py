@@ -0,0 +1,57 @@
+'''
+Tests of the serialization of tile results.
+'''
+import json
+
+import numpy as np
+import pytest
+
+from inline_algorithm.detections import ColumnarDetections
+from inline_algorithm.models import ScanOngoing
+from inline_algorithm.serialization import serialize_tile_results
+
+MESSAGE = ScanOngoing(
+    slide_name="slide", tile_name="tile_1_2", tile_image_path="", row_idx=1, col_idx=2
+)
+DETECTIONS = [
+    {"bbox": [1.0, 2.0, 3.0, 4.0], "confidence": 0.9, "class": "cell"},
+    {"bbox": [5.0, 6.0, 7.0, 8.0], "confidence": 0.5, "class": "nucleus"},
+]
+
+
+def _serialize(model_results, trusted=False):
+    return json.loads(serialize_tile_results("algorithm", MESSAGE, model_results, trusted))
+
+
+def test_trusted_results_have_the_validated_schema():
+    validated = _serialize(DETECTIONS)
+    assert validated["results"]["detection_array"][0]["scan_at_other_mag"] is None
+    assert _serialize(DETECTIONS, trusted=True) == validated
+    columnar = ColumnarDetections(
+        np.array([detection["bbox"] for detection in DETECTIONS]),
+        np.array([0.9, 0.5]),
+        np.array([0, 1]),
+        ["cell", "nucleus"],
+    )
+    assert _serialize(columnar) == validated
+
+
+@pytest.mark.parametrize("class_ids", [[0, 2], [-1, 0]])
+def test_class_ids_out_of_range(class_ids):
+    with pytest.raises(ValueError):
+        ColumnarDetections(np.zeros((2, 4)), np.zeros(2), np.array(class_ids), ["a", "b"])
+
+
+@pytest.mark.parametrize("k, scores", [
+    (0, []),
+    (-1, []),
+    (2, [0.9, 0.7]),
+    (5, [0.9, 0.7, 0.5, 0.1]),
+])
+def test_top_k(k, scores):
+    detections = ColumnarDetections(
+        np.zeros((4, 4)), np.array([0.5, 0.9, 0.1, 0.7]), np.zeros(4, dtype=int), ["cell"]
+    )
+    top = detections.top_k(k)
+    assert top.scores.tolist() == scores
+    assert len(top.to_detection_array()) == len(scores)
@@ -0,0 +1,64 @@
+'''
+Tests of the shared memory ring buffer holding the pixels of raw tile uploads.
+'''
+import numpy as np
+
+from inline_algorithm.models import ScanOngoing
+from inline_algorithm.tile_buffer import ALIGNMENT, SharedTileRing
+
+SHAPE = (ALIGNMENT // 8, 8) # The tiles take one aligned slot each.
+
+
+def _tile(index):
+    return ScanOngoing(
+        slide_name="slide", tile_name=f"tile_{index}", tile_image_path="",
+        row_idx=0, col_idx=index,
+    )
+
+
+def _allocate(ring, message):
+    shared_tile = ring.allocate(message, SHAPE, "uint8")
+    return None if shared_tile is None else shared_tile.offset
+
+
+def test_allocations_wrap_around_once_the_oldest_are_released():
+    ring = SharedTileRing(4 * ALIGNMENT)
+    messages = [_tile(index) for index in range(6)]
+    try:
+        assert [_allocate(ring, message) for message in messages[:3]] == [
+            0, ALIGNMENT, 2 * ALIGNMENT,
+        ]
+        ring.release(messages[0])
+        assert _allocate(ring, messages[3]) == 3 * ALIGNMENT
+        assert _allocate(ring, messages[4]) == 0
+        assert ring.stats() == {"tiles": 4, "bytes": 4 * ALIGNMENT, "capacity": 4 * ALIGNMENT}
+        assert _allocate(ring, messages[5]) is None
+
+        shared_tile = ring.allocate(_tile(6), (4 * ALIGNMENT + 1,), "uint8")
+        assert shared_tile is None
+    finally:
+        ring.close()
+
+
+def test_tiles_released_out_of_order_are_reclaimed_with_the_older_ones():
+    ring = SharedTileRing(4 * ALIGNMENT)
+    messages = [_tile(index) for index in range(5)]
+    try:
+        for message in messages[:4]:
+            shared_tile = ring.allocate(message, SHAPE, "uint8")
+            buffer = shared_tile.buffer()
+            buffer[:] = bytes([message.col_idx]) * shared_tile.nbytes
+            buffer.release()
+            message.attach_tile_image(shared_tile)
+        ring.release(messages[2])
+        ring.release(messages[1])
+        assert ring.stats() == {"tiles": 2, "bytes": 4 * ALIGNMENT, "capacity": 4 * ALIGNMENT}
+        assert _allocate(ring, messages[4]) is None
+        assert np.all(messages[3].tile_image == 3)
+
+        ring.release(messages[0])
+        assert ring.stats() == {"tiles": 1, "bytes": ALIGNMENT, "capacity": 4 * ALIGNMENT}
+        assert _allocate(ring, messages[4]) == 0
+        assert np.all(messages[3].tile_image == 3)
+    finally:
+        ring.close()
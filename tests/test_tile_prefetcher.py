@@ -0,0 +1,76 @@
+'''
+Tests of the reader pool loading tiles ahead of process().
+'''
+import time
+
+import numpy as np
+
+from inline_algorithm.models import ScanOngoing
+from inline_algorithm.tile_prefetcher import TilePrefetcher
+
+
+def _tile(index, nbytes=100):
+    # The path of the tile holds its size in bytes, see _read.
+    return ScanOngoing(
+        slide_name="slide", tile_name=f"tile_{index}", tile_image_path=str(nbytes),
+        row_idx=0, col_idx=index,
+    )
+
+
+def _read(tile_image_path):
+    return np.zeros(int(tile_image_path), dtype=np.uint8)
+
+
+def _wait_for(prefetcher, **expected):
+    # The prefetched bytes are counted by a callback of the read, just after it resolves.
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        stats = prefetcher.stats()
+        if all(stats[key] == value for key, value in expected.items()):
+            return
+        time.sleep(0.001)
+    assert prefetcher.stats() == expected
+
+
+def test_tiles_wait_for_a_slot_in_arrival_order():
+    prefetcher = TilePrefetcher(_read, max_tiles=2)
+    messages = [_tile(index) for index in range(4)]
+    try:
+        assert [prefetcher.submit(message) for message in messages] == [
+            True, True, False, False,
+        ]
+        _wait_for(prefetcher, tiles=2, bytes=200, waiting=2)
+        prefetcher.release(messages[1])
+        _wait_for(prefetcher, tiles=2, bytes=200, waiting=1)
+        assert messages[2].tile_image.nbytes == 100
+        prefetcher.dequeued(messages[3])
+        prefetcher.release(messages[0])
+        _wait_for(prefetcher, tiles=1, bytes=100, waiting=0)
+        prefetcher.release(messages[2])
+        prefetcher.release(messages[3])
+        _wait_for(prefetcher, tiles=0, bytes=0, waiting=0)
+    finally:
+        prefetcher.shutdown()
+
+
+def test_prefetched_bytes_bound_the_slots():
+    prefetcher = TilePrefetcher(_read, max_tiles=8, max_bytes=150)
+    messages = [_tile(0), _tile(1), _tile(2, nbytes=30), _tile(3)]
+    try:
+        assert prefetcher.submit(messages[0])
+        _wait_for(prefetcher, tiles=1, bytes=100, waiting=0)
+        assert prefetcher.submit(messages[1])
+        _wait_for(prefetcher, tiles=2, bytes=200, waiting=0)
+        assert not prefetcher.submit(messages[2])
+        assert not prefetcher.submit(messages[3])
+        # The size of a tile is only known once it is read, every waiting tile starts
+        # while the bytes held are under the limit.
+        prefetcher.release(messages[0])
+        _wait_for(prefetcher, tiles=3, bytes=230, waiting=0)
+        prefetcher.release(messages[1])
+        _wait_for(prefetcher, tiles=2, bytes=130, waiting=0)
+        prefetcher.release(messages[3])
+        prefetcher.release(messages[2])
+        _wait_for(prefetcher, tiles=0, bytes=0, waiting=0)
+    finally:
+        prefetcher.shutdown()
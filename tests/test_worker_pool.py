@@ -0,0 +1,71 @@
+'''
+Tests of the pool processing tiles outside of the handler thread.
+'''
+import random
+import time
+from queue import Queue
+from threading import Event
+from types import SimpleNamespace
+
+from inline_algorithm.processor_config import ProcessorConfig
+from inline_algorithm.worker_pool import WorkerPool
+
+
+class _Algorithm:
+    def __init__(self, batch_size=1):
+        self.config = ProcessorConfig(batch_size=batch_size)
+
+    def process(self, message):
+        time.sleep(random.uniform(0, 0.005))
+        return message.tile_name
+
+    def process_batch(self, messages):
+        return [self.process(message) for message in messages]
+
+
+def _session(slide_name):
+    return SimpleNamespace(slide_name=slide_name, aborted=False)
+
+
+def test_results_are_handed_back_in_submission_order():
+    handed_back = Queue()
+    error_event = Event()
+    pool = WorkerPool(_Algorithm(batch_size=2), num_workers=4)
+    pool.start(
+        lambda session, batch, results, timing: handed_back.put(results),
+        lambda session, message: handed_back.put(message),
+        lambda batch: None,
+        error_event,
+    )
+    try:
+        session = _session("slide")
+        tiles = [SimpleNamespace(tile_name=f"tile_{i}") for i in range(40)]
+        for start in range(0, len(tiles), 2):
+            pool.submit(session, tiles[start:start + 2])
+        pool.end_scan(session, "end")
+        results = []
+        while (item := handed_back.get(timeout=5)) != "end":
+            results.extend(item)
+        assert results == [tile.tile_name for tile in tiles]
+        assert not error_event.is_set()
+    finally:
+        pool.shutdown()
+
+
+def test_cached_results_are_combined_with_processed_ones():
+    handed_back = Queue()
+    pool = WorkerPool(_Algorithm(), num_workers=2)
+    pool.start(
+        lambda session, batch, results, timing: handed_back.put(results),
+        lambda session, message: None,
+        lambda batch: None,
+        Event(),
+    )
+    try:
+        session = _session("slide")
+        tiles = [SimpleNamespace(tile_name=f"tile_{i}") for i in range(3)]
+        pool.submit(session, tiles, missed=[], cached_results=["a", "b", "c"])
+        assert handed_back.get(timeout=5) == ["a", "b", "c"]
+    finally:
+        pool.shutdown()
+